@@ -48,20 +48,40 @@ def inspect():
             sample_cell = con.execute("SELECT cell_id FROM travel_times LIMIT 1").fetchone()[0]
             print(f"Sample Cell: {sample_cell}")
             
-            query = f"""
-                SELECT 
-                    m.station_id,
-                    c.title,
-                    c.max_kw, 
-                    min(m.time_min) as best_time_min, 
-                    min(m.distance_km) as best_dist_km
-                FROM travel_times m 
-                JOIN chg.chargers c ON m.station_id = c.station_id 
-                WHERE m.cell_id = '{sample_cell}' 
-                GROUP BY m.station_id, c.title, c.max_kw
-                ORDER BY best_time_min ASC 
-                LIMIT 10
-            """
+            has_topk = con.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = 'cell_topk'").fetchone()[0] > 0
+            if has_topk:
+                # Point lookup on the materialized top-k list (see src/build_cell_topk.py)
+                query = f"""
+                    SELECT 
+                        m.station_id,
+                        c.title,
+                        c.max_kw, 
+                        m.time_min as best_time_min, 
+                        m.distance_km as best_dist_km
+                    FROM (
+                        SELECT unnest(station_ids) as station_id, unnest(times_min) as time_min, unnest(distances_km) as distance_km
+                        FROM cell_topk
+                        WHERE cell_id = '{sample_cell}' AND slot = 0
+                    ) m
+                    JOIN chg.chargers c ON m.station_id = c.station_id 
+                    ORDER BY best_time_min ASC 
+                    LIMIT 10
+                """
+            else:
+                query = f"""
+                    SELECT 
+                        m.station_id,
+                        c.title,
+                        c.max_kw, 
+                        min(m.time_min) as best_time_min, 
+                        min(m.distance_km) as best_dist_km
+                    FROM travel_times m 
+                    JOIN chg.chargers c ON m.station_id = c.station_id 
+                    WHERE m.cell_id = '{sample_cell}' 
+                    GROUP BY m.station_id, c.title, c.max_kw
+                    ORDER BY best_time_min ASC 
+                    LIMIT 10
+                """
             print(con.execute(query).df().to_string(index=False))
         except Exception as e:
             print(f"Could not join with chargers.db: {e}")
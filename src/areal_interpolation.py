@@ -0,0 +1,135 @@
+"""
+Areal Interpolation (polygon layer -> 1km grid)
+
+For a polygon layer (CAOP municipalities, parishes, statistical sections...)
+the cell x polygon intersection areas are computed once and cached in
+data/cache/overlap_<name>.npz as a sparse matrix A (m^2). Any dataset keyed
+by that layer then maps onto the grid with one sparse product:
+
+- extensive (counts):     cell = sum_p V_p * A[c, p] / area_p
+- intensive (rates/means): cell = sum_p v_p * A[c, p] / sum_p A[c, p]  (polygons with data only)
+- primary:                cell = v_p of the polygon with the largest A[c, p]
+
+The cache is rebuilt when the source file or the grid changes.
+"""
+
+import duckdb
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+import pyogrio
+import os
+from scipy import sparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+CACHE_DIR = os.path.join(BASE_DIR, "../data/cache")
+
+CELL_SIZE_M = 1000
+
+def load_grid_cells(crs):
+    """grid_spine cells as 1km squares, reprojected to crs."""
+    con = duckdb.connect(DB_PATH)
+    grid = con.execute("SELECT cell_id, x_3035, y_3035 FROM grid_spine").df()
+    con.close()
+    return gpd.GeoDataFrame(
+        grid[['cell_id']],
+        geometry=shapely.box(grid['x_3035'], grid['y_3035'], grid['x_3035'] + CELL_SIZE_M, grid['y_3035'] + CELL_SIZE_M),
+        crs="EPSG:3035"
+    ).to_crs(crs)
+
+def cell_polygon_overlaps(cells, polygons):
+    """
+    (cell index, polygon index, overlap area) for every intersecting pair, in the
+    units of the layers' (shared) CRS. Cells lying fully inside a polygon skip the
+    polygon intersection.
+    """
+    cell_geoms = cells.geometry.values
+    poly_geoms = polygons.geometry.values
+    shapely.prepare(poly_geoms)
+
+    poly_idx, cell_idx = cells.sindex.query(poly_geoms, predicate='intersects')
+    inside = shapely.contains(poly_geoms[poly_idx], cell_geoms[cell_idx])
+
+    area = shapely.area(cell_geoms[cell_idx])
+    border = ~inside
+    area[border] = shapely.area(shapely.intersection(cell_geoms[cell_idx[border]], poly_geoms[poly_idx[border]]))
+    keep = area > 0
+    return cell_idx[keep], poly_idx[keep], area[keep]
+
+def load_overlap_weights(name, path, layer, key_col, force=False):
+    """
+    Cached overlap weights for one polygon layer. Returns a dict with
+    A (csr, n_cells x n_polygons, m^2), cell_ids, keys (polygon key_col values),
+    cell_area and poly_area.
+    Polygons sharing a key (multi-part areas) are merged into one column.
+    """
+    cache_path = os.path.join(CACHE_DIR, f"overlap_{name}.npz")
+    stat = os.stat(path)
+    con = duckdb.connect(DB_PATH)
+    n_cells = con.execute("SELECT count(*) FROM grid_spine").fetchone()[0]
+    con.close()
+
+    if not force and os.path.exists(cache_path):
+        z = np.load(cache_path)
+        if z['src_size'] == stat.st_size and z['src_mtime'] == stat.st_mtime and len(z['cell_ids']) == n_cells:
+            return {
+                'A': sparse.csr_matrix((z['data'], z['indices'], z['indptr']), shape=tuple(z['shape'])),
+                'cell_ids': z['cell_ids'],
+                'keys': z['keys'],
+                'cell_area': z['cell_area'],
+                'poly_area': z['poly_area'],
+            }
+
+    print(f"Building overlap weights for {name} ({path}, layer {layer})...")
+    polygons = pyogrio.read_dataframe(path, layer=layer, columns=[key_col])
+    polygons[key_col] = polygons[key_col].astype(str).str.strip()
+    cells = load_grid_cells(polygons.crs)
+
+    key_codes, keys = pd.factorize(polygons[key_col])
+    cell_idx, poly_idx, area = cell_polygon_overlaps(cells, polygons)
+    A = sparse.csr_matrix((area, (cell_idx, key_codes[poly_idx])), shape=(len(cells), len(keys))) # duplicates summed
+    poly_area = np.bincount(key_codes, weights=shapely.area(polygons.geometry.values), minlength=len(keys))
+    cell_area = shapely.area(cells.geometry.values)
+    cell_ids = cells['cell_id'].to_numpy().astype(str)
+    keys = np.asarray(keys, dtype=str)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, data=A.data, indices=A.indices, indptr=A.indptr, shape=np.array(A.shape),
+             cell_ids=cell_ids, keys=keys, cell_area=cell_area, poly_area=poly_area,
+             src_size=stat.st_size, src_mtime=stat.st_mtime)
+    os.replace(tmp_path, cache_path)
+    print(f"Cached {A.nnz} cell-polygon overlaps to {cache_path}")
+    return {'A': A, 'cell_ids': cell_ids, 'keys': keys, 'cell_area': cell_area, 'poly_area': poly_area}
+
+def _aligned(weights, values):
+    # values: DataFrame indexed by polygon key -> (n_polygons x n_columns) float array
+    return values.reindex(pd.Index(weights['keys'])).to_numpy(dtype=float)
+
+def interpolate_extensive(weights, values):
+    """Distributes polygon totals to cells by area share. values: DataFrame indexed by key."""
+    V = _aligned(weights, values)
+    known = ~np.isnan(V)
+    share = weights['A'] @ sparse.diags(1.0 / np.where(weights['poly_area'] > 0, weights['poly_area'], np.inf))
+    out = share @ np.where(known, V, 0.0)
+    # NaN where no overlapping polygon has a value
+    out[(weights['A'] @ known.astype(float)) == 0] = np.nan
+    return pd.DataFrame(out, index=pd.Index(weights['cell_ids'], name='cell_id'), columns=values.columns)
+
+def interpolate_intensive(weights, values):
+    """Area-weighted mean of polygon values over each cell (polygons without a value are ignored)."""
+    V = _aligned(weights, values)
+    known = ~np.isnan(V)
+    num = weights['A'] @ np.where(known, V, 0.0)
+    den = weights['A'] @ known.astype(float)
+    out = np.divide(num, den, out=np.full(num.shape, np.nan), where=den > 0)
+    return pd.DataFrame(out, index=pd.Index(weights['cell_ids'], name='cell_id'), columns=values.columns)
+
+def interpolate_primary(weights, values):
+    """Each cell takes the values of the polygon covering most of its area (NaN outside every polygon)."""
+    A = weights['A']
+    out = _aligned(weights, values)[np.asarray(A.argmax(axis=1)).ravel()]
+    out[np.diff(A.indptr) == 0] = np.nan
+    return pd.DataFrame(out, index=pd.Index(weights['cell_ids'], name='cell_id'), columns=values.columns)
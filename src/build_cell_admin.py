@@ -0,0 +1,97 @@
+"""
+Cell -> Administrative Area Lookup (CAOP)
+
+Derives, from the cached cell x parish overlap weights (see
+areal_interpolation.py), the `cell_admin` table in osm_analysis.db:
+
+    cell_id | level | code | name | overlap_frac | is_primary
+
+level is 'freguesia' (code = DTMNFR), 'municipio' (DTMN) or 'distrito' (DT).
+overlap_frac is the share of the cell's area inside the area (cells on a
+border get one row per area, coastal cells may sum to < 1); is_primary
+marks the area with the largest share. Municipal or parish datasets then
+attach to cells with a plain equi-join, e.g.
+
+    SELECT a.cell_id, i.* FROM cell_admin a JOIN income_muni i ON a.code = i.dicc
+    WHERE a.level = 'municipio' AND a.is_primary
+"""
+
+import duckdb
+import pandas as pd
+import pyogrio
+import os
+import sys
+from areal_interpolation import load_overlap_weights
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CAOP_GPKG = os.path.join(BASE_DIR, "../data/Continente_CAOP2024_1.gpkg")
+DB_PATH = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+
+PARISH_LAYER = 'cont_freguesias'
+# Overlaps below this share of a cell are digitizing slivers
+MIN_OVERLAP_FRAC = 1e-4
+
+# level -> (number of leading DTMNFR digits, CAOP name column)
+ADMIN_LEVELS = {
+    'distrito': (2, 'distrito_ilha'),
+    'municipio': (4, 'municipio'),
+    'freguesia': (6, 'freguesia'),
+}
+
+def load_parish_names():
+    fields = set(pyogrio.read_info(CAOP_GPKG, layer=PARISH_LAYER)['fields'])
+    columns = ['dtmnfr'] + [name for _, name in ADMIN_LEVELS.values() if name in fields]
+    parishes = pyogrio.read_dataframe(CAOP_GPKG, layer=PARISH_LAYER, columns=columns, read_geometry=False)
+    parishes['dtmnfr'] = parishes['dtmnfr'].astype(str).str.strip()
+    return parishes
+
+def build_cell_admin(force=False):
+    con = duckdb.connect(DB_PATH)
+    tables = set(con.execute("SELECT table_name FROM information_schema.tables").df()['table_name'])
+    if 'cell_admin' in tables and not force:
+        print("cell_admin already built (pass --force to rebuild).")
+        con.close()
+        return
+
+    print("--- 1. Cell x Parish Overlap Weights ---")
+    weights = load_overlap_weights('caop_freguesias', CAOP_GPKG, PARISH_LAYER, 'dtmnfr')
+    parishes = load_parish_names()
+    A = weights['A'].tocoo()
+    overlaps = pd.DataFrame({
+        'cell_id': weights['cell_ids'][A.row],
+        'dtmnfr': weights['keys'][A.col],
+        'overlap_frac': A.data / weights['cell_area'][A.row],
+    })
+    overlaps = overlaps[overlaps['overlap_frac'] >= MIN_OVERLAP_FRAC]
+    print(f"{len(overlaps)} cell-parish overlaps ({(overlaps['overlap_frac'] < 1).sum()} on borders).")
+
+    print("--- 2. Rolling Up Admin Levels ---")
+    levels = []
+    for level, (digits, name_col) in ADMIN_LEVELS.items():
+        part = overlaps.assign(code=overlaps['dtmnfr'].str[:digits]).groupby(['cell_id', 'code'], as_index=False)['overlap_frac'].sum()
+        part['overlap_frac'] = part['overlap_frac'].clip(upper=1.0)
+        part['level'] = level
+        if name_col in parishes:
+            names = parishes.assign(code=parishes['dtmnfr'].str[:digits]).drop_duplicates('code').set_index('code')[name_col]
+            part['name'] = part['code'].map(names)
+        else:
+            part['name'] = None
+        # Largest share wins; ties go to the lowest code
+        part = part.sort_values(['cell_id', 'overlap_frac', 'code'], ascending=[True, False, True])
+        part['is_primary'] = ~part.duplicated('cell_id')
+        levels.append(part)
+    cell_admin = pd.concat(levels, ignore_index=True)[['cell_id', 'level', 'code', 'name', 'overlap_frac', 'is_primary']]
+
+    print("--- 3. Saving cell_admin ---")
+    con.register("cell_admin_df", cell_admin)
+    con.execute("CREATE OR REPLACE TABLE cell_admin AS SELECT * FROM cell_admin_df ORDER BY level, code, cell_id")
+    con.execute("CREATE INDEX idx_cell_admin_code ON cell_admin (level, code)")
+    con.execute("CREATE INDEX idx_cell_admin_cell ON cell_admin (cell_id)")
+    counts = con.execute("SELECT level, count(DISTINCT code), count(DISTINCT cell_id) FROM cell_admin GROUP BY level ORDER BY level").fetchall()
+    con.close()
+    for level, n_codes, n_cells in counts:
+        print(f"  {level}: {n_codes} areas over {n_cells} cells")
+    print("Table in osm_analysis.db: cell_admin")
+
+if __name__ == "__main__":
+    build_cell_admin(force='--force' in sys.argv)
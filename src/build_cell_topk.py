@@ -0,0 +1,111 @@
+"""
+Cell Top-K Stations (Materialized Nearest-Station Lists)
+
+Keeps `cell_topk` in travel_matrix.db: for every (cell_id, slot) the TOPK fastest
+stations after origin reduction (best time over all origins of the cell), stored
+as fixed-width arrays so one cell's list is a single keyed row.
+
+calculate_travel_matrix.py updates the table incrementally as edges are added;
+run this script to rebuild it from an existing travel_times table.
+"""
+
+import duckdb
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MATRIX_DB = os.path.join(BASE_DIR, "../data/travel_matrix.db")
+
+TOPK = 10
+
+TOPK_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS cell_topk (
+        cell_id VARCHAR,
+        slot UTINYINT,
+        n_stations UTINYINT,
+        station_ids VARCHAR[{TOPK}],
+        times_min FLOAT[{TOPK}],
+        distances_km FLOAT[{TOPK}],
+        PRIMARY KEY (cell_id, slot)
+    )
+"""
+
+def _topk_select(source_sql):
+    # Arrays shorter than TOPK are padded with NULLs
+    return f"""
+        WITH best AS (
+            SELECT cell_id, slot, station_id,
+                   min(time_min) as time_min,
+                   arg_min(distance_km, time_min) as distance_km
+            FROM ({source_sql})
+            WHERE station_id IS NOT NULL
+            GROUP BY cell_id, slot, station_id
+        ),
+        ranked AS (
+            SELECT *, row_number() OVER (PARTITION BY cell_id, slot ORDER BY time_min, station_id) as rk
+            FROM best
+            QUALIFY rk <= {TOPK}
+        )
+        SELECT
+            cell_id,
+            slot::UTINYINT as slot,
+            count(*)::UTINYINT as n_stations,
+            list_resize(list(station_id ORDER BY rk), {TOPK})::VARCHAR[{TOPK}] as station_ids,
+            list_resize(list(time_min::FLOAT ORDER BY rk), {TOPK})::FLOAT[{TOPK}] as times_min,
+            list_resize(list(distance_km::FLOAT ORDER BY rk), {TOPK})::FLOAT[{TOPK}] as distances_km
+        FROM ranked
+        GROUP BY cell_id, slot
+    """
+
+def update_cell_topk(con, edges_df):
+    """
+    Merges new travel_times edges into cell_topk. Only the touched (cell_id, slot)
+    rows are recomputed: top-k of (old top-k + new edges) equals top-k of all edges.
+    """
+    con.execute(TOPK_SCHEMA)
+    con.register("tmp_topk_edges", edges_df[['cell_id', 'station_id', 'time_min', 'distance_km', 'slot']])
+    con.execute(f"""
+        INSERT OR REPLACE INTO cell_topk
+        {_topk_select(f'''
+            SELECT t.cell_id, t.slot,
+                   unnest(t.station_ids) as station_id,
+                   unnest(t.times_min)::DOUBLE as time_min,
+                   unnest(t.distances_km)::DOUBLE as distance_km
+            FROM cell_topk t
+            JOIN (SELECT DISTINCT cell_id, slot FROM tmp_topk_edges) touched
+              ON t.cell_id = touched.cell_id AND t.slot = touched.slot
+            UNION ALL
+            SELECT cell_id, slot, station_id, time_min, distance_km FROM tmp_topk_edges
+        ''')}
+    """)
+    con.unregister("tmp_topk_edges")
+
+def lookup_cell_topk(con, cell_id, slot=0):
+    """Point lookup of one cell's ranked stations as a DataFrame (station_id, time_min, distance_km)."""
+    return con.execute("""
+        SELECT unnest(station_ids) as station_id,
+               unnest(times_min) as time_min,
+               unnest(distances_km) as distance_km
+        FROM cell_topk
+        WHERE cell_id = ? AND slot = ?
+    """, [cell_id, slot]).df().dropna(subset=['station_id'])
+
+def build_cell_topk():
+    if not os.path.exists(MATRIX_DB):
+        print(f"Error: {MATRIX_DB} not found.")
+        return
+
+    con = duckdb.connect(MATRIX_DB)
+    print(f"--- Rebuilding cell_topk (k={TOPK}) from travel_times ---")
+    con.execute("DROP TABLE IF EXISTS cell_topk")
+    con.execute(TOPK_SCHEMA)
+    con.execute(f"""
+        INSERT INTO cell_topk
+        {_topk_select("SELECT cell_id, slot, station_id, time_min, distance_km FROM travel_times")}
+        ORDER BY cell_id, slot
+    """)
+    count = con.execute("SELECT count(*) FROM cell_topk").fetchone()[0]
+    print(f"Stored {count} (cell, slot) rows in cell_topk.")
+    con.close()
+
+if __name__ == "__main__":
+    build_cell_topk()
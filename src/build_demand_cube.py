@@ -0,0 +1,209 @@
+"""
+Mobi.E Demand Cube (station x day x time-of-day bin)
+
+Keeps the occupancy/energy timelines that process_mobie_data.py reduces to
+daily maxima, rolled up to BIN_MIN-minute bins and stored as NumPy memmaps
+in data/demand_cube/:
+
+- occupancy_peak.npy (uint8):  peak simultaneous sessions in the bin
+- stall_minutes.npy (uint16):  occupied stall-minutes (/ BIN_MIN = mean occupancy)
+- energy_dkwh.npy (uint16):    energy delivered, in 0.1 kWh
+
+Each array is (stations x days x bins); cube_meta.json holds the station
+order and first day. Load with `load_demand_cube()` and slice, e.g.
+cube['energy_dkwh'][i, :, 32:40] is station i's 08:00-10:00 energy per day.
+
+Hour-of-week profiles rolled up by station, operator, city and grid cell
+are saved as `demand_profiles` in mobie_data.db.
+"""
+
+import duckdb
+import pandas as pd
+import numpy as np
+import os
+import glob
+import json
+import shutil
+from ingest_mobie_sessions import load_fragments, fragments_path
+from process_session_logic import session_bounds, minute_intervals, occupancy_timelines, MINUTES_PER_DAY
+from run_metrics import track
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_GLOB = os.path.join(BASE_DIR, "../data/detailed-*.csv")
+DB_PATH = os.path.join(BASE_DIR, "../data/mobie_data.db")
+CUBE_DIR = os.path.join(BASE_DIR, "../data/demand_cube")
+
+# Must divide 1440; 1 keeps the full minute-level timelines
+BIN_MIN = 15
+ENERGY_SCALE = 10 # stored units per kWh
+
+CUBE_ARRAYS = {
+    'occupancy_peak': np.uint8,
+    'stall_minutes': np.uint16,
+    'energy_dkwh': np.uint16,
+}
+# demand_profiles levels: name -> stations column
+ROLLUP_LEVELS = {
+    'operator': 'OPERADOR',
+    'city': 'CIDADE',
+    'cell': 'cell_id',
+}
+
+def load_demand_cube(cube_dir=CUBE_DIR):
+    """Opens the cube read-only: {array name: memmap, 'stations': [...], 'days': DatetimeIndex, 'bin_min': int}."""
+    with open(os.path.join(cube_dir, "cube_meta.json")) as f:
+        meta = json.load(f)
+    cube = {name: np.load(os.path.join(cube_dir, f"{name}.npy"), mmap_mode='r') for name in meta['arrays']}
+    cube['stations'] = meta['stations']
+    cube['days'] = pd.date_range(meta['first_day'], periods=meta['n_days'], freq='D')
+    cube['bin_min'] = meta['bin_min']
+    return cube
+
+def _write_cube(stations, days, df, bounds):
+    n_stations, n_days, n_bins = len(stations), len(days), MINUTES_PER_DAY // BIN_MIN
+    tmp_dir = CUBE_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    cube = {
+        name: np.lib.format.open_memmap(os.path.join(tmp_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=(n_stations, n_days, n_bins))
+        for name, dtype in CUBE_ARRAYS.items()
+    }
+    # Flat (station * day) x bin views onto the same files
+    arrays = {name: arr.reshape(n_stations * n_days, n_bins) for name, arr in cube.items()}
+
+    # One cube row per (station, day): row = station * n_days + day
+    station_idx = pd.Index(stations).get_indexer(df['idChargingStation'])
+    day_start = pd.to_datetime(df['idDay'].astype(str), format='%Y%m%d')
+    row_idx = station_idx * n_days + (day_start - days[0]).dt.days.to_numpy()
+
+    b = df[['idCdr']].join(bounds, on='idCdr')
+    start_min, end_min, valid = minute_intervals(day_start, b['s_bound'], b['e_bound'])
+    energy = df['energia_total_periodo'].to_numpy(dtype=np.float64)
+    n_rows = n_stations * n_days
+
+    # A session occupies its station-day once, however many fragment rows it has there
+    # (as in session_stats.max_concurrent); energy keeps every fragment row
+    first = valid & ~df.duplicated(['idCdr', 'idChargingStation', 'idDay']).to_numpy()
+    occupancy = occupancy_timelines(row_idx[first], start_min[first], end_min[first], n_rows)
+    # Energy is spread evenly over the fragment's minutes in the day
+    rate = energy[valid] / (end_min[valid] - start_min[valid])
+    energy_tl = occupancy_timelines(row_idx[valid], start_min[valid], end_min[valid], n_rows, weights=rate)
+    for (lo, hi, occ), (_, _, kwh) in zip(occupancy, energy_tl):
+        occ = occ.reshape(hi - lo, n_bins, BIN_MIN)
+        arrays['occupancy_peak'][lo:hi] = np.minimum(occ.max(axis=2), np.iinfo(np.uint8).max)
+        arrays['stall_minutes'][lo:hi] = np.minimum(occ.sum(axis=2), np.iinfo(np.uint16).max)
+        kwh = kwh.reshape(hi - lo, n_bins, BIN_MIN).sum(axis=2)
+        # Sub-minute fragments keep their energy in the bin they started in
+        rest = ~valid & (row_idx >= lo) & (row_idx < hi)
+        np.add.at(kwh, (row_idx[rest] - lo, start_min[rest] // BIN_MIN), energy[rest])
+        arrays['energy_dkwh'][lo:hi] = np.clip(np.rint(kwh * ENERGY_SCALE), 0, np.iinfo(np.uint16).max)
+
+    for arr in cube.values():
+        arr.flush()
+    del cube, arrays
+
+    with open(os.path.join(tmp_dir, "cube_meta.json"), "w") as f:
+        json.dump({
+            'arrays': list(CUBE_ARRAYS),
+            'shape': [n_stations, n_days, n_bins],
+            'stations': list(stations),
+            'first_day': str(days[0].date()),
+            'n_days': n_days,
+            'bin_min': BIN_MIN,
+            'energy_scale': ENERGY_SCALE,
+        }, f, indent=2)
+    shutil.rmtree(CUBE_DIR, ignore_errors=True)
+    os.replace(tmp_dir, CUBE_DIR)
+
+def hour_of_week_profiles(cube, groups):
+    """
+    Hour-of-week rollup of the cube for one grouping of stations.
+    groups: array of group keys per cube station (None/NaN = excluded).
+    Returns rows (key, dow, hour, avg_kwh, avg_occupancy, peak_occupancy, n_stations, n_days);
+    dow 0 = Monday. peak_occupancy is the largest sum of the stations' bin peaks.
+    """
+    codes, keys = pd.factorize(pd.Series(groups, dtype=object))
+    n_days, n_bins = cube['energy_dkwh'].shape[1:]
+    per_hour = 60 // cube['bin_min']
+    dow = cube['days'].dayofweek.to_numpy()
+    dows = np.unique(dow)
+    # (dows x days) averaging weights
+    W = (dows[:, None] == dow[None, :]).astype(np.float64)
+    n_days_dow = W.sum(axis=1)
+    W /= n_days_dow[:, None]
+
+    def hourly(name, members, reduce):
+        total = cube[name][members].sum(axis=0, dtype=np.float64) # days x bins
+        return reduce(total.reshape(n_days, 24, per_hour), axis=2)
+
+    order = np.argsort(codes, kind='stable')
+    splits = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+    rows = []
+    for g, key in enumerate(keys):
+        members = order[splits[g]:splits[g + 1]]
+        kwh = hourly('energy_dkwh', members, np.sum) / ENERGY_SCALE
+        occ = hourly('stall_minutes', members, np.sum) / 60.0
+        peak = hourly('occupancy_peak', members, np.max)
+        rows.append(pd.DataFrame({
+            'key': key,
+            'dow': np.repeat(dows, 24),
+            'hour': np.tile(np.arange(24), len(dows)),
+            'avg_kwh': (W @ kwh).ravel(),
+            'avg_occupancy': (W @ occ).ravel(),
+            'peak_occupancy': np.stack([peak[dow == d].max(axis=0) for d in dows]).ravel().astype(int),
+            'n_stations': len(members),
+            'n_days': np.repeat(n_days_dow.astype(int), 24),
+        }))
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+
+def build_demand_cube():
+    csv_paths = sorted(glob.glob(CSV_GLOB))
+    parquets = [fragments_path(p) for p in csv_paths if os.path.exists(fragments_path(p))]
+    if not parquets or not os.path.exists(DB_PATH):
+        print("Missing input files. Run process_mobie_data.py first.")
+        return
+
+    print("--- 1. Loading Stations & Session Fragments ---")
+    con = duckdb.connect(DB_PATH)
+    meta = con.execute("SELECT * FROM stations").df().drop_duplicates('ID').set_index('ID')
+    df = load_fragments(parquets)
+    bounds = session_bounds(df)
+    df = df[df['idChargingStation'].isin(meta.index)]
+    if df.empty:
+        print("No sessions at known stations.")
+        con.close()
+        return
+
+    first, last = pd.to_datetime(df['idDay'].astype(str), format='%Y%m%d').agg(['min', 'max'])
+    days = pd.date_range(first, last, freq='D')
+    stations = meta.index
+    print(f"{len(df)} fragments over {len(stations)} stations x {len(days)} days.")
+
+    print(f"--- 2. Building {BIN_MIN}-minute Cube ---")
+    with track('demand_cube', 'timelines', rows_in=len(df)) as m:
+        _write_cube(stations, days, df, bounds)
+        m['rows_out'] = len(stations) * len(days)
+    cube = load_demand_cube()
+    print(f"Saved cube {cube['energy_dkwh'].shape} to {CUBE_DIR}")
+
+    print("--- 3. Hour-of-Week Rollups ---")
+    levels = {'station': np.asarray(stations, dtype=object)}
+    for level, column in ROLLUP_LEVELS.items():
+        if column in meta.columns:
+            levels[level] = meta[column].to_numpy(dtype=object)
+        else:
+            print(f"  [WARN] stations has no {column}; skipping {level} rollup.")
+
+    profiles = pd.concat([
+        hour_of_week_profiles(cube, groups).assign(level=level) for level, groups in levels.items()
+    ], ignore_index=True)
+    profiles = profiles[['level', 'key', 'dow', 'hour', 'avg_kwh', 'avg_occupancy', 'peak_occupancy', 'n_stations', 'n_days']]
+
+    con.execute("DROP TABLE IF EXISTS demand_profiles")
+    con.execute("CREATE TABLE demand_profiles AS SELECT * FROM profiles")
+    con.close()
+    print(f"Saved {len(profiles)} profile rows. Table in mobie_data.db: demand_profiles")
+
+if __name__ == "__main__":
+    with track('demand_cube'):
+        build_demand_cube()
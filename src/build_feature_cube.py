@@ -0,0 +1,173 @@
+"""
+Cell Feature Cube (memory-mapped rows x cols x features raster)
+
+Exports every numeric cell feature in osm_analysis.db (census_stats,
+road_stats, poi_stats, poly_stats, income, tourism, cell_lags) to one float32
+NumPy memmap on the 1km EPSG:3035 grid, in data/feature_cube/:
+
+- features.npy (float32, rows x cols x features): NaN where a cell has no value
+- cube_meta.json: grid origin, cell size, shape, feature names and source tables
+
+Row r / column c is the cell whose lower-left corner is
+(x_min + c * 1000, y_min + r * 1000), so rows run south to north. A cell's
+features are contiguous, so point lookups and windows are plain slicing:
+
+    cube = load_feature_cube()
+    lookup(cube, x_3035, y_3035, ['pop_total', 'tourism_pressure'])   # (n, 2)
+    lookup_lonlat(cube, lon, lat)                                     # every feature
+    window(cube, xmin, ymin, xmax, ymax, ['pop_total'])               # (rows, cols, 1) view
+
+The file is opened read-only with mmap, so any number of worker processes
+share the same pages without opening the database.
+"""
+
+import duckdb
+import numpy as np
+import os
+import json
+import shutil
+from datetime import datetime
+from grid_logic import CELL_SIZE_M, lonlat_to_3035
+from run_metrics import track
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+CUBE_DIR = os.path.join(BASE_DIR, "../data/feature_cube")
+
+CUBE_TABLES = ['census_stats', 'road_stats', 'poi_stats', 'poly_stats', 'income', 'tourism', 'cell_lags']
+NUMERIC_TYPES = ('DOUBLE', 'FLOAT', 'BIGINT', 'INTEGER', 'SMALLINT', 'TINYINT', 'HUGEINT', 'DECIMAL', 'UBIGINT', 'UINTEGER')
+
+def load_feature_cube(cube_dir=CUBE_DIR):
+    """Opens the cube read-only: meta dict plus 'features' (memmap) and 'index' (name -> layer)."""
+    with open(os.path.join(cube_dir, "cube_meta.json")) as f:
+        cube = json.load(f)
+    cube['features'] = np.load(os.path.join(cube_dir, "features.npy"), mmap_mode='r')
+    cube['index'] = {name: i for i, name in enumerate(cube['names'])}
+    return cube
+
+def _layers(cube, names):
+    if names is None:
+        return slice(None)
+    return [cube['index'][n] for n in names]
+
+def cell_rc(cube, x_3035, y_3035):
+    """(row, col, inside) of the cells containing x/y; row/col are clipped where outside."""
+    x = np.asarray(x_3035, dtype=float)
+    y = np.asarray(y_3035, dtype=float)
+    n_rows, n_cols = cube['shape'][:2]
+    col = np.floor((x - cube['x_min']) / cube['cell_size']).astype(np.int64, copy=False)
+    row = np.floor((y - cube['y_min']) / cube['cell_size']).astype(np.int64, copy=False)
+    inside = (row >= 0) & (row < n_rows) & (col >= 0) & (col < n_cols)
+    return np.clip(row, 0, n_rows - 1), np.clip(col, 0, n_cols - 1), inside
+
+def lookup(cube, x_3035, y_3035, names=None):
+    """Features of the cells containing the EPSG:3035 points, (n_points x n_features); NaN outside the grid."""
+    row, col, inside = cell_rc(cube, np.atleast_1d(x_3035), np.atleast_1d(y_3035))
+    out = np.array(cube['features'][row, col][:, _layers(cube, names)])
+    out[~inside] = np.nan
+    return out
+
+def lookup_lonlat(cube, lon, lat, names=None):
+    x, y = lonlat_to_3035(np.atleast_1d(lon), np.atleast_1d(lat))
+    return lookup(cube, x, y, names)
+
+def window_rc(cube, xmin, ymin, xmax, ymax):
+    """
+    (r0, c0, r1, c1): the inclusive cell range overlapping [xmin, xmax) x [ymin, ymax),
+    clipped to the grid. Empty (r1 < r0 or c1 < c0) when the box misses the grid.
+    """
+    n_rows, n_cols = cube['shape'][:2]
+    size = cube['cell_size']
+    c0 = int(np.clip(np.floor((xmin - cube['x_min']) / size), 0, n_cols))
+    r0 = int(np.clip(np.floor((ymin - cube['y_min']) / size), 0, n_rows))
+    c1 = int(np.clip(np.floor((np.nextafter(xmax, -np.inf) - cube['x_min']) / size), -1, n_cols - 1))
+    r1 = int(np.clip(np.floor((np.nextafter(ymax, -np.inf) - cube['y_min']) / size), -1, n_rows - 1))
+    return r0, c0, r1, c1
+
+def window(cube, xmin, ymin, xmax, ymax, names=None):
+    """
+    Read-only view of the cells overlapping [xmin, xmax) x [ymin, ymax) (EPSG:3035),
+    clipped to the grid (zero-size when the box misses it). Returns (view, (x0, y0))
+    with x0/y0 the lower-left corner of view[0, 0].
+    """
+    r0, c0, r1, c1 = window_rc(cube, xmin, ymin, xmax, ymax)
+    view = cube['features'][r0:r1 + 1, c0:c1 + 1]
+    if names is not None:
+        layers = _layers(cube, names)
+        # Contiguous layers stay a view; others are gathered
+        view = view[..., layers[0]:layers[-1] + 1] if layers == list(range(layers[0], layers[-1] + 1)) else view[..., layers]
+    return view, (cube['x_min'] + c0 * cube['cell_size'], cube['y_min'] + r0 * cube['cell_size'])
+
+def _feature_columns(con, table):
+    described = con.execute(f"DESCRIBE {table}").df()
+    return [c for c, t in zip(described['column_name'], described['column_type'])
+            if c != 'cell_id' and t.startswith(NUMERIC_TYPES)]
+
+def build_feature_cube():
+    if not os.path.exists(DB_PATH):
+        print("Missing input files.")
+        return
+
+    print("--- 1. Resolving Grid & Feature Tables ---")
+    con = duckdb.connect(DB_PATH, read_only=True)
+    tables = set(con.execute("SELECT table_name FROM information_schema.tables").df()['table_name'])
+    x_min, y_min, x_max, y_max = con.execute("SELECT min(x_3035), min(y_3035), max(x_3035), max(y_3035) FROM grid_spine").fetchone()
+    n_rows = int((y_max - y_min) // CELL_SIZE_M) + 1
+    n_cols = int((x_max - x_min) // CELL_SIZE_M) + 1
+
+    sources = {}
+    names = []
+    for table in CUBE_TABLES:
+        if table not in tables:
+            print(f"  [WARN] Table {table} not found; skipping.")
+            continue
+        cols = _feature_columns(con, table)
+        # Names are unique across tables; clashes get the table as prefix
+        sources[table] = [(c, c if c not in names else f"{table}_{c}") for c in cols]
+        names += [name for _, name in sources[table]]
+    print(f"Grid {n_rows} x {n_cols} cells, {len(names)} features from {len(sources)} tables "
+          f"({n_rows * n_cols * len(names) * 4 / 1e6:.0f} MB).")
+
+    print("--- 2. Filling the Cube ---")
+    tmp_dir = CUBE_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    features = np.lib.format.open_memmap(os.path.join(tmp_dir, "features.npy"), mode='w+', dtype=np.float32,
+                                         shape=(n_rows, n_cols, len(names)))
+    features[:] = np.nan
+    layer = 0
+    for table, cols in sources.items():
+        # Blocks can append a cell twice; duplicates are averaged
+        aggs = ", ".join(f'avg(t."{c}")::FLOAT AS "{name}"' for c, name in cols)
+        df = con.execute(f"""
+            SELECT g.x_3035, g.y_3035, {aggs}
+            FROM {table} t JOIN grid_spine g USING (cell_id)
+            GROUP BY g.x_3035, g.y_3035
+        """).df()
+        row = ((df['y_3035'].to_numpy() - y_min) // CELL_SIZE_M).astype(np.int64)
+        col = ((df['x_3035'].to_numpy() - x_min) // CELL_SIZE_M).astype(np.int64)
+        features[row, col, layer:layer + len(cols)] = df[[name for _, name in cols]].to_numpy(dtype=np.float32)
+        print(f"  {table}: {len(cols)} features, {len(df)} cells")
+        layer += len(cols)
+    con.close()
+    features.flush()
+    del features
+
+    with open(os.path.join(tmp_dir, "cube_meta.json"), "w") as f:
+        json.dump({
+            'x_min': float(x_min),
+            'y_min': float(y_min),
+            'cell_size': CELL_SIZE_M,
+            'crs': "EPSG:3035",
+            'shape': [n_rows, n_cols, len(names)],
+            'names': names,
+            'sources': {table: [name for _, name in cols] for table, cols in sources.items()},
+            'built_at': datetime.now().isoformat(timespec='seconds'),
+        }, f, indent=2)
+    shutil.rmtree(CUBE_DIR, ignore_errors=True)
+    os.replace(tmp_dir, CUBE_DIR)
+    print(f"Feature cube written to {CUBE_DIR}")
+
+if __name__ == "__main__":
+    with track('feature_cube'):
+        build_feature_cube()
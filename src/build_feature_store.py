@@ -0,0 +1,196 @@
+"""
+Station-Day Feature Store (ML Training Set as Partitioned Parquet)
+
+Materializes the full training table, one row per station-day in
+session_stats, joined once in DuckDB with:
+
+- stations:           physical and operator features, EPSG:3035 position, cell_id
+- prices:             tariff components and effective prices per profile
+- station_catchment:  census/income/tourism/POI totals within 10/20/30 minutes
+- census_stats, tourism, cell_lags (osm_analysis.db): the station's own cell, as cell_* columns
+- session_stats:      labels (kwh_daily, sessions_daily) and same-day occupancy
+
+and written to data/feature_store/ as Parquet partitioned by month:
+
+    feature_store/month=2026-01/data_0.parquet
+
+Columns are typed and downcast (DATE, FLOAT instead of DOUBLE for features,
+the smallest integer type that holds every value), with one schema for all
+partitions. Each month's fingerprint (row count and hash of its joined rows)
+is kept in feature_store/_manifest.json; a run rewrites only the months whose
+upstream rows changed, plus all of them if the schema changes.
+
+    python build_feature_store.py           # refresh changed months
+    python build_feature_store.py --force   # rewrite every month
+
+Training jobs read the files with `load_features()` (or any Parquet reader)
+instead of joining the databases.
+"""
+
+import duckdb
+import hashlib
+import json
+import os
+import shutil
+import sys
+from run_metrics import track
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MOBIE_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
+OSM_DB = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+FEATURE_DIR = os.path.join(BASE_DIR, "../data/feature_store")
+MANIFEST_PATH = os.path.join(FEATURE_DIR, "_manifest.json")
+
+# Kept at full precision; every other DOUBLE is stored as FLOAT
+LABEL_COLUMNS = ['kwh_daily', 'sessions_daily', 'max_concurrent', 'saturation_ratio']
+# Raw text / coordinates that are not model features
+STATION_DROP = ['ID', 'LATITUDE', 'LONGITUDE', 'MORADA']
+INT_TYPES = [('TINYINT', 2**7), ('SMALLINT', 2**15), ('INTEGER', 2**31)]
+
+def table_exists(con, table_name, catalog=None):
+    where = f"table_name = '{table_name}'" + (f" AND table_catalog = '{catalog}'" if catalog else "")
+    return con.execute(f"SELECT count(*) FROM information_schema.tables WHERE {where}").fetchone()[0] > 0
+
+def _columns(con, table):
+    return con.execute(f"SELECT * FROM {table} LIMIT 0").df().columns.tolist()
+
+def features_sql(con):
+    """SELECT producing one row per station-day with every feature, plus its month."""
+    stations = [c for c in _columns(con, "stations") if c not in STATION_DROP]
+    select = [
+        "s.station_id",
+        "strptime(s.date_str, '%Y%m%d')::DATE AS date",
+        "isodow(strptime(s.date_str, '%Y%m%d')) AS day_of_week",
+    ] + [f'st."{c}"' for c in stations]
+    joins = ["JOIN stations st ON st.ID = s.station_id"]
+
+    # Optional sources: missing tables are skipped, not fatal
+    optional = [
+        ('prices', None, 'p', 'p.station_id_code = s.station_id', ['station_id_code'], ''),
+        ('station_catchment', None, 'c', 'c.station_id = s.station_id', ['station_id'], ''),
+        ('census_stats', 'osm', 'cs', 'cs.cell_id = st.cell_id', ['cell_id'], 'cell_'),
+        ('tourism', 'osm', 't', 't.cell_id = st.cell_id', ['cell_id'], 'cell_'),
+        ('cell_lags', 'osm', 'cl', 'cl.cell_id = st.cell_id', ['cell_id'], 'cell_'),
+    ]
+    for table, catalog, alias, on, drop, prefix in optional:
+        if not table_exists(con, table, catalog):
+            print(f"  [WARN] Table {table} not found; its features are left out.")
+            continue
+        ref = f"{catalog}.{table}" if catalog else table
+        select += [f'{alias}."{c}" AS "{prefix}{c}"' for c in _columns(con, ref) if c not in drop]
+        joins.append(f"LEFT JOIN {ref} {alias} ON {on}")
+
+    select += [f"s.{c}" for c in LABEL_COLUMNS]
+    select.append("substr(s.date_str, 1, 4) || '-' || substr(s.date_str, 5, 2) AS month")
+    return f"SELECT {', '.join(select)} FROM session_stats s {' '.join(joins)}"
+
+def storage_schema(con, sql):
+    """column -> stored type: FLOAT for feature DOUBLEs, the narrowest integer type for integers."""
+    described = con.execute(f"DESCRIBE {sql}").df()
+    types = dict(zip(described['column_name'], described['column_type']))
+    ints = [c for c, t in types.items() if t in ('BIGINT', 'INTEGER', 'HUGEINT', 'SMALLINT')]
+    ranges = {}
+    if ints:
+        aggs = ", ".join(f'min("{c}"), max("{c}")' for c in ints)
+        row = con.execute(f"SELECT {aggs} FROM ({sql})").fetchone()
+        ranges = {c: (row[2 * i], row[2 * i + 1]) for i, c in enumerate(ints)}
+
+    schema = {}
+    for col, typ in types.items():
+        if col == 'month':
+            continue
+        if typ == 'DOUBLE' and col not in LABEL_COLUMNS:
+            typ = 'FLOAT'
+        elif col in ranges:
+            lo, hi = (v if v is not None else 0 for v in ranges[col])
+            typ = next((name for name, bound in INT_TYPES if -bound <= lo and hi < bound), 'BIGINT')
+        schema[col] = typ
+    return schema
+
+def month_fingerprints(con, sql):
+    rows = con.execute(f"SELECT month, count(*), sum(hash(f))::VARCHAR FROM ({sql}) f GROUP BY month").fetchall()
+    return {month: {'rows': n, 'hash': h} for month, n, h in rows}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {'schema_hash': None, 'months': {}}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def build_feature_store(force=False):
+    if not os.path.exists(MOBIE_DB):
+        print("Missing input files.")
+        return
+
+    print("--- 1. Resolving Feature Sources ---")
+    con = duckdb.connect(MOBIE_DB, read_only=True)
+    if not table_exists(con, 'session_stats') or not table_exists(con, 'stations'):
+        print("session_stats/stations not found. Run process_mobie_static.py and process_mobie_data.py first.")
+        con.close()
+        return
+    if os.path.exists(OSM_DB):
+        con.execute(f"ATTACH '{OSM_DB}' AS osm (READ_ONLY)")
+    sql = features_sql(con)
+    schema = storage_schema(con, sql)
+    schema_hash = hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+    print(f"{len(schema)} columns.")
+
+    print("--- 2. Fingerprinting Months ---")
+    current = month_fingerprints(con, sql)
+    manifest = load_manifest()
+    rewrite_all = force or manifest['schema_hash'] != schema_hash
+    changed = sorted(m for m, fp in current.items()
+                     if rewrite_all or manifest['months'].get(m) != fp or not os.path.exists(os.path.join(FEATURE_DIR, f"month={m}")))
+    removed = sorted(set(manifest['months']) - set(current))
+    print(f"{len(current)} months, {len(changed)} to write, {len(removed)} to remove.")
+    if not changed and not removed:
+        con.close()
+        print("Feature store is up to date.")
+        return
+
+    os.makedirs(FEATURE_DIR, exist_ok=True)
+    if changed:
+        print("--- 3. Writing Partitions ---")
+        casts = ", ".join(f'CAST("{c}" AS {t}) AS "{c}"' for c, t in schema.items())
+        months = ", ".join(f"'{m}'" for m in changed)
+        tmp_dir = os.path.join(FEATURE_DIR, "_tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        with track('feature_store', 'write', rows_in=sum(current[m]['rows'] for m in changed)) as m:
+            con.execute(f"""
+                COPY (SELECT {casts}, month FROM ({sql}) WHERE month IN ({months}) ORDER BY month, station_id, date)
+                TO '{tmp_dir}' (FORMAT PARQUET, COMPRESSION ZSTD, PARTITION_BY (month))
+            """)
+            m['rows_out'] = m['rows_in']
+        # Swapped in month by month; readers never see a half-written partition
+        for month in changed:
+            target = os.path.join(FEATURE_DIR, f"month={month}")
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(os.path.join(tmp_dir, f"month={month}"), target)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    con.close()
+
+    for month in removed:
+        shutil.rmtree(os.path.join(FEATURE_DIR, f"month={month}"), ignore_errors=True)
+    save_manifest({'schema_hash': schema_hash, 'schema': schema, 'months': current})
+    print(f"Wrote {', '.join(changed) or 'no'} month(s); {sum(v['rows'] for v in current.values())} station-days in {FEATURE_DIR}")
+
+def load_features(months=None, columns="*"):
+    """Station-day features for the given months (e.g. ['2026-01']), reading only those partitions."""
+    where = "month IN (" + ", ".join(f"'{m}'" for m in months) + ")" if months else "TRUE"
+    con = duckdb.connect()
+    df = con.execute(f"""
+        SELECT {columns} FROM read_parquet('{FEATURE_DIR}/month=*/*.parquet', hive_partitioning=true)
+        WHERE {where}
+    """).df()
+    con.close()
+    return df
+
+if __name__ == "__main__":
+    with track('feature_store'):
+        build_feature_store(force='--force' in sys.argv[1:])
@@ -0,0 +1,118 @@
+"""
+Mobi.E Session Archive (Defragmented Sessions as Partitioned Parquet)
+
+Canonical, query-ready form of the session exports: one row per idCdr with
+its station, overall start/end, total kWh and duration, written to
+data/session_archive/ as Parquet partitioned by start month and station hash:
+
+    session_archive/month=2026-01/station_bucket=5/data_0.parquet
+
+DuckDB prunes partitions from filters on month/station_bucket, so ad hoc
+queries over a few stations or months only open those files. Use
+`archive_filter()` to build such filters, or `create_archive_view()` for
+a `sessions` view.
+"""
+
+import duckdb
+import os
+import glob
+import shutil
+import sys
+from ingest_mobie_sessions import create_fragments_view, fragments_path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_GLOB = os.path.join(BASE_DIR, "../data/detailed-*.csv")
+ARCHIVE_DIR = os.path.join(BASE_DIR, "../data/session_archive")
+
+N_STATION_BUCKETS = 16
+# md5_number is stable across DuckDB versions (unlike hash()), so buckets never move
+BUCKET_EXPR = f"(md5_number({{station}}) % {N_STATION_BUCKETS})::INTEGER"
+
+def station_bucket_sql(station_sql):
+    return BUCKET_EXPR.format(station=station_sql)
+
+def _sessions_sql(months=None):
+    month_filter = ""
+    if months is not None:
+        month_filter = "WHERE month IN (" + ", ".join(f"'{m}'" for m in months) + ")"
+    return f"""
+        SELECT * FROM (
+            SELECT
+                idCdr,
+                arg_min(idChargingStation, "start") as station_id,
+                min("start") as "start",
+                max("end") as "end",
+                sum(energia_total_periodo) as kwh,
+                (epoch(max("end")) - epoch(min("start"))) / 60.0 as duration_min,
+                count(*)::SMALLINT as n_fragments,
+                strftime(min("start"), '%Y-%m') as month,
+                {station_bucket_sql('arg_min(idChargingStation, "start")')} as station_bucket
+            FROM fragments
+            WHERE "start" IS NOT NULL AND "end" IS NOT NULL
+            GROUP BY idCdr
+        )
+        {month_filter}
+    """
+
+def build_session_archive(months=None):
+    """
+    Rebuilds the archive from every ingested export. With months (e.g. ['2026-01']),
+    only those month partitions are rewritten; an empty list rewrites nothing.
+    """
+    if months is not None and not months:
+        print("No archive months touched.")
+        return
+    parquets = [fragments_path(p) for p in sorted(glob.glob(CSV_GLOB)) if os.path.exists(fragments_path(p))]
+    if not parquets:
+        print("No ingested session exports found. Run process_mobie_data.py first.")
+        return
+
+    con = duckdb.connect()
+    create_fragments_view(con, parquets)
+
+    if months is None:
+        print(f"--- Rebuilding session archive from {len(parquets)} exports ---")
+        if os.path.exists(ARCHIVE_DIR):
+            shutil.rmtree(ARCHIVE_DIR)
+    else:
+        print(f"--- Refreshing archive months: {', '.join(sorted(months))} ---")
+        for m in months:
+            shutil.rmtree(os.path.join(ARCHIVE_DIR, f"month={m}"), ignore_errors=True)
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    con.execute(f"""
+        COPY ({_sessions_sql(months)} ORDER BY station_id, "start")
+        TO '{ARCHIVE_DIR}' (FORMAT PARQUET, COMPRESSION ZSTD, PARTITION_BY (month, station_bucket), APPEND true)
+    """)
+    n = con.execute(f"SELECT count(*) FROM read_parquet('{ARCHIVE_DIR}/**/*.parquet')").fetchone()[0]
+    con.close()
+    print(f"Session archive holds {n} sessions in {ARCHIVE_DIR}")
+
+def archive_filter(stations=None, months=None):
+    """SQL predicate that lets DuckDB prune archive partitions for the given stations/months."""
+    clauses = []
+    if months:
+        clauses.append("month IN (" + ", ".join(f"'{m}'" for m in months) + ")")
+    if stations:
+        quoted = [s.replace("'", "''") for s in stations]
+        buckets = ", ".join(station_bucket_sql(f"'{s}'") for s in quoted)
+        clauses.append(f"station_bucket IN ({buckets})")
+        clauses.append("station_id IN (" + ", ".join(f"'{s}'" for s in quoted) + ")")
+    return " AND ".join(clauses) or "TRUE"
+
+def create_archive_view(con, name="sessions"):
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW {name} AS
+        SELECT * FROM read_parquet('{ARCHIVE_DIR}/**/*.parquet', hive_partitioning=true)
+    """)
+
+def query_archive(stations=None, months=None, columns="*"):
+    """Sessions for the given stations and/or months, reading only the matching partitions."""
+    con = duckdb.connect()
+    create_archive_view(con)
+    df = con.execute(f"SELECT {columns} FROM sessions WHERE {archive_filter(stations, months)}").df()
+    con.close()
+    return df
+
+if __name__ == "__main__":
+    build_session_archive(sys.argv[1:] or None)
@@ -0,0 +1,147 @@
+"""
+Station Catchment Features (Demand-Side Context per Station)
+
+For every station, aggregates cell features over all cells that reach it
+within 10/20/30 minutes (static slot of travel_times).
+
+The matrix is loaded once as a sparse cell x station matrix; the time bands
+are stacked side by side so every feature for every station and band comes
+out of a single sparse product:
+
+    catchment = [A_10 | A_20 | A_30].T @ F
+
+Extensive features (counts) are summed; intensive ones (income, pressure)
+are population-weighted means. Output: `station_catchment` in mobie_data.db.
+"""
+
+import duckdb
+import pandas as pd
+import numpy as np
+import os
+from scipy import sparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OSM_DB = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+MOBIE_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
+MATRIX_DB = os.path.join(BASE_DIR, "../data/travel_matrix.db")
+
+TIME_BANDS_MIN = [10, 20, 30]
+
+# output name -> (table, SQL expression)
+EXTENSIVE_FEATURES = {
+    'pop': ('census_stats', 'pop_total'),
+    'households': ('census_stats', 'households_total'),
+    'private_households': ('census_stats', 'private_households'),
+    'poi': ('poi_stats', None), # sum of all poi_* columns
+}
+INTENSIVE_FEATURES = {
+    'avg_income': ('income', 'avg_income'),
+    'median_income': ('income', 'median_income'),
+    'tourism_pressure': ('tourism', 'tourism_pressure'),
+}
+WEIGHT_FEATURE = 'pop'
+
+def table_exists(con, table_name):
+    return con.execute(f"SELECT count(*) FROM information_schema.tables WHERE table_name = '{table_name}'").fetchone()[0] > 0
+
+def load_cell_features(con, cell_ids):
+    """Dense (n_cells x n_features) frame aligned to cell_ids; NaN where a table has no value."""
+    features = pd.DataFrame(index=pd.Index(cell_ids, name='cell_id'))
+    for name, (table, column) in {**EXTENSIVE_FEATURES, **INTENSIVE_FEATURES}.items():
+        if not table_exists(con, table):
+            print(f"  [WARN] Table {table} not found; {name} will be empty.")
+            features[name] = np.nan
+            continue
+
+        if column is None:
+            cols = con.execute(f"DESCRIBE {table}").df()['column_name']
+            poi_cols = [c for c in cols if c.startswith('poi_')]
+            expr = ' + '.join(f'COALESCE("{c}", 0)' for c in poi_cols) or '0'
+        else:
+            expr = column
+
+        df = con.execute(f"SELECT cell_id, avg({expr}) as v FROM {table} GROUP BY 1").df()
+        features[name] = df.set_index('cell_id')['v'].reindex(features.index)
+    return features
+
+def catchment_table(edges, features):
+    """
+    Catchment features per station from (cell_id, station_id, time_min) edges within
+    max(TIME_BANDS_MIN) and load_cell_features() rows covering every edge cell.
+    """
+    cell_codes, cell_ids = pd.factorize(edges['cell_id'])
+    station_codes, station_ids = pd.factorize(edges['station_id'])
+    n_cells, n_stations = len(cell_ids), len(station_ids)
+    features = features.reindex(cell_ids)
+
+    ext = list(EXTENSIVE_FEATURES)
+    intens = list(INTENSIVE_FEATURES)
+    weight = features[WEIGHT_FEATURE].fillna(0).to_numpy()
+
+    # Columns: extensive sums | weighted intensive numerators | weights per intensive | cell count
+    blocks = [features[ext].fillna(0).to_numpy()]
+    for name in intens:
+        vals = features[name].to_numpy()
+        known = ~np.isnan(vals)
+        blocks.append(np.where(known, vals * weight, 0.0)[:, None])
+        blocks.append(np.where(known, weight, 0.0)[:, None])
+    blocks.append(np.ones((n_cells, 1)))
+    F = np.hstack(blocks)
+
+    times = edges['time_min'].to_numpy()
+    band_mats = []
+    for band in TIME_BANDS_MIN:
+        mask = times <= band
+        band_mats.append(sparse.csr_matrix(
+            (np.ones(mask.sum()), (cell_codes[mask], station_codes[mask])), shape=(n_cells, n_stations)
+        ))
+    A = sparse.hstack(band_mats, format='csr')
+    R = np.asarray(A.T @ F) # (bands * stations) x columns
+
+    out = pd.DataFrame({'station_id': station_ids})
+    for b, band in enumerate(TIME_BANDS_MIN):
+        rows = R[b * n_stations:(b + 1) * n_stations]
+        col = 0
+        for name in ext:
+            out[f"{name}_{band}min"] = rows[:, col]
+            col += 1
+        for name in intens:
+            num, den = rows[:, col], rows[:, col + 1]
+            out[f"{name}_{band}min"] = np.divide(num, den, out=np.full(n_stations, np.nan), where=den > 0)
+            col += 2
+        out[f"cells_{band}min"] = rows[:, col].astype(np.int32)
+    return out
+
+def calculate_station_catchment():
+    if not os.path.exists(MATRIX_DB) or not os.path.exists(OSM_DB) or not os.path.exists(MOBIE_DB):
+        print(f"Missing required databases. Checked:\n{MATRIX_DB}\n{OSM_DB}\n{MOBIE_DB}")
+        return
+
+    print("--- 1. Loading Travel Matrix ---")
+    con_matrix = duckdb.connect(MATRIX_DB, read_only=True)
+    edges = con_matrix.execute("""
+        SELECT cell_id, station_id, min(time_min) as time_min
+        FROM travel_times
+        WHERE slot = 0 AND time_min <= ?
+        GROUP BY cell_id, station_id
+    """, [max(TIME_BANDS_MIN)]).df()
+    con_matrix.close()
+
+    print(f"Loaded {len(edges):,} edges ({edges['cell_id'].nunique()} cells x {edges['station_id'].nunique()} stations).")
+
+    print("--- 2. Loading Cell Features ---")
+    con_osm = duckdb.connect(OSM_DB, read_only=True)
+    features = load_cell_features(con_osm, edges['cell_id'].unique())
+    con_osm.close()
+
+    print("--- 3. Sparse Catchment Product ---")
+    out = catchment_table(edges, features)
+
+    con = duckdb.connect(MOBIE_DB)
+    con.execute("DROP TABLE IF EXISTS station_catchment")
+    con.execute("CREATE TABLE station_catchment AS SELECT * FROM out")
+    con.close()
+    print(f"Saved catchment features for {len(out)} stations. Table in mobie_data.db: station_catchment")
+
+if __name__ == "__main__":
+    calculate_station_catchment()
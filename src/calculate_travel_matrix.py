@@ -5,17 +5,44 @@ import pandas as pd
 import numpy as np
 import os
 import time
+from scipy.spatial import cKDTree
+from grid_logic import lonlat_to_3035
+from snap_locations import ROUTING_DB, origin_key, attach_snaps, valhalla_location
+from build_cell_topk import update_cell_topk
+from run_metrics import track, Tally
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OSM_DB = os.path.join(BASE_DIR, "../data/osm_analysis.db")
 MOBIE_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
 MATRIX_DB = os.path.join(BASE_DIR, "../data/travel_matrix.db")
 VALHALLA_URL = "http://localhost:8002/sources_to_targets"
+# "valhalla" (HTTP container) or "offline" (in-process road graph, see road_graph.py)
+ROUTING_BACKEND = os.environ.get("ROUTING_BACKEND", "valhalla")
 
 # Optimization Thresholds
 EUCLIDEAN_FILTER_KM = 60.0
 TIME_THRESHOLD_MIN = 30.0
 TIME_THRESHOLD_SEC = TIME_THRESHOLD_MIN * 60
+TARGET_CHUNK_SIZE = 250
+# EPSG:3035 distorts distances by a few % over Portugal; the KD-tree radius is padded and
+# the exact haversine cut applied afterwards
+KDTREE_RADIUS_PAD = 1.1
+
+# Departure Slots
+# The slot index is stored in travel_times.slot (UTINYINT). Slot 0 is the static,
+# time-independent matrix; the others depart at the given time on DEPARTURE_DATE.
+DEPARTURE_DATE = "2026-01-14" # A representative weekday
+DEPARTURE_SLOTS = [
+    ("static", None),
+    ("am_peak", "08:00"),
+    ("midday", "13:00"),
+    ("pm_peak", "18:00"),
+    ("night", "23:00"),
+]
+# Set to e.g. ["am_peak", "midday", "pm_peak", "night"] for a multi-slot run
+ACTIVE_SLOTS = ["static"]
+# LIMIT 20 for a very small test as requested (and due to disk space constraints)
+ORIGIN_LIMIT = 20
 
 def haversine(lon1, lat1, lon2, lat2):
     # Vectorized haversine distance in km
@@ -26,17 +53,175 @@ def haversine(lon1, lat1, lon2, lat2):
     a = np.sin(dphi/2)**2 + np.cos(phi1)*np.cos(phi2)*np.sin(dlambda/2)**2
     return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
 
-def calculate_matrix():
+def slot_ids(slot_names):
+    names = [name for name, _ in DEPARTURE_SLOTS]
+    return [names.index(n) for n in slot_names]
+
+def slot_departure(slot):
+    """Route cache key of a slot: its actual departure, so edited slots or dates never reuse old routes."""
+    clock = DEPARTURE_SLOTS[slot][1]
+    return "static" if clock is None else f"{DEPARTURE_DATE}T{clock}"
+
+def slot_date_time(slot):
+    clock = DEPARTURE_SLOTS[slot][1]
+    if clock is None:
+        return None
+    return {"type": 1, "value": f"{DEPARTURE_DATE}T{clock}"}
+
+def candidate_pairs(origins, chargers):
+    """
+    Euclidean pre-filter, computed once for every (unique origin, charger) pair and
+    shared by all departure slots. Returns one array of charger indices per origin.
+
+    Chargers are indexed in a KD-tree (EPSG:3035), so each origin only gets exact
+    haversine distances for the chargers near it.
+    """
+    c_lon = chargers['lon'].to_numpy(dtype=float)
+    c_lat = chargers['lat'].to_numpy(dtype=float)
+    o_lon = origins['lon'].to_numpy(dtype=float)
+    o_lat = origins['lat'].to_numpy(dtype=float)
+
+    located = np.flatnonzero(np.isfinite(c_lon) & np.isfinite(c_lat))
+    tree = cKDTree(np.column_stack(lonlat_to_3035(c_lon[located], c_lat[located])))
+    near = tree.query_ball_point(np.column_stack(lonlat_to_3035(o_lon, o_lat)), EUCLIDEAN_FILTER_KM * 1000 * KDTREE_RADIUS_PAD)
+
+    candidates = []
+    for i, idx in enumerate(near):
+        idx = located[np.sort(np.asarray(idx, dtype=np.int64))]
+        dists = haversine(o_lon[i], o_lat[i], c_lon[idx], c_lat[idx])
+        candidates.append(idx[dists < EUCLIDEAN_FILTER_KM])
+    return candidates
+
+def load_origins(limit=None):
+    """Origins (cell_id, lon, lat, origin_key) from cell_origins, optionally only the first `limit`."""
+    conn_osm = duckdb.connect(OSM_DB, read_only=True)
+    query = "SELECT cell_id, lon, lat FROM cell_origins"
+    origins = conn_osm.execute(query if limit is None else f"{query} LIMIT {int(limit)}").df()
+    conn_osm.close()
+    origins['origin_key'] = [origin_key(lon, lat) for lon, lat in zip(origins['lon'], origins['lat'])]
+    return origins
+
+def open_route_cache():
+    """
+    Route cache shared by all slots and runs: (origin_key, target_key, departure) -> time/distance,
+    with departure from slot_departure(). Unreachable pairs are cached with a NULL time so
+    they are never requested again.
+    """
+    con = duckdb.connect(ROUTING_DB)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS route_cache (
+            origin_key VARCHAR,
+            target_key VARCHAR,
+            departure VARCHAR,
+            time_s DOUBLE,
+            distance_km DOUBLE
+        )
+    """)
+    columns = con.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'route_cache'").df()['column_name']
+    if 'slot' in set(columns):
+        # Older caches were keyed by slot index; only the static routes are known to still apply
+        con.execute("""
+            CREATE OR REPLACE TABLE route_cache AS
+            SELECT origin_key, target_key, 'static' as departure, time_s, distance_km
+            FROM route_cache WHERE slot = 0
+        """)
+        print("Migrated route_cache to departure keys (timed slots dropped).")
+    return con
+
+def load_cached_routes(con_cache, pairs, slots):
+    """
+    Cached routes for the (origin_key, target_key) pairs in pairs and the given slots,
+    as {(origin_key, target_key, slot): (time_s, distance_km)}.
+    """
+    con_cache.register("tmp_route_pairs", pairs[['origin_key', 'target_key']])
+    con_cache.register("tmp_route_slots", pd.DataFrame({'slot': slots, 'departure': [slot_departure(s) for s in slots]}))
+    df = con_cache.execute("""
+        SELECT r.origin_key, r.target_key, s.slot, r.time_s, r.distance_km
+        FROM route_cache r
+        JOIN tmp_route_pairs p ON r.origin_key = p.origin_key AND r.target_key = p.target_key
+        JOIN tmp_route_slots s ON r.departure = s.departure
+    """).df()
+    con_cache.unregister("tmp_route_pairs")
+    con_cache.unregister("tmp_route_slots")
+    return {(o, t, s): (ts, d) for o, t, s, ts, d in df.itertuples(index=False)}
+
+def save_cached_routes(con_cache, routes):
+    """Appends (origin_key, target_key, slot, time_s, distance_km) rows to route_cache."""
+    cache_df = pd.DataFrame(routes, columns=['origin_key', 'target_key', 'slot', 'time_s', 'distance_km'])
+    cache_df['departure'] = [slot_departure(s) for s in cache_df['slot']]
+    con_cache.execute("INSERT INTO route_cache SELECT origin_key, target_key, departure, time_s, distance_km FROM cache_df")
+
+def request_matrix(session, source, targets, slot):
+    payload = {
+        "sources": [source],
+        "targets": targets,
+        "costing": "auto"
+    }
+    date_time = slot_date_time(slot)
+    if date_time is not None:
+        payload["date_time"] = date_time
+
+    response = session.post(VALHALLA_URL, json=payload, timeout=60)
+    response.raise_for_status()
+    result = response.json()
+    return result.get('sources_to_targets', [[]])[0]
+
+def save_edges(conn_matrix, df_edges):
+    conn_matrix.execute("INSERT INTO travel_times SELECT cell_id, station_id, time_min, distance_km, slot FROM df_edges")
+    update_cell_topk(conn_matrix, df_edges)
+
+def calculate_matrix_offline(conn_matrix, unique_origins, cells_by_key, chargers, slots):
+    """Static matrix from the in-process road graph: one shortest-path tree per station."""
+    from road_graph import load_road_graph, snap_to_nodes, station_travel_times
+
+    if slots != [0]:
+        print("[WARN] The offline backend has no traffic model; computing the static slot only.")
+
+    start_time = time.time()
+    graph = load_road_graph()
+    origin_nodes = snap_to_nodes(graph, unique_origins['lon'], unique_origins['lat'])
+    station_nodes = snap_to_nodes(graph, chargers['lon'], chargers['lat'])
+    print(f"Snapped {(origin_nodes >= 0).sum()}/{len(origin_nodes)} origins and {(station_nodes >= 0).sum()}/{len(station_nodes)} stations to the road graph.")
+
+    origin_cells = unique_origins['origin_key'].map(cells_by_key)
+    total_saved = 0
+    saves = Tally('travel_matrix', 'save_edges')
+    print("\n--- Starting Station Tree Expansion ---")
+    # Includes save_edges, which is also tallied on its own
+    with track('travel_matrix', 'tree_expansion', rows_in=len(station_nodes)) as m:
+        for batch in station_travel_times(graph, origin_nodes, station_nodes, TIME_THRESHOLD_SEC):
+            batch['cell_id'] = origin_cells.to_numpy()[batch['origin_idx'].to_numpy()]
+            batch = batch.explode('cell_id')
+            df_edges = pd.DataFrame({
+                'cell_id': batch['cell_id'].to_numpy(),
+                'station_id': chargers['station_id'].to_numpy()[batch['station_idx'].to_numpy()],
+                'time_min': batch['time_s'].to_numpy() / 60.0,
+                'distance_km': batch['distance_km'].to_numpy(),
+                'slot': 0
+            })
+            with saves(rows_in=len(df_edges)):
+                save_edges(conn_matrix, df_edges)
+            total_saved += len(df_edges)
+            print(f"  Saved {total_saved:,} edges so far ({time.time()-start_time:.1f}s)")
+        m['rows_out'] = total_saved
+
+    elapsed = time.time() - start_time
+    print(f"\n--- OFFLINE MATRIX COMPLETE ---")
+    print(f"Total reachable edges saved: {total_saved}")
+    print(f"Elapsed: {elapsed:.2f}s")
+    print(f"Database size: {os.path.getsize(MATRIX_DB)/1024:.1f} KB")
+
+def calculate_matrix(slot_names=None):
     if not os.path.exists(OSM_DB) or not os.path.exists(MOBIE_DB):
         print(f"Missing required databases. Checked:\n{OSM_DB}\n{MOBIE_DB}")
         return
 
+    slots = slot_ids(slot_names or ACTIVE_SLOTS)
+    print(f"Departure slots: {[DEPARTURE_SLOTS[s][0] for s in slots]}")
+
     # 1. Load Data
-    print("Loading origins (MICRO-TEST LIMIT 20) and Mobi.E chargers...")
-    conn_osm = duckdb.connect(OSM_DB)
-    # LIMIT 20 for a very small test as requested (and due to disk space constraints)
-    origins = conn_osm.execute("SELECT cell_id, lon, lat FROM cell_origins LIMIT 20").df()
-    conn_osm.close()
+    print(f"Loading origins (MICRO-TEST LIMIT {ORIGIN_LIMIT}) and Mobi.E chargers...")
+    origins = load_origins(ORIGIN_LIMIT)
 
     conn_mobie = duckdb.connect(MOBIE_DB)
     chargers = conn_mobie.execute("SELECT ID as station_id, LONGITUDE as lon, LATITUDE as lat FROM stations").df()
@@ -44,83 +229,139 @@ def calculate_matrix():
 
     print(f"Loaded {len(origins)} origins and {len(chargers)} chargers.")
 
+    # Use cached /locate results (see snap_locations.py) and drop unroutable points
+    origins = attach_snaps(origins, 'origin', 'origin_key')
+    chargers = attach_snaps(chargers, 'station', 'station_id')
+    chargers['target_key'] = [origin_key(lon, lat) for lon, lat in zip(chargers['lon'], chargers['lat'])]
+    charger_locations = [valhalla_location(c) for c in chargers.to_dict('records')]
+
+    # Entry points on shared cell boundaries are routed once and fanned out to every owning cell
+    cells_by_key = origins.groupby('origin_key')['cell_id'].unique()
+    unique_origins = origins.drop_duplicates(subset=['origin_key']).reset_index(drop=True)
+    print(f"Deduplicated to {len(unique_origins)} unique origin locations.")
+
     # 2. Setup Travel Matrix DB
     if os.path.exists(MATRIX_DB):
         print(f"Deleting existing {MATRIX_DB} to ensure clean state...")
-        os.remove(MATRIX_DB) 
-        
+        os.remove(MATRIX_DB)
+
     conn_matrix = duckdb.connect(MATRIX_DB)
-    conn_matrix.execute("CREATE TABLE travel_times (cell_id VARCHAR, station_id VARCHAR, time_min DOUBLE, distance_km DOUBLE)")
+    conn_matrix.execute("CREATE TABLE travel_times (cell_id VARCHAR, station_id VARCHAR, time_min DOUBLE, distance_km DOUBLE, slot UTINYINT)")
+    slots_df = pd.DataFrame({
+        'slot': [s for s in range(len(DEPARTURE_SLOTS))],
+        'name': [name for name, _ in DEPARTURE_SLOTS],
+        'date_time': [None if clock is None else f"{DEPARTURE_DATE}T{clock}" for _, clock in DEPARTURE_SLOTS]
+    })
+    conn_matrix.execute("CREATE TABLE departure_slots AS SELECT slot::UTINYINT as slot, name, date_time FROM slots_df")
 
-    # 3. Process in Batches
-    TARGET_CHUNK_SIZE = 250
-    
+    if ROUTING_BACKEND == "offline":
+        calculate_matrix_offline(conn_matrix, unique_origins, cells_by_key, chargers, slots)
+        conn_matrix.close()
+        return
+
+    # 3. Candidate Pairs (shared by all slots)
+    candidates = candidate_pairs(unique_origins, chargers)
+    print(f"Candidate pairs within {EUCLIDEAN_FILTER_KM}km: {sum(len(c) for c in candidates):,}")
+
+    conn_cache = open_route_cache()
+    pairs = pd.DataFrame({
+        'origin_key': np.repeat(unique_origins['origin_key'].to_numpy(), [len(c) for c in candidates]),
+        'target_key': chargers['target_key'].to_numpy()[np.concatenate(candidates + [np.empty(0, dtype=np.int64)])],
+    })
+    cached = load_cached_routes(conn_cache, pairs, slots)
+    print(f"Route cache hits available: {len(cached):,}")
+
+    # One keep-alive connection pool for every slot and chunk
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+    # 4. Process in Batches
+    requests_tally = Tally('travel_matrix', 'valhalla_request')
+    saves = Tally('travel_matrix', 'save_edges')
     start_time = time.time()
     total_processed = 0
     total_saved = 0
+    total_requests = 0
 
     print("\n--- Starting Batch Processing ---")
-    for idx, origin in origins.iterrows():
+    for idx, origin in unique_origins.iterrows():
         b_start = time.time()
-        # Calculate Euclidean distances to all chargers
-        dists = haversine(origin['lon'], origin['lat'], chargers['lon'], chargers['lat'])
-        candidate_chargers = chargers[dists < EUCLIDEAN_FILTER_KM]
-        
-        print(f"Cell {origin['cell_id']} ({total_processed+1}/{len(origins)}): {len(candidate_chargers)} candidates in {EUCLIDEAN_FILTER_KM}km radius")
-        
-        if candidate_chargers.empty:
+        okey = origin['origin_key']
+        cand_idx = candidates[idx]
+        cells = cells_by_key[okey]
+
+        print(f"Origin {okey} [{', '.join(cells)}] ({total_processed+1}/{len(unique_origins)}): {len(cand_idx)} candidates in {EUCLIDEAN_FILTER_KM}km radius")
+
+        if len(cand_idx) == 0:
             total_processed += 1
             continue
-        
-        # Process targets in chunks for this origin
-        for j in range(0, len(candidate_chargers), TARGET_CHUNK_SIZE):
-            chunk = candidate_chargers.iloc[j : j + TARGET_CHUNK_SIZE]
-            
-            payload = {
-                "sources": [{"lat": origin['lat'], "lon": origin['lon']}],
-                "targets": [{"lat": c['lat'], "lon": c['lon']} for _, c in chunk.iterrows()],
-                "costing": "auto"
-            }
-            
-            try:
-                response = requests.post(VALHALLA_URL, json=payload, timeout=60)
-                response.raise_for_status()
-                result = response.json()
-                
-                if 'sources_to_targets' in result:
-                    valid_edges = []
-                    for k, target_result in enumerate(result['sources_to_targets'][0]):
-                        t_sec = target_result.get('time')
-                        if t_sec is not None and t_sec <= TIME_THRESHOLD_SEC:
-                            valid_edges.append({
-                                'cell_id': origin['cell_id'],
-                                'station_id': chunk.iloc[k]['station_id'],
-                                'time_min': float(t_sec / 60.0),
-                                'distance_km': float(target_result.get('distance'))
-                            })
-                    
-                    if valid_edges:
-                        df_edges = pd.DataFrame(valid_edges)
-                        conn_matrix.execute("INSERT INTO travel_times SELECT * FROM df_edges")
-                        total_saved += len(valid_edges)
-                
-            except Exception as e:
-                print(f"  [ERROR] Chunk {j}-{j+len(chunk)}: {e}")
-            
+
+        source = valhalla_location(origin)
+        routes = []
+        new_cache = []
+
+        # Slots are the innermost loop so consecutive requests hit the same tiles on the server
+        for j in range(0, len(cand_idx), TARGET_CHUNK_SIZE):
+            chunk = cand_idx[j : j + TARGET_CHUNK_SIZE]
+            for slot in slots:
+                missing = [c for c in chunk if (okey, chargers.at[c, 'target_key'], slot) not in cached]
+                for c in chunk:
+                    hit = cached.get((okey, chargers.at[c, 'target_key'], slot))
+                    if hit is not None:
+                        routes.append((c, slot, hit[0], hit[1]))
+
+                if not missing:
+                    continue
+
+                try:
+                    with requests_tally(rows_in=len(missing)) as m:
+                        result = request_matrix(session, source, [charger_locations[c] for c in missing], slot)
+                        m['rows_out'] = len(result)
+                    total_requests += 1
+                except Exception as e:
+                    print(f"  [ERROR] Chunk {j}-{j+len(chunk)} slot {slot}: {e}")
+                    continue
+
+                for c, target_result in zip(missing, result):
+                    t_sec = target_result.get('time')
+                    dist = target_result.get('distance')
+                    routes.append((c, slot, t_sec, dist))
+                    new_cache.append((okey, chargers.at[c, 'target_key'], slot, t_sec, dist))
+
+        if new_cache:
+            save_cached_routes(conn_cache, new_cache)
+
+        valid_edges = []
+        for c, slot, t_sec, dist in routes:
+            if t_sec is not None and not pd.isna(t_sec) and t_sec <= TIME_THRESHOLD_SEC:
+                for cell_id in cells:
+                    valid_edges.append({
+                        'cell_id': cell_id,
+                        'station_id': chargers.at[c, 'station_id'],
+                        'time_min': float(t_sec / 60.0),
+                        'distance_km': float(dist),
+                        'slot': slot
+                    })
+
+        if valid_edges:
+            with saves(rows_in=len(valid_edges)):
+                save_edges(conn_matrix, pd.DataFrame(valid_edges))
+            total_saved += len(valid_edges)
+
         b_elapsed = time.time() - b_start
         total_processed += 1
-        print(f"  Done. Saved {total_saved - (total_saved - len(valid_edges) if 'valid_edges' in locals() else 0)} edges for this cell. ({b_elapsed:.2f}s)")
+        print(f"  Done. Saved {len(valid_edges)} edges for this origin. ({b_elapsed:.2f}s)")
 
     elapsed = time.time() - start_time
     print(f"\n--- MICRO-TEST COMPLETE ---")
     print(f"Total origins processed: {total_processed}")
+    print(f"Valhalla requests sent: {total_requests} ({len(slots)} slot(s))")
     print(f"Total reachable edges saved: {total_saved}")
-    print(f"Average time per origin: {elapsed/total_processed:.2f}s")
+    print(f"Average time per origin: {elapsed/max(total_processed, 1):.2f}s")
     print(f"Database size: {os.path.getsize(MATRIX_DB)/1024:.1f} KB")
+    conn_cache.close()
     conn_matrix.close()
 
 if __name__ == "__main__":
-    calculate_matrix()
-
-if __name__ == "__main__":
-    calculate_matrix()
+    with track('travel_matrix'):
+        calculate_matrix()
@@ -0,0 +1,89 @@
+import duckdb
+import pandas as pd
+import numpy as np
+import importlib.util
+import json
+import os
+import pyogrio
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CENSUS_GPKG = os.path.join(BASE_DIR, "../data/GRID1K21_CONT.gpkg")
+CACHE_DIR = os.path.join(BASE_DIR, "../data/cache")
+CENSUS_CACHE = os.path.join(CACHE_DIR, "census_grid.parquet")
+# Source path, size/mtime and columns the cache was built from
+CENSUS_CACHE_META = os.path.join(CACHE_DIR, "census_grid.json")
+
+# The only GeoPackage attributes any stage reads (census_stats, tourism)
+CENSUS_COLUMNS = [
+    'GRD_ID2021_OFICIAL',
+    'N_INDIVIDUOS',
+    'N_INDIVIDUOS_H',
+    'N_INDIVIDUOS_M',
+    'N_INDIVIDUOS_0_14',
+    'N_INDIVIDUOS_15_24',
+    'N_INDIVIDUOS_25_64',
+    'N_INDIVIDUOS_65_OU_MAIS',
+    'N_EDIFICIOS_CLASSICOS',
+    'N_ALOJAMENTOS_TOTAL',
+    'N_AGREGADOS_DOMESTICOS_PRIVADO',
+]
+
+# Arrow reads are several times faster; pyogrio falls back to its own reader without pyarrow
+USE_ARROW = importlib.util.find_spec("pyarrow") is not None
+
+def normalize_census_ids(official_ids):
+    """
+    Vectorized INE id normalization.
+    PT_CRS3035RES1000mN1729000E2730000 -> RES1kmN1729E2730, x_3035 2730000, y_3035 1729000
+    Returns (cell_id, x_3035, y_3035); None/NaN where the id does not match.
+    """
+    parts = pd.Series(official_ids).astype("string").str.extract(r'N(\d+)E(\d+)')
+    n_km = pd.to_numeric(parts[0]) // 1000
+    e_km = pd.to_numeric(parts[1]) // 1000
+    valid = n_km.notna() & e_km.notna()
+
+    cell_id = pd.Series(None, index=parts.index, dtype=object)
+    cell_id[valid] = "RES1kmN" + n_km[valid].astype(np.int64).astype(str) + "E" + e_km[valid].astype(np.int64).astype(str)
+    return cell_id.to_numpy(), (e_km * 1000).to_numpy(dtype=float), (n_km * 1000).to_numpy(dtype=float)
+
+def load_census(gpkg_path=CENSUS_GPKG, force=False):
+    """
+    Census grid attributes (CENSUS_COLUMNS present in the file) plus cell_id and
+    the cell's lower-left x_3035/y_3035. The GeoPackage is decoded once, without
+    geometry, and cached as typed Parquet; later calls read the cache unless the
+    GeoPackage (path, size, mtime) or CENSUS_COLUMNS changed.
+    """
+    source = _census_source(gpkg_path)
+    if force or not _cache_matches(source):
+        _cache_census(gpkg_path, source)
+    return duckdb.sql(f"SELECT * FROM read_parquet('{CENSUS_CACHE}')").df()
+
+def _census_source(gpkg_path):
+    stat = os.stat(gpkg_path)
+    return {'path': os.path.abspath(gpkg_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'columns': CENSUS_COLUMNS}
+
+def _cache_matches(source):
+    if not os.path.exists(CENSUS_CACHE) or not os.path.exists(CENSUS_CACHE_META):
+        return False
+    with open(CENSUS_CACHE_META) as f:
+        return json.load(f) == source
+
+def _cache_census(gpkg_path, source):
+    fields = set(pyogrio.read_info(gpkg_path)['fields'])
+    columns = [c for c in CENSUS_COLUMNS if c in fields]
+    print(f"Reading {len(columns)} columns from {gpkg_path}...")
+    df = pyogrio.read_dataframe(gpkg_path, columns=columns, read_geometry=False, use_arrow=USE_ARROW)
+    df = pd.DataFrame(df)
+    df['cell_id'], df['x_3035'], df['y_3035'] = normalize_census_ids(df['GRD_ID2021_OFICIAL'])
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = CENSUS_CACHE + ".tmp"
+    con = duckdb.connect()
+    con.register("census_df", df)
+    con.execute(f"COPY (SELECT * FROM census_df) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+    con.close()
+    os.replace(tmp_path, CENSUS_CACHE)
+    with open(CENSUS_CACHE_META + ".tmp", "w") as f:
+        json.dump(source, f, indent=2)
+    os.replace(CENSUS_CACHE_META + ".tmp", CENSUS_CACHE_META)
+    print(f"Cached {len(df)} census cells to {CENSUS_CACHE}")
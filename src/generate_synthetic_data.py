@@ -0,0 +1,479 @@
+"""
+Synthetic Input Generator
+
+Writes realistic stand-ins for every raw input the pipeline reads, with the
+exact file names, encodings and column layouts the scripts expect, so the
+whole pipeline can run (and be benchmarked) without the proprietary data drop:
+
+- GRID1K21_CONT.gpkg                      INE census grid (1km polygons, EPSG:3035)
+- Continente_CAOP2024_1.gpkg              CAOP parishes / municipalities (EPSG:3763)
+- Agregados_pub_2023.csv,
+  Sujeitos Passivos_pub_2023.csv          AT income tables (latin-1, headerless)
+- Estabelecimentos_de_Alojamento_Local.csv  RNAL lodging (LatLong "lat ; lon")
+- MOBIe_Lista_de_postos.csv               MobiE socket list
+- MOBIE_Tarifas.csv                       MobiE tariff components
+- detailed-YYYYMMDD.csv                   MobiE session exports (one fragment per day)
+- portugal-latest.osm.pbf                 roads, POIs and land use (needs pyosmium)
+
+Everything is drawn from one density surface: a Lisbon peak around the
+orchestrate_blocks test blocks plus a few towns, so road spacing, POIs,
+population, stations and sessions all thin out towards the rural edge.
+The row count of every file goes to synthetic_manifest.json.
+
+Usage (from src/):
+    python generate_synthetic_data.py /tmp/synth/data --scale 5
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from pyproj import Transformer
+
+# Marquês de Pombal (see the orchestrate_blocks test override)
+CENTER_X, CENTER_Y = 2664000, 1947000
+CELL_SIZE_M = 1000
+PARISH_KM = 5
+MUNICIPALITY_PARISHES = 2 # per side
+DISTRICT_MUNICIPALITIES = 2 # per side
+
+# Counts at scale 1
+BASE_STATIONS = 200
+BASE_SESSIONS = 20000
+BASE_LODGINGS = 2000
+PEAK_DENSITY = 12000 # residents per km2 at the centre
+
+START_DATE = pd.Timestamp('2026-01-01')
+
+OPERATORS = ['EDP', 'GALP', 'PRIO', 'IONITY', 'TESLA', 'POWERDOT', 'MOON', 'EVIO', 'HELEXIA', 'KLC', 'ATLANTE', 'REPSOL']
+CONNECTORS = ['Mennekes (Type 2)', 'CCS2', 'CHAdeMO', 'Schuko']
+VOLTAGES = ['Baixa Tensão Normal', 'Baixa Tensão Especial', 'Média Tensão']
+AC_POWERS = [3.7, 7.4, 11.0, 22.0]
+DC_POWERS = [50.0, 60.0, 150.0]
+
+_TO_4326 = Transformer.from_crs("EPSG:3035", "EPSG:4326", always_xy=True)
+
+def pt_decimal(values, fmt):
+    """Numbers as Portuguese-formatted strings ('%.1f' -> '22,0')."""
+    return np.char.replace(np.char.mod(fmt, np.asarray(values, dtype=float)), '.', ',')
+
+class DensitySurface:
+    """Relative urban intensity in [0, 1] over EPSG:3035: a Lisbon peak plus smaller towns."""
+
+    def __init__(self, extent, rng, n_towns=6):
+        xmin, ymin, xmax, ymax = extent
+        self.centers = [(CENTER_X, CENTER_Y, 1.0, 6000.0)]
+        for _ in range(n_towns):
+            self.centers.append((rng.uniform(xmin, xmax), rng.uniform(ymin, ymax), rng.uniform(0.15, 0.45), rng.uniform(1500, 3500)))
+
+    def __call__(self, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        d = np.zeros(np.broadcast(x, y).shape)
+        for cx, cy, peak, scale in self.centers:
+            d = np.maximum(d, peak * np.exp(-np.hypot(x - cx, y - cy) / scale))
+        return d
+
+    def sample(self, n, extent, rng, power=1.0):
+        """n points drawn with probability ~ density**power (rejection sampling)."""
+        xmin, ymin, xmax, ymax = extent
+        xs, ys = [np.empty(0)], [np.empty(0)]
+        while sum(len(v) for v in xs) < n:
+            x = rng.uniform(xmin, xmax, 4 * n)
+            y = rng.uniform(ymin, ymax, 4 * n)
+            keep = rng.uniform(size=4 * n) < np.clip(self(x, y), 0.01, 1.0) ** power
+            xs.append(x[keep])
+            ys.append(y[keep])
+        return np.concatenate(xs)[:n], np.concatenate(ys)[:n]
+
+def study_extent(extent_km):
+    """EPSG:3035 square of extent_km around the centre, aligned to the 10km blocks of orchestrate_blocks.py."""
+    half = extent_km * 1000 // 2
+    xmin = (CENTER_X - half) // 10000 * 10000
+    ymin = (CENTER_Y - half) // 10000 * 10000
+    return (xmin, ymin, xmin + extent_km * 1000, ymin + extent_km * 1000)
+
+def to_lonlat(x, y):
+    lon, lat = _TO_4326.transform(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    return np.asarray(lon), np.asarray(lat)
+
+def write_census(out_dir, extent, density, rng):
+    xmin, ymin, xmax, ymax = extent
+    gx, gy = np.meshgrid(np.arange(xmin, xmax, CELL_SIZE_M), np.arange(ymin, ymax, CELL_SIZE_M))
+    x, y = gx.ravel(), gy.ravel()
+    dens = density(x + CELL_SIZE_M / 2, y + CELL_SIZE_M / 2)
+    pop = rng.poisson(PEAK_DENSITY * dens ** 1.5 + 5)
+    # Empty rural cells are common in the real grid
+    pop[rng.uniform(size=len(pop)) < 0.15 * (1 - dens)] = 0
+
+    men = rng.binomial(pop, 0.475)
+    ages = np.stack([rng.multinomial(p, [0.13, 0.10, 0.53, 0.24]) for p in pop])
+    households = np.round(pop / rng.uniform(2.1, 2.7, len(pop)))
+    df = pd.DataFrame({
+        'GRD_ID2021_OFICIAL': [f"PT_CRS3035RES1000mN{int(b)}E{int(a)}" for a, b in zip(x, y)],
+        'N_INDIVIDUOS': pop.astype(float),
+        'N_INDIVIDUOS_H': men.astype(float),
+        'N_INDIVIDUOS_M': (pop - men).astype(float),
+        'N_INDIVIDUOS_0_14': ages[:, 0].astype(float),
+        'N_INDIVIDUOS_15_24': ages[:, 1].astype(float),
+        'N_INDIVIDUOS_25_64': ages[:, 2].astype(float),
+        'N_INDIVIDUOS_65_OU_MAIS': ages[:, 3].astype(float),
+        'N_EDIFICIOS_CLASSICOS': np.ceil(households / (1 + 15 * dens)),
+        'N_ALOJAMENTOS_TOTAL': np.ceil(households * 1.25),
+        'N_AGREGADOS_DOMESTICOS_PRIVADO': households,
+    })
+    grid = gpd.GeoDataFrame(df, geometry=shapely.box(x, y, x + CELL_SIZE_M, y + CELL_SIZE_M), crs="EPSG:3035")
+    path = os.path.join(out_dir, "GRID1K21_CONT.gpkg")
+    grid.to_file(path, layer="GRID1K21_CONT", driver="GPKG")
+    return {'GRID1K21_CONT.gpkg': len(grid)}, grid
+
+def admin_layout(extent):
+    """Square parishes nested in municipalities and districts, with CAOP-style DTMNFR codes."""
+    xmin, ymin, xmax, ymax = extent
+    size = PARISH_KM * 1000
+    px, py = np.meshgrid(np.arange(xmin, xmax, size), np.arange(ymin, ymax, size))
+    px, py = px.ravel(), py.ravel()
+    i, j = (px - xmin) // size, (py - ymin) // size
+    mi, mj = i // MUNICIPALITY_PARISHES, j // MUNICIPALITY_PARISHES
+    di, dj = mi // DISTRICT_MUNICIPALITIES, mj // DISTRICT_MUNICIPALITIES
+    n_dj = int(dj.max()) + 1
+    district = (di * n_dj + dj + 1).astype(int)
+    muni = ((mi % DISTRICT_MUNICIPALITIES) * DISTRICT_MUNICIPALITIES + (mj % DISTRICT_MUNICIPALITIES) + 1).astype(int)
+    parish = ((i % MUNICIPALITY_PARISHES) * MUNICIPALITY_PARISHES + (j % MUNICIPALITY_PARISHES) + 1).astype(int)
+    parishes = pd.DataFrame({
+        'dtmnfr': [f"{d:02d}{m:02d}{f:02d}" for d, m, f in zip(district, muni, parish)],
+        'x': px, 'y': py,
+    })
+    parishes['dtmn'] = parishes['dtmnfr'].str[:4]
+    parishes['freguesia'] = "Freguesia " + parishes['dtmnfr']
+    parishes['municipio'] = "Municipio " + parishes['dtmn']
+    parishes['distrito_ilha'] = "Distrito " + parishes['dtmnfr'].str[:2]
+    return gpd.GeoDataFrame(parishes, geometry=shapely.box(px, py, px + size, py + size), crs="EPSG:3035")
+
+def write_caop(out_dir, parishes):
+    path = os.path.join(out_dir, "Continente_CAOP2024_1.gpkg")
+    freguesias = parishes[['dtmnfr', 'freguesia', 'municipio', 'distrito_ilha', 'geometry']].to_crs("EPSG:3763")
+    freguesias.to_file(path, layer="cont_freguesias", driver="GPKG")
+    municipios = parishes.dissolve(by='dtmn', as_index=False)[['dtmn', 'municipio', 'geometry']].to_crs("EPSG:3763")
+    municipios.to_file(path, layer="cont_municipios", driver="GPKG", mode="a")
+    return {'Continente_CAOP2024_1.gpkg': len(freguesias)}
+
+def write_income(out_dir, parishes, census, rng):
+    """AT tables: metadata rows, NUTS rows, mainland municipalities, then an island block that must be ignored."""
+    centroids = census.geometry.centroid
+    muni_of_cell = gpd.sjoin(gpd.GeoDataFrame(census[['N_AGREGADOS_DOMESTICOS_PRIVADO', 'N_INDIVIDUOS']], geometry=centroids, crs=census.crs),
+                             parishes[['dtmn', 'geometry']], predicate='within')
+    munis = muni_of_cell.groupby('dtmn')[['N_AGREGADOS_DOMESTICOS_PRIVADO', 'N_INDIVIDUOS']].sum()
+    names = parishes.drop_duplicates('dtmn').set_index('dtmn')['municipio']
+
+    def number(v, suppressed):
+        if suppressed:
+            return '§'
+        return f"{v:,.1f}".replace(',', ' ').replace('.', ',')
+
+    def table(n_cols, values_for):
+        rows = [["Tabela sintética"] + [""] * (n_cols - 1), ["Unidade: euros"] + [""] * (n_cols - 1)]
+        rows.append(["PT", "País", "Portugal"] + [""] * (n_cols - 3))
+        rows.append(["1", "NUTS 1", "Continente"] + [""] * (n_cols - 3))
+        for dtmn in munis.index:
+            row = [dtmn, "Município", names[dtmn]] + [""] * (n_cols - 3)
+            for col, text in values_for(dtmn).items():
+                row[col] = text
+            rows.append(row)
+        rows.append(["2", "NUTS 1", "Região Autónoma dos Açores"] + [""] * (n_cols - 3))
+        rows.append(["4201", "Município", "Ponta Delgada"] + ["1 000,0"] * (n_cols - 3))
+        return "\n".join(";".join(r) for r in rows) + "\n"
+
+    wealth = {d: rng.uniform(0.8, 1.3) for d in munis.index}
+    def agregados(dtmn):
+        hh = munis.at[dtmn, 'N_AGREGADOS_DOMESTICOS_PRIVADO']
+        avg = 14000 * wealth[dtmn] * (1 + 0.4 * rng.uniform())
+        # Small municipalities get suppressed percentiles, as in the real tables
+        small = hh < 200
+        return {3: number(hh, False), 6: number(avg, False), 12: number(avg * 0.8, small),
+                17: number(avg * 2.1, small), 35: number(rng.uniform(25, 40), small)}
+    def passivos(dtmn):
+        return {3: number(munis.at[dtmn, 'N_INDIVIDUOS'] * 0.62, False)}
+
+    for name, n_cols, values_for in [("Agregados_pub_2023.csv", 40, agregados), ("Sujeitos Passivos_pub_2023.csv", 6, passivos)]:
+        with open(os.path.join(out_dir, name), 'w', encoding='latin-1') as f:
+            f.write(table(n_cols, values_for))
+    return {"Agregados_pub_2023.csv": len(munis), "Sujeitos Passivos_pub_2023.csv": len(munis)}
+
+def make_lodging(extent, density, rng, n):
+    # Tourism concentrates in the centre harder than residents do
+    x, y = density.sample(n, extent, rng, power=2.0)
+    lon, lat = to_lonlat(x, y)
+    latlong = np.char.add(np.char.add(pt_decimal(lat, '%.12f'), ' ; '), pt_decimal(lon, '%.12f')).astype(object)
+    latlong[rng.uniform(size=n) < 0.005] = "" # a few unparsable rows
+    return pd.DataFrame({
+        'NrRNAL': np.arange(100000, 100000 + n),
+        'Modalidade': rng.choice(['Apartamento', 'Moradia', 'Quartos', 'Estabelecimento de hospedagem'], n, p=[0.6, 0.2, 0.12, 0.08]),
+        'NrUtentes': rng.choice([2, 4, 6, 8, 12, 20], n, p=[0.3, 0.35, 0.15, 0.1, 0.06, 0.04]),
+        'LatLong': latlong,
+    })
+
+def write_lodging(out_dir, extent, density, rng, n):
+    df = make_lodging(extent, density, rng, n)
+    df.to_csv(os.path.join(out_dir, "Estabelecimentos_de_Alojamento_Local.csv"), index=False)
+    return {"Estabelecimentos_de_Alojamento_Local.csv": n}
+
+def make_stations(extent, density, rng, n):
+    x, y = density.sample(n, extent, rng, power=1.0)
+    lon, lat = to_lonlat(x, y)
+    dens = density(x, y)
+    is_dc = rng.uniform(size=n) < 0.15 + 0.15 * (1 - dens) # fast chargers along rural corridors
+    operator_p = np.array([0.3, 0.12, 0.1, 0.05, 0.05, 0.08, 0.06, 0.06, 0.05, 0.05, 0.04, 0.04])
+    return pd.DataFrame({
+        'ID': [f"{'LSB' if d > 0.3 else 'PRT'}-{i:05d}" for i, d in enumerate(dens)],
+        'x': x, 'y': y, 'lon': lon, 'lat': lat,
+        'is_dc': is_dc,
+        'sockets': np.where(is_dc, rng.integers(1, 3, n), rng.integers(1, 5, n)),
+        'power_kw': np.where(is_dc, rng.choice(DC_POWERS, n), rng.choice(AC_POWERS, n)),
+        'operator': rng.choice(OPERATORS, n, p=operator_p / operator_p.sum()),
+        'city': np.where(dens > 0.3, 'Lisboa', 'Outra'),
+        'weight': 0.2 + dens + is_dc,
+    })
+
+def write_station_list(out_dir, stations, rng):
+    s = stations.loc[stations.index.repeat(stations['sockets'])].reset_index(drop=True)
+    socket_no = s.groupby('ID').cumcount() + 1
+    power = pt_decimal(s['power_kw'], '%.1f').astype(object)
+    power[rng.uniform(size=len(s)) < 0.02] = "" # missing power, as in the real list
+    connector = np.where(s['is_dc'], rng.choice(['CCS2', 'CHAdeMO'], len(s), p=[0.8, 0.2]),
+                         rng.choice(['Mennekes (Type 2)', 'Schuko'], len(s), p=[0.9, 0.1]))
+    lat = s['lat'].round(8).astype(object)
+    lat[rng.uniform(size=len(s)) < 0.002] = None # a few stations without coordinates
+    df = pd.DataFrame({
+        'ID': s['ID'],
+        ' LATITUDE': lat, # real header names carry stray spaces
+        'LONGITUDE ': s['lon'].round(8),
+        'OPERADOR': s['operator'],
+        'CIDADE': s['city'],
+        'MORADA': "Rua Sintética " + s.index.astype(str),
+        'UID DA TOMADA': s['ID'] + "-" + socket_no.astype(str),
+        'POTÊNCIA DA TOMADA (kW)': power,
+        'NÍVEL DE TENSÃO': np.where(s['is_dc'], VOLTAGES[2], rng.choice(VOLTAGES[:2], len(s), p=[0.85, 0.15])),
+        'TIPO DE TOMADA': connector,
+    })
+    df.to_csv(os.path.join(out_dir, "MOBIe_Lista_de_postos.csv"), sep=';', index=False, encoding='utf-8-sig')
+    return {"MOBIe_Lista_de_postos.csv": len(df)}
+
+def make_tariffs(stations, rng):
+    """Tariff component rows (ID, TIPO_TARIFARIO, TIPO_TARIFA, TARIFA) as in MOBIE_Tarifas.csv."""
+    rows = []
+    for sid, is_dc in zip(stations['ID'], stations['is_dc']):
+        energy = rng.uniform(0.35, 0.6) if is_dc else rng.uniform(0.15, 0.35)
+        regular = [('ENERGY', f"€ {energy:.4f} /kWh")]
+        if rng.uniform() < 0.4:
+            regular.append(('TIME', f"€ {rng.uniform(0.01, 0.08):.4f} /min"))
+        if rng.uniform() < 0.3:
+            regular.append(('FLAT', f"€ {rng.uniform(0.1, 0.5):.3f} /charge"))
+        if is_dc and rng.uniform() < 0.5:
+            regular.append(('PARKING_TIME', f"€ {rng.uniform(0.1, 0.3):.4f} /min"))
+        # Ad-hoc sometimes omits components, which prices step 4 corrects for
+        adhoc = [(kind, text.replace(text.split()[1], f"{float(text.split()[1]) * rng.uniform(1.0, 1.3):.4f}"))
+                 for kind, text in regular if kind == 'ENERGY' or rng.uniform() < 0.7]
+        rows += [(sid, 'REGULAR', kind, text) for kind, text in regular]
+        rows += [(sid, 'AD_HOC_PAYMENT', kind, text) for kind, text in adhoc]
+        if rng.uniform() < 0.1:
+            rows.append((sid, 'SUBSCRIPTION', 'ENERGY', f"€ {energy * 0.8:.4f} /kWh"))
+    return pd.DataFrame(rows, columns=['ID', 'TIPO_TARIFARIO', 'TIPO_TARIFA', 'TARIFA'])
+
+def write_tariffs(out_dir, stations, rng):
+    df = make_tariffs(stations, rng)
+    df.to_csv(os.path.join(out_dir, "MOBIE_Tarifas.csv"), sep=';', index=False, encoding='utf-8-sig')
+    return {"MOBIE_Tarifas.csv": len(df)}
+
+def make_sessions(stations, rng, n, days):
+    """One row per session: station, start/end, total kWh."""
+    st = rng.choice(len(stations), n, p=(stations['weight'] / stations['weight'].sum()).to_numpy())
+    is_dc = stations['is_dc'].to_numpy()[st]
+    power = stations['power_kw'].to_numpy()[st]
+
+    # Morning and evening arrival peaks
+    hour = np.where(rng.uniform(size=n) < 0.55, rng.normal(9.5, 2.5, n), rng.normal(18.5, 2.5, n)) % 24
+    start = START_DATE + pd.to_timedelta(rng.integers(0, days, n), unit='D') + pd.to_timedelta(np.round(hour * 3600), unit='s')
+    # DC: short top-ups; AC: errands or overnight
+    minutes = np.where(is_dc, rng.lognormal(np.log(35), 0.4, n),
+                       np.where(rng.uniform(size=n) < 0.6, rng.lognormal(np.log(120), 0.6, n), rng.lognormal(np.log(660), 0.3, n)))
+    minutes = np.clip(minutes, 3, 47 * 60)
+    end = start + pd.to_timedelta(np.round(minutes * 60), unit='s')
+    kwh = np.minimum(power * minutes / 60 * rng.uniform(0.5, 0.95, n), rng.uniform(20, 75, n))
+
+    ids = stations['ID'].to_numpy()[st].astype(object)
+    ids[rng.uniform(size=n) < 0.01] = "UNKNOWN-00001" # sessions at stations missing from the list
+    return pd.DataFrame({'idCdr': [f"cdr{i:09d}" for i in range(n)], 'station': ids, 'power': power,
+                         'start': start, 'end': end, 'kwh': kwh})
+
+def session_fragments(sessions):
+    """Splits sessions at midnight into per-day fragments with pro-rata energy."""
+    day0 = sessions['start'].dt.normalize()
+    n_days = ((sessions['end'] - pd.Timedelta(seconds=1)).dt.normalize() - day0).dt.days.to_numpy() + 1
+    rep = np.repeat(np.arange(len(sessions)), n_days)
+    offset = np.arange(len(rep)) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+    f = sessions.iloc[rep].reset_index(drop=True)
+    day = day0.iloc[rep].reset_index(drop=True) + pd.to_timedelta(offset, unit='D')
+    f_start = np.maximum(f['start'], day)
+    f_end = np.minimum(f['end'], day + pd.Timedelta(days=1))
+    total_min = (f['end'] - f['start']).dt.total_seconds() / 60
+    period_min = (f_end - f_start).dt.total_seconds() / 60
+    f['idDay'] = day.dt.strftime('%Y%m%d')
+    f['total_min'] = total_min
+    f['period_min'] = period_min
+    f['period_kwh'] = f['kwh'] * period_min / total_min
+    return f
+
+def write_session_exports(out_dir, sessions, exports, days, rng):
+    """detailed-YYYYMMDD.csv per export window (by session start), named after the window's last day."""
+    counts = {}
+    bounds = np.linspace(0, days, exports + 1).round().astype(int)
+    start_day = (sessions['start'].dt.normalize() - START_DATE).dt.days.to_numpy()
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        f = session_fragments(sessions[(start_day >= lo) & (start_day < hi)])
+        stop = f['end'].dt.strftime('%Y%m%d%H%M%S').astype(object)
+        stop[rng.uniform(size=len(f)) < 0.001] = "" # unparsable, dropped at ingestion
+        df = pd.DataFrame({
+            'idCdr': f['idCdr'],
+            'idUsage': 'u' + f.index.astype(str),
+            'idServiceProvider': rng.choice(['PRIO', 'EDP', 'GALP', 'MIIO'], len(f)),
+            'idInternalNumber': 'x',
+            'type': rng.choice(['RFID', 'APP'], len(f)),
+            'idNetworkOperator': 'ENBL',
+            'idChargingStation': f['station'],
+            'idEVSE': f['station'] + "-1",
+            'evse_max_power': pt_decimal(f['power'], '%.1f'),
+            'startTimestamp': f['start'].dt.strftime('%Y%m%d%H%M%S'),
+            'stopTimestamp': stop,
+            'totalDuration': pt_decimal(f['total_min'], '%.1f'),
+            'energia_total_transacao': pt_decimal(f['kwh'], '%.3f'),
+            'idDay': f['idDay'],
+            'periodDuration': pt_decimal(f['period_min'], '%.2f'),
+            'energia_total_periodo': pt_decimal(f['period_kwh'], '%.3f'),
+        })
+        name = f"detailed-{(START_DATE + pd.Timedelta(days=int(hi) - 1)):%Y%m%d}.csv"
+        df.to_csv(os.path.join(out_dir, name), sep=';', index=False, encoding='utf-8-sig')
+        counts[name] = len(df)
+    return counts
+
+def osm_features(extent, density, rng):
+    """
+    Road lattice (denser towards the centre), one land-use polygon per cell and POIs,
+    in EPSG:3035. Returns (ways, pois): ways as (vertex array, tags), pois as x, y, key, value.
+    """
+    xmin, ymin, xmax, ymax = extent
+    step = 250 # lattice resolution: roads share vertices where they cross
+    def line(xs, ys):
+        return np.column_stack(np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)))
+
+    ways = []
+    # Arterials span the extent; local streets only where the cell is dense enough.
+    # Arterials carry maxspeed; local streets fall back to the highway default like much of real OSM
+    classes = [(5000, 'primary', '90'), (2500, 'secondary', '70'), (1000, 'tertiary', 'PT:urban')]
+    for k, (spacing, highway, maxspeed) in enumerate(classes):
+        # Each line gets the class of the widest spacing it falls on
+        lines = lambda lo, hi: [v for v in np.arange(lo, hi + 1, spacing) if all((v - lo) % s for s, _, _ in classes[:k])]
+        for x in lines(xmin, xmax):
+            ways.append((line(x, np.arange(ymin, ymax + 1, step)), {'highway': highway, 'maxspeed': maxspeed}))
+        for y in lines(ymin, ymax):
+            ways.append((line(np.arange(xmin, xmax + 1, step), y), {'highway': highway, 'maxspeed': maxspeed}))
+    for cx in np.arange(xmin, xmax, CELL_SIZE_M):
+        for cy in np.arange(ymin, ymax, CELL_SIZE_M):
+            d = float(density(cx + 500, cy + 500))
+            local = 250 if d > 0.4 else 500 if d > 0.1 else None
+            if local is not None:
+                for off in range(local, CELL_SIZE_M, local):
+                    ways.append((line(cx + off, cy + np.arange(0, CELL_SIZE_M + 1, step)), {'highway': 'residential'}))
+                    ways.append((line(cx + np.arange(0, CELL_SIZE_M + 1, step), cy + off), {'highway': 'residential'}))
+            landuse = 'commercial' if d > 0.7 else 'residential' if d > 0.25 else rng.choice(['farmland', 'forest', 'meadow'])
+            ring = line([cx + 50, cx + 950, cx + 950, cx + 50, cx + 50], [cy + 50, cy + 50, cy + 950, cy + 950, cy + 50])
+            ways.append((ring, {'landuse': str(landuse)}))
+
+    poi_tags = [('amenity', 'restaurant'), ('amenity', 'cafe'), ('amenity', 'parking'), ('amenity', 'fuel'),
+                ('amenity', 'school'), ('amenity', 'pharmacy'), ('shop', 'supermarket'), ('shop', 'convenience'),
+                ('shop', 'bakery'), ('tourism', 'hotel'), ('tourism', 'museum')]
+    n_pois = int(sum(rng.poisson(60 * density(cx + 500, cy + 500))
+                     for cx in np.arange(xmin, xmax, CELL_SIZE_M) for cy in np.arange(ymin, ymax, CELL_SIZE_M)))
+    px, py = density.sample(n_pois, extent, rng)
+    kinds = rng.integers(len(poi_tags), size=n_pois)
+    pois = pd.DataFrame({'x': px, 'y': py, 'key': [poi_tags[k][0] for k in kinds], 'value': [poi_tags[k][1] for k in kinds]})
+    return ways, pois
+
+def write_osm_pbf(out_dir, extent, density, rng):
+    try:
+        import osmium
+    except ImportError:
+        print("  [WARN] pyosmium not installed; skipping portugal-latest.osm.pbf (pip install osmium).")
+        return {}
+    path = os.path.join(out_dir, "portugal-latest.osm.pbf")
+    if os.path.exists(path):
+        os.remove(path)
+    ways, pois = osm_features(extent, density, rng)
+
+    # Ways that cross share a node
+    node_ids = {}
+    refs = []
+    for coords, _ in ways:
+        refs.append([node_ids.setdefault((int(x), int(y)), len(node_ids) + 1) for x, y in coords])
+    lattice = np.array(list(node_ids), dtype=float)
+    lon, lat = to_lonlat(lattice[:, 0], lattice[:, 1])
+    plon, plat = to_lonlat(pois['x'], pois['y'])
+
+    writer = osmium.SimpleWriter(path)
+    for i in range(len(lattice)):
+        writer.add_node(osmium.osm.mutable.Node(id=i + 1, location=osmium.osm.Location(lon[i], lat[i])))
+    for k, (key, value) in enumerate(zip(pois['key'], pois['value'])):
+        writer.add_node(osmium.osm.mutable.Node(id=len(lattice) + k + 1, location=osmium.osm.Location(plon[k], plat[k]),
+                                                tags={key: value, 'name': f"{value} {k}"}))
+    for w, ((_, tags), nodes) in enumerate(zip(ways, refs)):
+        writer.add_way(osmium.osm.mutable.Way(id=w + 1, nodes=nodes, tags=tags))
+    writer.close()
+    return {"portugal-latest.osm.pbf": len(ways)}
+
+def generate(out_dir, scale=1.0, extent_km=40, days=28, exports=4, seed=0):
+    """Writes every synthetic input to out_dir and returns the manifest (file -> rows)."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    extent = study_extent(extent_km)
+    density = DensitySurface(extent, rng)
+    manifest = {}
+
+    print("--- 1. Census Grid ---")
+    counts, census = write_census(out_dir, extent, density, rng)
+    manifest.update(counts)
+    print("--- 2. CAOP & Income Tables ---")
+    parishes = admin_layout(extent)
+    manifest.update(write_caop(out_dir, parishes))
+    manifest.update(write_income(out_dir, parishes, census, rng))
+    print("--- 3. Alojamento Local ---")
+    manifest.update(write_lodging(out_dir, extent, density, rng, int(BASE_LODGINGS * scale)))
+    print("--- 4. MobiE Stations & Tariffs ---")
+    stations = make_stations(extent, density, rng, max(int(BASE_STATIONS * scale), 2))
+    manifest.update(write_station_list(out_dir, stations, rng))
+    manifest.update(write_tariffs(out_dir, stations, rng))
+    print("--- 5. MobiE Session Exports ---")
+    sessions = make_sessions(stations, rng, int(BASE_SESSIONS * scale), days)
+    manifest.update(write_session_exports(out_dir, sessions, exports, days, rng))
+    print("--- 6. OSM Extract ---")
+    manifest.update(write_osm_pbf(out_dir, extent, density, rng))
+
+    with open(os.path.join(out_dir, "synthetic_manifest.json"), 'w') as f:
+        json.dump({'params': {'scale': scale, 'extent_km': extent_km, 'days': days, 'exports': exports, 'seed': seed,
+                              'extent_3035': [int(v) for v in extent]},
+                   'rows': manifest}, f, indent=2)
+    for name, rows in manifest.items():
+        print(f"  {name}: {rows:,} rows")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic pipeline inputs.")
+    parser.add_argument('out_dir', help="target data directory")
+    parser.add_argument('--scale', type=float, default=1.0, help=f"x{BASE_STATIONS} stations, x{BASE_SESSIONS} sessions, x{BASE_LODGINGS} lodgings")
+    parser.add_argument('--extent-km', type=int, default=40, help="side of the square area around Lisbon (multiple of 10)")
+    parser.add_argument('--days', type=int, default=28, help="days of charging sessions")
+    parser.add_argument('--exports', type=int, default=4, help="number of detailed-*.csv exports")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.scale, args.extent_km, args.days, args.exports, args.seed)
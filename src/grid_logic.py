@@ -0,0 +1,42 @@
+import numpy as np
+from pyproj import Transformer
+
+CELL_SIZE_M = 1000
+
+_TO_3035 = Transformer.from_crs("EPSG:4326", "EPSG:3035", always_xy=True)
+
+def cell_id(x_3035, y_3035):
+    """
+    Grid spine ids (RES1kmN{y_km}E{x_km}) of the cells containing x/y (EPSG:3035).
+    Object array; None where a coordinate is missing.
+    """
+    x = np.asarray(x_3035, dtype=float)
+    y = np.asarray(y_3035, dtype=float)
+    valid = np.isfinite(x) & np.isfinite(y)
+    y_km = np.where(valid, y // CELL_SIZE_M, 0).astype(np.int64).astype(str)
+    x_km = np.where(valid, x // CELL_SIZE_M, 0).astype(np.int64).astype(str)
+    ids = np.char.add(np.char.add(np.char.add("RES1kmN", y_km), "E"), x_km).astype(object)
+    ids[~valid] = None
+    return ids
+
+def lonlat_to_3035(lon, lat):
+    """Vectorized WGS84 -> EPSG:3035 (x, y) in metres."""
+    x, y = _TO_3035.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    return np.asarray(x), np.asarray(y)
+
+def lonlat_to_cell(lon, lat):
+    """
+    Vectorized WGS84 -> 1km grid cell. Returns (x_3035, y_3035, cell_id) with x/y
+    the cell's lower-left corner, as in grid_spine.
+    """
+    x, y = lonlat_to_3035(lon, lat)
+    x = np.floor(np.asarray(x) / CELL_SIZE_M) * CELL_SIZE_M
+    y = np.floor(np.asarray(y) / CELL_SIZE_M) * CELL_SIZE_M
+    return x, y, cell_id(x, y)
+
+def cells_within(x, y, radius_m):
+    """Ids of every cell overlapping the square of half-side radius_m around one EPSG:3035 point."""
+    xs = np.arange(np.floor((x - radius_m) / CELL_SIZE_M), np.floor((x + radius_m) / CELL_SIZE_M) + 1) * CELL_SIZE_M
+    ys = np.arange(np.floor((y - radius_m) / CELL_SIZE_M), np.floor((y + radius_m) / CELL_SIZE_M) + 1) * CELL_SIZE_M
+    gx, gy = np.meshgrid(xs, ys)
+    return list(cell_id(gx.ravel(), gy.ravel()))
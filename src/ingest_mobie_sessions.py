@@ -0,0 +1,128 @@
+"""
+Mobi.E Session Ingestion (CSV -> typed Parquet)
+
+Streams a detailed-*.csv session export through DuckDB's CSV reader instead
+of loading it whole into pandas. Only the columns the session stages use are
+projected, Portuguese number formats ('1.234,5') are parsed by the reader
+itself and timestamps are parsed natively, so memory stays bounded regardless
+of the export size.
+
+Output: data/session_fragments/<export name>.parquet, one row per fragment.
+"""
+
+import duckdb
+import pandas as pd
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(BASE_DIR, "../data/detailed-20260116.csv")
+FRAGMENTS_DIR = os.path.join(BASE_DIR, "../data/session_fragments")
+
+# Caps DuckDB's buffer pool; larger exports spill instead of growing RAM
+MEMORY_LIMIT = "2GB"
+
+FRAGMENT_COLUMNS = ['idCdr', 'idChargingStation', 'idDay', 'startTimestamp', 'stopTimestamp', 'energia_total_periodo']
+
+def fragments_path(csv_path):
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(FRAGMENTS_DIR, f"{name}.parquet")
+
+def _header_map(csv_path):
+    # Exports carry padded header names; map the stripped name to the raw one
+    with open(csv_path, encoding='utf-8-sig') as f:
+        header = f.readline().rstrip('\r\n').split(';')
+    return {h.strip(): h for h in header}
+
+def ingest_session_csv(csv_path=CSV_PATH, force=False):
+    """
+    Converts one export to Parquet (skipped if the Parquet is newer than the CSV).
+    Returns the Parquet path.
+    """
+    out_path = fragments_path(csv_path)
+    if not force and os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(csv_path):
+        return out_path
+
+    header = _header_map(csv_path)
+    missing = [c for c in FRAGMENT_COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f"{csv_path} is missing columns: {missing}")
+    col = {c: '"' + header[c].replace('"', '""') + '"' for c in FRAGMENT_COLUMNS}
+
+    os.makedirs(FRAGMENTS_DIR, exist_ok=True)
+    tmp_path = out_path + ".tmp"
+
+    con = duckdb.connect()
+    con.execute(f"SET memory_limit = '{MEMORY_LIMIT}'")
+    con.execute(f"""
+        COPY (
+            SELECT
+                {col['idCdr']}::VARCHAR as idCdr,
+                {col['idChargingStation']}::VARCHAR as idChargingStation,
+                {col['idDay']}::BIGINT as idDay,
+                try_strptime({col['startTimestamp']}, '%Y%m%d%H%M%S') as "start",
+                try_strptime({col['stopTimestamp']}, '%Y%m%d%H%M%S') as "end",
+                -- Malformed values count as 0 kWh instead of failing the export
+                COALESCE(TRY_CAST(replace(replace({col['energia_total_periodo']}, '.', ''), ',', '.') AS DOUBLE), 0.0) as energia_total_periodo
+            FROM read_csv(?, delim=';', header=true, quote='"',
+                          types={{{header['startTimestamp']!r}: 'VARCHAR', {header['stopTimestamp']!r}: 'VARCHAR',
+                                  {header['energia_total_periodo']!r}: 'VARCHAR'}})
+        ) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD)
+    """, [csv_path])
+    rows = con.execute(f"SELECT count(*) FROM read_parquet('{tmp_path}')").fetchone()[0]
+    con.close()
+
+    os.replace(tmp_path, out_path)
+    print(f"Ingested {rows} fragments from {os.path.basename(csv_path)} -> {out_path}")
+    return out_path
+
+def create_fragments_view(con, parquet_paths, where="TRUE"):
+    """
+    Temp view `fragments` over the given exports (in export order). If several
+    exports contain the same (idCdr, idDay) fragment, the most recent one wins.
+    """
+    paths_sql = "[" + ", ".join("'" + p.replace("'", "''") + "'" for p in parquet_paths) + "]"
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW fragments AS
+        SELECT * FROM (
+            SELECT *, list_position({paths_sql}, filename) as file_rank
+            FROM read_parquet({paths_sql}, filename=true, file_row_number=true)
+            WHERE {where}
+        )
+        QUALIFY file_rank = max(file_rank) OVER (PARTITION BY idCdr, idDay)
+    """)
+
+def load_fragments(parquet_paths, cdrs=None, station_days=None):
+    """
+    Reads fragments (with parsed timestamps) into pandas, dropping unparsable rows.
+
+    parquet_paths are in export order (see create_fragments_view). Optional filters:
+    cdrs (iterable of idCdr) and station_days (DataFrame idChargingStation, idDay).
+    Rows keep file/row order so per-day sums are reproducible.
+    """
+    paths = [parquet_paths] if isinstance(parquet_paths, str) else list(parquet_paths)
+    if not paths:
+        return pd.DataFrame(columns=['idCdr', 'idChargingStation', 'idDay', 'start', 'end', 'start_day', 'energia_total_periodo'])
+
+    con = duckdb.connect()
+    filters = []
+    if cdrs is not None:
+        con.register("tmp_cdrs", pd.DataFrame({'idCdr': pd.Series(list(cdrs), dtype=object)}))
+        filters.append("idCdr IN (SELECT idCdr FROM tmp_cdrs)")
+    if station_days is not None:
+        con.register("tmp_station_days", station_days[['idChargingStation', 'idDay']])
+        filters.append("(idChargingStation, idDay) IN (SELECT idChargingStation, idDay FROM tmp_station_days)")
+    where = " AND ".join(['"start" IS NOT NULL', '"end" IS NOT NULL'] + filters)
+
+    create_fragments_view(con, paths, where)
+    df = con.execute("""
+        SELECT idCdr, idChargingStation, idDay, "start", "end",
+               strftime("start", '%Y%m%d') as start_day, energia_total_periodo
+        FROM fragments
+        ORDER BY file_rank, file_row_number
+    """).df()
+    con.close()
+    return df
+
+if __name__ == "__main__":
+    ingest_session_csv(sys.argv[1] if len(sys.argv) > 1 else CSV_PATH, force=True)
@@ -3,6 +3,7 @@ import pandas as pd
 import geopandas as gpd
 from pyrosm import OSM
 from process_cell_logic import analyze_single_cell
+from run_metrics import track
 import os
 import numpy as np
 
@@ -31,25 +32,37 @@ def orchestrate():
     
     print(f"Test Blocks to process: {len(xs) * len(ys)}")
     
-    for bx in xs:
-        for by in ys:
-            # 1. Get cells in this block
-            block_cells = con.execute(f"""
-                SELECT * FROM grid_spine 
-                WHERE x_3035 >= {bx} AND x_3035 < {bx + block_size}
-                AND y_3035 >= {by} AND y_3035 < {by + block_size}
-            """).df()
-            
-            if block_cells.empty: continue
-            
-            print(f"Processing Block X={bx} Y={by} ({len(block_cells)} cells)...")
-            
-            # Get block bbox in WGS84 for extraction
-            b_min_lon, b_min_lat = block_cells[['min_lon', 'min_lat']].min()
-            b_max_lon, b_max_lat = block_cells[['max_lon', 'max_lat']].max()
-            bbox = [b_min_lon, b_min_lat, b_max_lon, b_max_lat]
-            
-            # 2. Extract Data Once per Block
+    with track('osm_blocks') as total:
+        total['rows_out'] = 0
+        for bx in xs:
+            for by in ys:
+                total['rows_out'] += process_block(con, bx, by, block_size)
+
+    con.close()
+    print("Orchestration Complete.")
+
+def process_block(con, bx, by, block_size):
+    """Extracts, analyzes and saves one block. Returns the number of cells analyzed."""
+    key = f"X={bx} Y={by}"
+    # 1. Get cells in this block
+    block_cells = con.execute(f"""
+        SELECT * FROM grid_spine 
+        WHERE x_3035 >= {bx} AND x_3035 < {bx + block_size}
+        AND y_3035 >= {by} AND y_3035 < {by + block_size}
+    """).df()
+    
+    if block_cells.empty: return 0
+    
+    print(f"Processing Block X={bx} Y={by} ({len(block_cells)} cells)...")
+    
+    # Get block bbox in WGS84 for extraction
+    b_min_lon, b_min_lat = block_cells[['min_lon', 'min_lat']].min()
+    b_max_lon, b_max_lat = block_cells[['max_lon', 'max_lat']].max()
+    bbox = [b_min_lon, b_min_lat, b_max_lon, b_max_lat]
+    
+    with track('osm_blocks', 'block', key, rows_in=len(block_cells), profile=True) as block:
+        # 2. Extract Data Once per Block
+        with track('osm_blocks', 'extract', key) as m:
             try:
                 osm = OSM(pbf_path, bounding_box=bbox)
                 roads = osm.get_network(network_type="driving")
@@ -67,14 +80,16 @@ def orchestrate():
                     
             except Exception as e:
                 print(f"  Error extracting block data: {e}")
-                continue
+                return 0
+            m['rows_out'] = sum(len(g) for g in (roads, pois, lu, nat) if g is not None)
 
-            # 3. Process Cell by Cell
-            road_results = []
-            poi_results = []
-            poly_results = []
-            origin_results = []
-            
+        # 3. Process Cell by Cell
+        road_results = []
+        poi_results = []
+        poly_results = []
+        origin_results = []
+        
+        with track('osm_blocks', 'analyze', key, rows_in=len(block_cells)) as m:
             for _, cell in block_cells.iterrows():
                 res = analyze_single_cell(cell, roads, pois, lu, nat)
                 if res:
@@ -82,8 +97,10 @@ def orchestrate():
                     poi_results.append(res['poi_stats'])
                     poly_results.append(res['poly_stats'])
                     origin_results.extend(res['origins'])
-            
-            # 4. Save Block Results to DuckDB
+            m['rows_out'] = len(road_results)
+        
+        # 4. Save Block Results to DuckDB
+        with track('osm_blocks', 'save', key) as m:
             if road_results:
                 save_to_db(con, "road_stats", pd.DataFrame(road_results))
             if poi_results:
@@ -92,9 +109,10 @@ def orchestrate():
                 save_to_db(con, "poly_stats", pd.DataFrame(poly_results))
             if origin_results:
                 save_to_db(con, "cell_origins", pd.DataFrame(origin_results))
+            m['rows_in'] = len(road_results) + len(poi_results) + len(poly_results) + len(origin_results)
+        block['rows_out'] = len(road_results)
 
-    con.close()
-    print("Orchestration Complete.")
+    return len(road_results)
 
 def save_to_db(con, table_name, df):
     # Flexible column handling
@@ -1,37 +1,19 @@
-import geopandas as gpd
 import duckdb
-import pandas as pd
-import re
 import os
+from census_logic import load_census
 
 gpkg_path = "../data/GRID1K21_CONT.gpkg"
 db_path = "../data/osm_analysis.db"
 
-def normalize_census_id(official_id):
-    """
-    Transforms official INE ID to our standard format.
-    PT_CRS3035RES1000mN1729000E2730000 -> RES1kmN1729E2730
-    """
-    if not isinstance(official_id, str):
-        return None
-    match = re.search(r'N(\d+)E(\d+)', official_id)
-    if match:
-        n = int(match.group(1)) // 1000
-        e = int(match.group(2)) // 1000
-        return f"RES1kmN{n}E{e}"
-    return None
-
 def process_census():
     if not os.path.exists(gpkg_path):
         print(f"Error: {gpkg_path} not found.")
         return
 
     print(f"Loading {gpkg_path}...")
-    # We don't need the geometry for this table, just the attributes
-    df = gpd.read_file(gpkg_path, ignore_geometry=True)
-    
-    print(f"Normalizing IDs for {len(df)} rows...")
-    df['cell_id'] = df['GRD_ID2021_OFICIAL'].apply(normalize_census_id)
+    # Attributes only, ids already normalized (RES1km...); cached as Parquet after the first read
+    df = load_census(gpkg_path)
+    print(f"Loaded {len(df)} census cells.")
     
     # Select and rename columns for readability
     rename_map = {
@@ -1,8 +1,6 @@
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
 import duckdb
-import os
+from areal_interpolation import load_overlap_weights, interpolate_primary, interpolate_extensive, interpolate_intensive
 
 # Paths
 AGREGADOS_CSV = "../data/Agregados_pub_2023.csv"
@@ -10,15 +8,14 @@ PASSIVOS_CSV = "../data/Sujeitos Passivos_pub_2023.csv"
 CAOP_GPKG = "../data/Continente_CAOP2024_1.gpkg"
 DB_PATH = "../data/osm_analysis.db"
 
-def clean_value(val):
-    if pd.isna(val) or val == 'nan':
-        return None
-    # Remove spaces and replace comma with dot
-    s = str(val).replace(' ', '').replace(',', '.')
-    try:
-        return float(s)
-    except:
-        return None
+def clean_values(values):
+    """'1 234,5' -> 1234.5; missing or unparsable -> NaN."""
+    return pd.to_numeric(values.astype(str).str.replace(' ', '', regex=False).str.replace(',', '.', regex=False), errors='coerce')
+
+# Municipal totals are kept as the primary municipality's totals and also spread over cells
+# by area (<name>_cell); rates and indices are area-weighted means
+EXTENSIVE_COLUMNS = ['num_households', 'num_taxpayers']
+INTENSIVE_COLUMNS = ['avg_income', 'median_income', 'p90_income', 'gini_index']
 
 def process_income_data():
     print("Loading Income CSVs...")
@@ -28,34 +25,24 @@ def process_income_data():
     
     def load_and_filter(path, col_mapping):
         df = pd.read_csv(path, sep=';', encoding='latin-1', header=None, dtype=str)
-        
-        valid_rows = []
-        is_mainland = False
-        for idx, row in df.iterrows():
-            code = str(row[0]).strip()
-            level = str(row[1]).strip()
-            designation = str(row[2]).strip()
-            
-            # Use NUTS 1 Row to start/stop mainland detection
-            if level == 'NUTS 1':
-                if designation == 'Continente':
-                    is_mainland = True
-                else:
-                    is_mainland = False
-                    # Once we hit a non-mainland NUTS 1, we stop processing
-                    break
-            
-            # Keep only Municipality level inside Mainland
-            if is_mainland and level == 'Município':
-                valid_rows.append(row)
-        
-        filtered_df = pd.DataFrame(valid_rows)
+        level = df[1].str.strip()
+        designation = df[2].str.strip()
+
+        # NUTS 1 rows open/close the mainland block; the first non-mainland NUTS 1 ends the scan
+        nuts1 = (level == 'NUTS 1').fillna(False).to_numpy()
+        mainland_start = nuts1 & (designation == 'Continente').fillna(False).to_numpy()
+        stops = (nuts1 & ~mainland_start).nonzero()[0]
+        in_scan = pd.RangeIndex(len(df)) < (stops[0] if len(stops) else len(df))
+        is_mainland = mainland_start.cumsum() > 0
+
+        # Keep only Municipality level inside Mainland
+        filtered_df = df[in_scan & is_mainland & (level == 'Município').fillna(False).to_numpy()]
         # Apply mapping
         result = pd.DataFrame()
         result['dicc'] = filtered_df[0]
         result['municipio_name'] = filtered_df[2]
         for name, col_idx in col_mapping.items():
-            result[name] = filtered_df[col_idx].apply(clean_value)
+            result[name] = clean_values(filtered_df[col_idx])
         return result
 
     # Col mapping based on Agregados_pub_2023.csv research
@@ -92,37 +79,20 @@ def process_income_data():
             print(f"  Imputing {count} values for {col} with Mainland Minimum: {min_val}")
             income_combined[col] = income_combined[col].fillna(min_val)
 
-    print("Loading CAOP municipality polygons...")
-    # Load CAOP municipalities
-    gdf_muni = gpd.read_file(CAOP_GPKG, layer='cont_municipios')
-    # Join with income data using 'dtmn' which is the DICC (first 4 digits of code)
-    # Ensure types match
-    gdf_muni['dicc'] = gdf_muni['dtmn'].astype(str)
-    income_combined['dicc'] = income_combined['dicc'].astype(str)
-    
-    final_muni_gdf = gdf_muni.merge(income_combined, on='dicc', how='left')
-    
-    print("Connecting to DuckDB and loading grid spine...")
+    print("Interpolating income data onto grid cells...")
+    # Sparse cell x municipality overlap weights, cached after the first run (see areal_interpolation.py)
+    weights = load_overlap_weights('caop_municipios', CAOP_GPKG, 'cont_municipios', 'dtmn')
+    income_combined['dicc'] = income_combined['dicc'].astype(str).str.strip()
+    by_muni = income_combined.drop_duplicates('dicc').set_index('dicc')
+    income_table = pd.concat([
+        interpolate_primary(weights, by_muni[EXTENSIVE_COLUMNS]),
+        interpolate_extensive(weights, by_muni[EXTENSIVE_COLUMNS]).add_suffix('_cell'),
+        interpolate_intensive(weights, by_muni[INTENSIVE_COLUMNS]),
+    ], axis=1).reset_index()
+    income_table = income_table[['cell_id', 'num_households', 'num_taxpayers', 'num_households_cell', 'num_taxpayers_cell',
+                                 'avg_income', 'median_income', 'p90_income', 'gini_index']]
     con = duckdb.connect(DB_PATH)
-    grid_df = con.execute("SELECT * FROM grid_spine").df()
-    
-    # Create GeoDataFrame for grid (taking centroids of the boxes)
-    # The spine has min_lon, min_lat, max_lon, max_lat
-    grid_df['lon'] = (grid_df['min_lon'] + grid_df['max_lon']) / 2
-    grid_df['lat'] = (grid_df['min_lat'] + grid_df['max_lat']) / 2
-    
-    grid_gdf = gpd.GeoDataFrame(grid_df, geometry=gpd.points_from_xy(grid_df.lon, grid_df.lat), crs="EPSG:4326")
-    
-    # Reproject to match CAOP (EPSG:3763)
-    grid_gdf_3763 = grid_gdf.to_crs(final_muni_gdf.crs)
-    
-    print("Assigning income data to grid cells...")
-    # Spatial join: Grid centroids within Municipality polygons
-    joined = gpd.sjoin(grid_gdf_3763, final_muni_gdf[['geometry', 'num_households', 'num_taxpayers', 'avg_income', 'median_income', 'p90_income', 'gini_index']], how='left', predicate='within')
-    
-    # Select final columns
-    income_table = joined[['cell_id', 'num_households', 'num_taxpayers', 'avg_income', 'median_income', 'p90_income', 'gini_index']]
-    
+
     print("Storing income table in DuckDB...")
     con.execute("DROP TABLE IF EXISTS income")
     con.execute("CREATE TABLE income AS SELECT * FROM income_table")
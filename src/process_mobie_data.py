@@ -1,7 +1,7 @@
 """
 Mobi.E Native Session Processor (Step 20)
 
-This script aggregates raw session data (detailed-20260116.csv) into 
+This script aggregates raw session data (detailed-*.csv exports) into
 Daily Station Labels and Features.
 
 Labels (Targets):
@@ -11,118 +11,203 @@ Labels (Targets):
 Features (Realized Demand Context):
 - max_concurrent: Peak number of simultaneous users.
 - saturation_ratio: Fraction of the day (0-1) where all stalls were occupied.
+
+Incremental Mode:
+Every export is registered in `session_files`. On later runs only new or
+changed exports are ingested, and only the station-days they touch are
+recomputed and upserted into session_stats. That includes earlier days of
+sessions that span midnight into already-processed data.
 """
 
 import duckdb
 import pandas as pd
 import numpy as np
 import os
-from datetime import timedelta
+import glob
+from ingest_mobie_sessions import ingest_session_csv, load_fragments, fragments_path
+from process_session_logic import session_bounds, minute_intervals, occupancy_timelines, group_sums
+from build_session_archive import build_session_archive, ARCHIVE_DIR
+from run_metrics import track
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CSV_PATH = os.path.join(BASE_DIR, "../data/detailed-20260116.csv")
+CSV_GLOB = os.path.join(BASE_DIR, "../data/detailed-*.csv")
 DB_PATH = os.path.join(BASE_DIR, "../data/mobie_data.db")
 
+# Set to False to rebuild session_stats from every registered export
+INCREMENTAL = True
+
+def aggregate_station_days(df, stations_meta, bounds):
+    """
+    Daily labels and occupancy features for every (station, idDay) in df.
+    bounds: overall session start/end per idCdr (see session_bounds).
+    """
+    # We only care about stations in our master list
+    df = df[df['idChargingStation'].isin(stations_meta.index)]
+    keys = ['idChargingStation', 'idDay']
+    if df.empty:
+        return pd.DataFrame(columns=['station_id', 'date_str', 'kwh_daily', 'sessions_daily', 'max_concurrent', 'saturation_ratio'])
+
+    # A. Labels
+    station_days = group_sums(df, keys, 'energia_total_periodo').rename(columns={'energia_total_periodo': 'kwh_daily'})
+    # count(distinct idCdr) WHERE session began today
+    began_today = df[df['start_day'].astype(str) == df['idDay'].astype(str)]
+    sessions = began_today.groupby(keys)['idCdr'].nunique().rename('sessions_daily')
+    station_days = station_days.merge(sessions, on=keys, how='left')
+    station_days['sessions_daily'] = station_days['sessions_daily'].fillna(0)
+    station_days['sd_idx'] = np.arange(len(station_days))
+
+    # B. Timeline Reconstruction (Minute-by-Minute)
+    # Every session active in a station-day uses its full bounds (not just the fragment)
+    # so multi-day spans are clipped correctly.
+    active = df[keys + ['idCdr']].drop_duplicates()
+    active = active.merge(station_days[keys + ['sd_idx']], on=keys).join(bounds, on='idCdr')
+    day_start = pd.to_datetime(active['idDay'].astype(str), format='%Y%m%d')
+    start_min, end_min, valid = minute_intervals(day_start, active['s_bound'], active['e_bound'])
+
+    capacity = stations_meta['stalls'].reindex(station_days['idChargingStation']).astype(int).to_numpy()
+    max_concurrent = np.zeros(len(station_days), dtype=np.int64)
+    saturated_mins = np.zeros(len(station_days), dtype=np.int64)
+    with track('mobie_sessions', 'timelines', rows_in=int(valid.sum())) as m:
+        for lo, hi, timelines in occupancy_timelines(active['sd_idx'].to_numpy()[valid], start_min[valid], end_min[valid], len(station_days)):
+            max_concurrent[lo:hi] = timelines.max(axis=1)
+            saturated_mins[lo:hi] = (timelines >= capacity[lo:hi, None]).sum(axis=1)
+        m['rows_out'] = len(station_days)
+
+    return pd.DataFrame({
+        'station_id': station_days['idChargingStation'],
+        'date_str': station_days['idDay'].astype(str),
+        # Python round() (not Series.round) to match the historical labels exactly
+        'kwh_daily': [round(float(v), 2) for v in station_days['kwh_daily']],
+        'sessions_daily': station_days['sessions_daily'].astype(int),
+        'max_concurrent': max_concurrent.astype(int),
+        'saturation_ratio': [round(float(v), 4) for v in saturated_mins / 1440.0]
+    })
+
+def register_exports(con, csv_paths):
+    """
+    Ingests new or changed exports. Returns (changed_parquets, stale, pending):
+    the Parquet files that changed, the (idCdr, idChargingStation, idDay)
+    fragments their previous version contained, whose station-days must be
+    recomputed too, and their session_files rows. The rows are written by
+    save_registry() in the same transaction as session_stats, so a failed run
+    leaves the exports unregistered and the next run retries them.
+    """
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS session_files (
+            file_name VARCHAR PRIMARY KEY,
+            size_bytes BIGINT,
+            mtime DOUBLE,
+            fragments BIGINT,
+            registered_at TIMESTAMP
+        )
+    """)
+    registry = con.execute("SELECT file_name, size_bytes, mtime FROM session_files").df().set_index('file_name')
+
+    changed = []
+    stale = []
+    pending = []
+    for path in csv_paths:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        if name in registry.index and registry.at[name, 'size_bytes'] == stat.st_size and registry.at[name, 'mtime'] == stat.st_mtime:
+            continue
+
+        parquet = fragments_path(path)
+        if name in registry.index and os.path.exists(parquet):
+            stale.append(load_fragments(parquet)[['idCdr', 'idChargingStation', 'idDay']])
+
+        ingest_session_csv(path, force=True)
+        n = con.execute(f"SELECT count(*) FROM read_parquet('{parquet}')").fetchone()[0]
+        pending.append((name, stat.st_size, stat.st_mtime, n))
+        changed.append(parquet)
+    stale = pd.concat(stale, ignore_index=True) if stale else pd.DataFrame(columns=['idCdr', 'idChargingStation', 'idDay'])
+    return changed, stale, pending
+
+def save_registry(con, pending):
+    for row in pending:
+        con.execute("INSERT OR REPLACE INTO session_files VALUES (?, ?, ?, ?, now())", list(row))
+
 def process_sessions():
-    if not os.path.exists(CSV_PATH) or not os.path.exists(DB_PATH):
+    csv_paths = sorted(glob.glob(CSV_GLOB))
+    if not csv_paths or not os.path.exists(DB_PATH):
         print("Missing input files.")
         return
 
     print("--- 1. Loading Native Station Metadata ---")
     con = duckdb.connect(DB_PATH)
     stations_meta = con.execute("SELECT ID, stalls FROM stations").df().set_index('ID')
-    
-    print("--- 2. Loading Session Data ---")
-    df = pd.read_csv(CSV_PATH, sep=';', thousands='.', decimal=',', encoding='utf-8-sig')
-    df.columns = df.columns.str.strip()
-    
-    # Parse Timestamps
-    df['start'] = pd.to_datetime(df['startTimestamp'].astype(str), format='%Y%m%d%H%M%S', errors='coerce')
-    df['end'] = pd.to_datetime(df['stopTimestamp'].astype(str), format='%Y%m%d%H%M%S', errors='coerce')
-    df['start_day'] = df['start'].dt.strftime('%Y%m%d')
-    df = df.dropna(subset=['start', 'end'])
-    
-    # Numerical cleaning
-    for col in ['energia_total_periodo', 'periodDuration']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-    
-    print(f"Loaded {len(df)} session fragments.")
+
+    print("--- 2. Registering Session Exports ---")
+    # Streamed, column-projected and typed by DuckDB (see ingest_mobie_sessions.py)
+    # session_stats built before exports were registered is rebuilt in full once
+    tables = set(con.execute("SELECT table_name FROM information_schema.tables").df()['table_name'])
+    incremental = INCREMENTAL and {'session_stats', 'session_files'} <= tables
+    with track('mobie_sessions', 'ingest', rows_in=len(csv_paths)) as m:
+        changed, stale, pending = register_exports(con, csv_paths)
+        m['rows_out'] = len(changed)
+    all_parquets = [fragments_path(p) for p in csv_paths]
+    print(f"{len(csv_paths)} exports registered, {len(changed)} new or changed.")
+
+    if incremental and not changed:
+        con.close()
+        print("session_stats is up to date.")
+        return
 
     print("--- 3. Aggregating Labels & Saturation ---")
-    results = []
-    
-    # Group by Station and fragment date (idDay)
-    for (station_id, day), group in df.groupby(['idChargingStation', 'idDay']):
-        if station_id not in stations_meta.index:
-            continue # We only care about stations in our master list
-            
-        capacity = int(stations_meta.loc[station_id, 'stalls'])
-        
-        # A. Labels
-        kwh_daily = group['energia_total_periodo'].sum()
-        # count(distinct idCdr) WHERE session began today
-        sessions_daily = group[group['start_day'].astype(str) == str(day)]['idCdr'].nunique()
-        
-        # B. Timeline Reconstruction (Minute-by-Minute)
-        day_start = pd.to_datetime(str(day), format='%Y%m%d')
-        day_end = day_start + timedelta(days=1)
-        timeline = np.zeros(1440, dtype=int)
-        
-        # Map ALL sessions active in this station-day to the 1440m timeline
-        # We need to look across the whole dataframe for the full start/end of these sessions
-        sids = group['idCdr'].unique()
-        for sid in sids:
-            # Get the overall session boundaries (not just the fragment)
-            # Efficiently: use the group's min start/max end if they are in the same day, 
-            # but safer to query the whole df for that sid to handle multiday spans correctly.
-            # For performance with large datasets, we'd pre-extract unique session bounds.
-            
-            s_rows = df[df['idCdr'] == sid]
-            s_bound = s_rows['start'].min()
-            e_bound = s_rows['end'].max()
-            
-            # Clip session to the current day
-            s = max(s_bound, day_start)
-            e = min(e_bound, day_end)
-            
-            if s >= e: continue
-            
-            start_min = int((s - day_start).total_seconds() // 60)
-            end_min = int((e - day_start).total_seconds() // 60)
-            
-            # Boundary checks
-            start_min = max(0, min(1439, start_min))
-            end_min = max(0, min(1440, end_min))
-            
-            timeline[start_min:end_min] += 1
-            
-        max_concurrent = np.max(timeline) if len(timeline) > 0 else 0
-        saturated_mins = np.sum(timeline >= capacity)
-        saturation_ratio = saturated_mins / 1440.0
-        
-        results.append({
-            'station_id': station_id,
-            'date_str': str(day),
-            'kwh_daily': round(float(kwh_daily), 2),
-            'sessions_daily': int(sessions_daily),
-            'max_concurrent': int(max_concurrent),
-            'saturation_ratio': round(float(saturation_ratio), 4)
-        })
-        
+    if incremental:
+        # Sessions in the new data, plus every station-day any of their fragments fall on
+        touched_cdrs = set(load_fragments(changed)['idCdr'].unique()) | set(stale['idCdr'])
+        touched = pd.concat([
+            load_fragments(all_parquets, cdrs=touched_cdrs)[['idChargingStation', 'idDay']],
+            stale[['idChargingStation', 'idDay']]
+        ]).drop_duplicates()
+        df = load_fragments(all_parquets, station_days=touched)
+        print(f"Recomputing {len(touched)} touched station-days ({len(df)} fragments).")
+    else:
+        df = load_fragments(all_parquets)
+        print(f"Loaded {len(df)} session fragments.")
+
+    # Session bounds need every fragment of the sessions involved, wherever they fall
+    with track('mobie_sessions', 'aggregate', rows_in=len(df)) as m:
+        bounds = session_bounds(load_fragments(all_parquets, cdrs=df['idCdr'].unique()) if incremental else df)
+        results = aggregate_station_days(df, stations_meta, bounds)
+        m['rows_out'] = len(results)
     print(f"Generated {len(results)} station-day data points.")
 
     print("--- 4. Saving to mobie_data.db ---")
-    if not results:
+    res_df = results
+    if incremental:
+        touched_keys = pd.DataFrame({'station_id': touched['idChargingStation'], 'date_str': touched['idDay'].astype(str)})
+        con.execute("BEGIN TRANSACTION")
+        con.execute("DELETE FROM session_stats WHERE (station_id, date_str) IN (SELECT station_id, date_str FROM touched_keys)")
+        con.execute("INSERT INTO session_stats SELECT station_id, date_str, kwh_daily, sessions_daily, max_concurrent, saturation_ratio FROM res_df")
+        save_registry(con, pending)
+        con.execute("COMMIT")
+    elif results.empty:
         print("No results to save.")
+        save_registry(con, pending)
         con.close()
         return
-        
-    res_df = pd.DataFrame(results)
-    con.execute("DROP TABLE IF EXISTS session_stats")
-    con.execute("CREATE TABLE session_stats AS SELECT * FROM res_df")
-    
+    else:
+        con.execute("BEGIN TRANSACTION")
+        con.execute("DROP TABLE IF EXISTS session_stats")
+        con.execute("CREATE TABLE session_stats AS SELECT * FROM res_df")
+        save_registry(con, pending)
+        con.execute("COMMIT")
+
     con.close()
-    print("Done. Tables in mobie_data.db: stations, prices, session_stats")
+
+    # Keep the partitioned session archive (if built) in step with the exports
+    if os.path.exists(ARCHIVE_DIR):
+        print("--- 5. Refreshing Session Archive ---")
+        if incremental:
+            days = touched['idDay'].astype(str)
+            build_session_archive(sorted({f"{d[:4]}-{d[4:6]}" for d in days}))
+        else:
+            build_session_archive()
+
+    print("Done. Tables in mobie_data.db: stations, prices, session_stats, session_files")
 
 if __name__ == "__main__":
-    process_sessions()
+    with track('mobie_sessions'):
+        process_sessions()
@@ -1,20 +1,23 @@
 import pandas as pd
 import duckdb
 import os
-import re
 import numpy as np
+from tariff_engine import parse_prices, build_tariffs, effective_kwh_price, price_sessions
+from build_session_archive import ARCHIVE_DIR, create_archive_view
+from run_metrics import track
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_CSV = os.path.join(BASE_DIR, "../data/MOBIE_Tarifas.csv")
 OUTPUT_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
 
-def parse_price(val):
-    if pd.isna(val) or val == 'nan': return 0.0
-    # Extract numeric part (e.g., "€ 0.261 /charge" -> 0.261)
-    match = re.search(r'€\s+([0-9.]+)', str(val))
-    if match:
-        return float(match.group(1))
-    return 0.0
+# Charging profiles priced for every station: effective_kwh_<name> in prices.
+# 'ref' (1h at full station power) is the historical effective_kwh_ref.
+REFERENCE_PROFILES = {
+    'ref': dict(kwh=np.inf, duration_min=60, power_kw=np.inf),
+    'ac_overnight': dict(kwh=30, duration_min=600, power_kw=7.4),
+    'ac_top_up': dict(kwh=10, duration_min=90, power_kw=11),
+    'dc_fast': dict(kwh=40, duration_min=30, power_kw=150),
+}
 
 def process_prices():
     if not os.path.exists(INPUT_CSV) or not os.path.exists(OUTPUT_DB):
@@ -34,40 +37,20 @@ def process_prices():
     print(f"Loaded {len(df)} tariff component rows.")
 
     print("--- 2. Parsing Tariffs ---")
-    df['is_energy'] = (df['TIPO_TARIFA'] == 'ENERGY')
-    df['is_time'] = (df['TIPO_TARIFA'] == 'TIME')
-    df['is_fixed'] = (df['TIPO_TARIFA'] == 'FLAT')
-    df['is_parking'] = (df['TIPO_TARIFA'] == 'PARKING_TIME')
-    df['price_val'] = df['TARIFA'].apply(parse_price)
+    df['price_val'] = parse_prices(df['TARIFA'])
 
-    print("--- 3. Aggregating by Station + Type ---")
-    
-    def calc_station_price(group):
-        station_id = group['ID'].iloc[0]
-        if station_id not in stations.index:
-            return None
-            
-        power = stations.loc[station_id, 'max_power_kw']
-        
-        p_fixed = group[group['is_fixed']]['price_val'].sum()
-        p_energy = group[group['is_energy']]['price_val'].max() if any(group['is_energy']) else 0
-        p_time = group[group['is_time']]['price_val'].max() if any(group['is_time']) else 0
-        has_parking = int(any(group['is_parking']))
-        
-        # Consistent Price Calculation for 1h session:
-        # Cost = Fixed + (Power * 1h * Energy) + (60min * Time_min)
-        effective_total = p_fixed + (power * p_energy) + (60 * p_time)
-        effective_kwh = effective_total / power if power > 0 else 0
-        
-        return pd.Series({
-            'p_fixed': p_fixed,
-            'p_energy': p_energy,
-            'p_time': p_time,
-            'has_parking': has_parking,
-            'effective_kwh_ref': effective_kwh
-        })
+    print("--- 3. Pricing Reference Profiles ---")
+    # FLAT/ENERGY/TIME/PARKING_TIME pivoted once into per-profile arrays (see tariff_engine.py)
+    tariffs = build_tariffs(df, stations['max_power_kw'])
+    profiles = {k: np.array([p[k] for p in REFERENCE_PROFILES.values()], dtype=float) for k in ['kwh', 'duration_min', 'power_kw']}
+    effective = effective_kwh_price(tariffs, **profiles)
 
-    station_prices = df.groupby(['ID', 'TIPO_TARIFARIO']).apply(calc_station_price).dropna().reset_index()
+    station_prices = tariffs[['p_fixed', 'p_energy', 'p_time']].copy()
+    station_prices['has_parking'] = tariffs['has_parking'].astype(float)
+    for i, name in enumerate(REFERENCE_PROFILES):
+        station_prices[f'effective_kwh_{name}'] = effective[:, i]
+    station_prices['p_parking'] = tariffs['p_parking']
+    station_prices = station_prices.reset_index()
 
     print("--- 4. Correcting Ad-Hoc Premium ---")
     # Pivot for comparison
@@ -93,12 +76,29 @@ def process_prices():
 
     print("--- 5. Global Rank ---")
     master['price_percentile'] = master['effective_kwh_ref'].rank(pct=True)
+    # Historical columns first, then the per-profile additions
+    extra = ['p_parking'] + [f'effective_kwh_{name}' for name in REFERENCE_PROFILES if name != 'ref']
+    master = master[[c for c in master.columns if c not in extra] + extra]
 
     print("--- 6. Saving to database ---")
     con.execute("DROP TABLE IF EXISTS prices")
     con.execute("CREATE TABLE prices AS SELECT * FROM master")
-    con.close()
     print(f"Saved {len(master)} price profiles.")
 
+    if os.path.exists(ARCHIVE_DIR):
+        print("--- 7. Pricing Archived Sessions ---")
+        create_archive_view(con)
+        priced = con.execute("SELECT idCdr, station_id, month, kwh, duration_min FROM sessions").df()
+        for tariff_type, col in [('REGULAR', 'cost_regular'), ('AD_HOC_PAYMENT', 'cost_adhoc')]:
+            if tariff_type in tariffs.index.get_level_values('TIPO_TARIFARIO'):
+                priced[col] = price_sessions(tariffs, priced['station_id'], priced['kwh'], priced['duration_min'], tariff_type)
+            else:
+                priced[col] = np.nan
+        con.execute("DROP TABLE IF EXISTS session_costs")
+        con.execute("CREATE TABLE session_costs AS SELECT * FROM priced")
+        print(f"Priced {priced['cost_regular'].notna().sum()} of {len(priced)} sessions. Table in mobie_data.db: session_costs")
+    con.close()
+
 if __name__ == "__main__":
-    process_prices()
+    with track('mobie_prices'):
+        process_prices()
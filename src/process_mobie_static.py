@@ -2,11 +2,53 @@ import pandas as pd
 import duckdb
 import os
 import numpy as np
+from grid_logic import lonlat_to_3035, cell_id, cells_within
+from run_metrics import track
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_CSV = os.path.join(BASE_DIR, "../data/MOBIe_Lista_de_postos.csv")
 OUTPUT_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
 
+def clean_power(values):
+    """'22,0' -> 22.0; unparsable -> 0.0; missing/'nan' stay NaN (as float(str(val)) did)."""
+    text = values.astype(str).str.replace(',', '.', regex=False)
+    parsed = pd.to_numeric(text.str.strip(), errors='coerce')
+    keep_nan = values.isna() | text.str.strip().str.lower().isin(['nan', '+nan', '-nan'])
+    return parsed.where(parsed.notna() | keep_nan, 0.0).astype(float)
+
+def categorize_connector(values):
+    upper = values.astype(str).str.upper()
+    has = lambda token: upper.str.contains(token, regex=False).fillna(False).to_numpy(dtype=bool)
+    return np.select(
+        [has('CCS'), has('CHADEMO'), has('MENNEKES') | has('TYPE 2') | has('TYPE2')],
+        ['ccs', 'chademo', 'type2'],
+        default='other'
+    )
+
+def to_coord(values):
+    # Coordinates may come as '38,7' strings
+    return pd.to_numeric(values.astype(str).str.replace(',', '.', regex=False), errors='coerce').to_numpy(dtype=float)
+
+def stations_in_cells(con, cell_ids):
+    """Stations (ID, x_3035, y_3035, cell_id) in the given cells, via the station_cells index."""
+    cells = pd.DataFrame({'cell_id': pd.Series(list(cell_ids), dtype=object)})
+    con.register("cells_df", cells)
+    found = con.execute("""
+        SELECT s.ID, s.x_3035, s.y_3035, s.cell_id
+        FROM station_cells sc
+        JOIN cells_df c ON sc.cell_id = c.cell_id
+        JOIN stations s ON s.ID = sc.station_id
+    """).df()
+    con.unregister("cells_df")
+    return found
+
+def stations_within(con, lon, lat, radius_m):
+    """Stations within radius_m (EPSG:3035 metres) of a point, with their distance_m."""
+    x, y = lonlat_to_3035(lon, lat)
+    found = stations_in_cells(con, cells_within(float(x), float(y), radius_m))
+    found['distance_m'] = np.hypot(found['x_3035'] - x, found['y_3035'] - y)
+    return found[found['distance_m'] <= radius_m].sort_values('distance_m').reset_index(drop=True)
+
 def process_static():
     if not os.path.exists(INPUT_CSV):
         print(f"Error: {INPUT_CSV} not found.")
@@ -19,13 +61,7 @@ def process_static():
     df.columns = df.columns.str.strip()
     
     # Clean numeric columns
-    def clean_power(val):
-        try:
-            return float(str(val).replace(',', '.'))
-        except:
-            return 0.0
-
-    df['power_kw'] = df['POTÊNCIA DA TOMADA (kW)'].apply(clean_power)
+    df['power_kw'] = clean_power(df['POTÊNCIA DA TOMADA (kW)'])
     
     print(f"Loaded {len(df)} socket rows.")
 
@@ -40,14 +76,7 @@ def process_static():
     df['voltage_lvl'] = df['NÍVEL DE TENSÃO'].map(voltage_map).fillna(1)
 
     # Connector Mapping
-    def categorize_connector(val):
-        val = str(val).upper()
-        if 'CCS' in val: return 'ccs'
-        if 'CHADEMO' in val: return 'chademo'
-        if 'MENNEKES' in val or 'TYPE 2' in val or 'TYPE2' in val: return 'type2'
-        return 'other'
-    
-    df['conn_type'] = df['TIPO DE TOMADA'].apply(categorize_connector)
+    df['conn_type'] = categorize_connector(df['TIPO DE TOMADA'])
     conn_dummies = pd.get_dummies(df['conn_type'], prefix='conn')
     df = pd.concat([df, conn_dummies], axis=1)
 
@@ -85,17 +114,30 @@ def process_static():
         clean_name = ''.join(e for e in op if e.isalnum()).lower()
         stations[f'is_op_{clean_name}'] = (stations['OPERADOR'] == op).astype(int)
 
-    print("--- 5. Saving to database ---")
-    if os.path.exists(OUTPUT_DB):
-        os.remove(OUTPUT_DB) # Starting fresh as requested
+    print("--- 5. Grid Cell Assignment ---")
+    # Exact EPSG:3035 position plus the 1km grid cell, so spatial lookups use cells, not scans
+    x, y = lonlat_to_3035(to_coord(stations['LONGITUDE']), to_coord(stations['LATITUDE']))
+    stations['x_3035'] = x
+    stations['y_3035'] = y
+    stations['cell_id'] = cell_id(x, y)
+    station_cells = stations.loc[stations['cell_id'].notna(), ['cell_id', 'ID']].rename(columns={'ID': 'station_id'})
+    print(f"{len(station_cells)} stations located in {station_cells['cell_id'].nunique()} grid cells.")
 
+    print("--- 6. Saving to database ---")
+    # Replaced in place: prices, session_stats etc. in the same DB are kept
     con = duckdb.connect(OUTPUT_DB)
-    con.execute("CREATE TABLE stations AS SELECT * FROM stations")
-    
-    # Add spatial index? For now just raw table.
+    # Registered under new names: the existing tables would shadow the DataFrames
+    con.register("stations_df", stations)
+    con.register("station_cells_df", station_cells)
+    con.execute("CREATE OR REPLACE TABLE stations AS SELECT * FROM stations_df")
+    con.execute("CREATE OR REPLACE TABLE station_cells AS SELECT * FROM station_cells_df ORDER BY cell_id")
+    con.execute("CREATE INDEX idx_station_cells_cell ON station_cells (cell_id)")
+    con.execute("CREATE UNIQUE INDEX idx_stations_id ON stations (ID)")
+
     row_count = con.execute("SELECT count(*) FROM stations").fetchone()[0]
-    print(f"Saved {row_count} stations to {OUTPUT_DB}")
+    print(f"Saved {row_count} stations to {OUTPUT_DB} (tables: stations, station_cells)")
     con.close()
 
 if __name__ == "__main__":
-    process_static()
+    with track('mobie_static'):
+        process_static()
@@ -0,0 +1,67 @@
+import pandas as pd
+import numpy as np
+
+MINUTES_PER_DAY = 1440
+# Station-days per timeline batch (batch_rows x 1441 int32 difference array)
+OCCUPANCY_BATCH_ROWS = 10000
+
+def session_bounds(df):
+    """Overall start/end of every session (idCdr) across all of its day fragments."""
+    return df.groupby('idCdr').agg(s_bound=('start', 'min'), e_bound=('end', 'max'))
+
+def minute_intervals(day_start, s_bound, e_bound):
+    """
+    Clips sessions to their station-day and converts them to [start_min, end_min)
+    minute offsets, vectorized. Returns (start_min, end_min, valid).
+    """
+    day_end = day_start + pd.Timedelta(days=1)
+    s = s_bound.where(s_bound > day_start, day_start)
+    e = e_bound.where(e_bound < day_end, day_end)
+
+    minute = pd.Timedelta(minutes=1)
+    start_min = ((s - day_start) // minute).clip(0, MINUTES_PER_DAY - 1).to_numpy(dtype=np.int64)
+    end_min = ((e - day_start) // minute).clip(0, MINUTES_PER_DAY).to_numpy(dtype=np.int64)
+    # Sub-minute sessions (same floored minute) add nothing to the timeline
+    valid = (s < e).to_numpy() & (start_min < end_min)
+    return start_min, end_min, valid
+
+def occupancy_timelines(row_idx, start_min, end_min, n_rows, batch_size=OCCUPANCY_BATCH_ROWS, weights=None):
+    """
+    Builds minute-by-minute occupancy for n_rows station-days with difference
+    arrays (+1 at start, -1 at end, cumsum). Interval i belongs to row row_idx[i].
+    With weights, interval i adds weights[i] per minute instead of 1 (float timelines).
+
+    Yields (lo, hi, timelines) with timelines of shape (hi - lo, 1440).
+    """
+    order = np.argsort(row_idx, kind='stable')
+    row_idx = np.asarray(row_idx)[order]
+    start_min = np.asarray(start_min)[order]
+    end_min = np.asarray(end_min)[order]
+    step = 1 if weights is None else np.asarray(weights, dtype=np.float64)[order]
+    dtype = np.int32 if weights is None else np.float64
+
+    for lo in range(0, n_rows, batch_size):
+        hi = min(lo + batch_size, n_rows)
+        a, b = np.searchsorted(row_idx, [lo, hi])
+        rows = row_idx[a:b] - lo
+
+        w = step if weights is None else step[a:b]
+        diff = np.zeros((hi - lo, MINUTES_PER_DAY + 1), dtype=dtype)
+        np.add.at(diff, (rows, start_min[a:b]), w)
+        np.add.at(diff, (rows, end_min[a:b]), -w)
+        yield lo, hi, np.cumsum(diff[:, :MINUTES_PER_DAY], axis=1)
+
+def group_sums(df, keys, col):
+    """
+    Per-group sums of col, sorted by keys. Each group is summed as one contiguous
+    NumPy slice (pairwise summation, same as Series.sum on the group) rather than
+    groupby's compensated sum, so rounded daily labels stay bit-identical.
+    """
+    ordered = df.sort_values(keys, kind='stable')
+    codes = ordered.groupby(keys, sort=True).ngroup().to_numpy()
+    bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+    values = ordered[col].to_numpy()
+
+    out = ordered.iloc[bounds[:-1]][keys].reset_index(drop=True)
+    out[col] = [values[a:b].sum() for a, b in zip(bounds[:-1], bounds[1:])]
+    return out
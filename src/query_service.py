@@ -0,0 +1,305 @@
+"""
+Local Feature Query Service
+
+Answers "what is around this lat/lon" without touching the databases per
+query. At startup it loads, read-only:
+
+- cell features: the memory-mapped feature cube (build_feature_cube.py)
+- cell_topk (travel_matrix.db): the fastest stations of every cell and slot,
+  as dense (slot, row, col, k) arrays on the cube's grid
+- stations (mobie_data.db): attributes joined with prices and station_catchment
+
+Point lookups are array indexing; per-cell and per-bbox results are kept in
+an LRU cache, so hot areas are answered from memory. Everything is immutable
+after startup, so any number of threads (or server processes sharing the
+memmap) can read concurrently.
+
+Python:
+    service = FeatureService()
+    service.point(-9.15, 38.72, features=['pop_total'])
+    service.batch([(-9.15, 38.72), (-8.61, 41.15)])
+
+HTTP (python query_service.py --port 8765):
+    GET  /point?lon=-9.15&lat=38.72&features=pop_total,tourism_pressure&slot=0
+    GET  /bbox?min_lon=-9.2&min_lat=38.7&max_lon=-9.1&max_lat=38.8&features=pop_total
+    POST /batch   {"points": [[-9.15, 38.72], ...], "features": [...], "slot": 0}
+    GET  /station/<station_id>
+    GET  /health
+"""
+
+import argparse
+import duckdb
+import json
+import numpy as np
+import pandas as pd
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from build_feature_cube import CUBE_DIR, load_feature_cube, cell_rc, window_rc
+from grid_logic import cell_id, lonlat_to_3035
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MATRIX_DB = os.path.join(BASE_DIR, "../data/travel_matrix.db")
+MOBIE_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
+
+DEFAULT_PORT = 8765
+CACHE_SIZE = 65536 # cells (and bboxes) kept per cache
+MAX_BBOX_CELLS = 250_000
+MAX_BATCH_POINTS = 100_000
+WORKERS = 8
+
+def _floats(values):
+    """JSON-safe floats: NaN -> None."""
+    return [None if v != v else float(v) for v in values]
+
+def _table_exists(con, table_name):
+    return con.execute(f"SELECT count(*) FROM information_schema.tables WHERE table_name = '{table_name}'").fetchone()[0] > 0
+
+class FeatureService:
+    """In-memory cell/station feature lookups. Returned dicts are shared with the cache: do not modify them."""
+
+    def __init__(self, cube_dir=CUBE_DIR, matrix_db=MATRIX_DB, mobie_db=MOBIE_DB, cache_size=CACHE_SIZE):
+        t0 = time.perf_counter()
+        self.cube = load_feature_cube(cube_dir)
+        self.names = self.cube['names']
+        self._load_stations(mobie_db)
+        self._load_topk(matrix_db)
+        self._cell = lru_cache(maxsize=cache_size)(self._cell_uncached)
+        self._bbox = lru_cache(maxsize=cache_size)(self._bbox_uncached)
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        print(f"Loaded {len(self.names)} cell features, {len(self.station_ids)} stations and "
+              f"{len(self.slots)} top-k slot(s) in {time.perf_counter() - t0:.1f}s")
+
+    def _load_stations(self, mobie_db):
+        self.station_ids = []
+        self.stations = {}
+        if not os.path.exists(mobie_db):
+            print(f"  [WARN] {mobie_db} not found; no station attributes.")
+            return
+        con = duckdb.connect(mobie_db, read_only=True)
+        select = ["s.*"]
+        joins = []
+        for table, alias, key in [('prices', 'p', 'station_id_code'), ('station_catchment', 'c', 'station_id')]:
+            if not _table_exists(con, table):
+                print(f"  [WARN] Table {table} not found; its attributes are left out.")
+                continue
+            select.append(f"{alias}.* EXCLUDE ({key})")
+            joins.append(f"LEFT JOIN {table} {alias} ON {alias}.{key} = s.ID")
+        df = con.execute(f"SELECT {', '.join(select)} FROM stations s {' '.join(joins)}").df()
+        con.close()
+        self.station_ids = df['ID'].tolist()
+        df = df.astype(object).where(df.notna(), None)
+        self.stations = {r['ID']: r for r in df.to_dict('records')}
+
+    def _load_topk(self, matrix_db):
+        n_rows, n_cols = self.cube['shape'][:2]
+        self.slots = {}
+        if not os.path.exists(matrix_db):
+            print(f"  [WARN] {matrix_db} not found; no top-k stations.")
+            self.topk_station = np.full((0, n_rows, n_cols, 0), -1, dtype=np.int32)
+            return
+        con = duckdb.connect(matrix_db, read_only=True)
+        if not _table_exists(con, 'cell_topk'):
+            con.close()
+            print("  [WARN] cell_topk not found; no top-k stations.")
+            self.topk_station = np.full((0, n_rows, n_cols, 0), -1, dtype=np.int32)
+            return
+        k = con.execute("SELECT max(len(station_ids)) FROM cell_topk").fetchone()[0] or 0
+        df = con.execute("""
+            SELECT cell_id, slot, k, station_id, time_min, distance_km FROM (
+                SELECT cell_id, slot,
+                       generate_subscripts(station_ids, 1) - 1 AS k,
+                       unnest(station_ids) AS station_id,
+                       unnest(times_min) AS time_min,
+                       unnest(distances_km) AS distance_km
+                FROM cell_topk
+            ) WHERE station_id IS NOT NULL
+        """).df()
+        con.close()
+
+        self.slots = {int(s): i for i, s in enumerate(sorted(df['slot'].unique()))}
+        shape = (len(self.slots), n_rows, n_cols, k)
+        self.topk_station = np.full(shape, -1, dtype=np.int32)
+        self.topk_time = np.full(shape, np.nan, dtype=np.float32)
+        self.topk_distance = np.full(shape, np.nan, dtype=np.float32)
+
+        # cell_id RES1kmN{y_km}E{x_km} -> cube position
+        parts = df['cell_id'].str.extract(r'N(\d+)E(\d+)').astype(float) * 1000
+        row, col, inside = cell_rc(self.cube, parts[1].to_numpy(), parts[0].to_numpy())
+        station = pd.Index(self.station_ids).get_indexer(df['station_id'])
+        keep = inside & (station >= 0)
+        at = (df['slot'].map(self.slots).to_numpy()[keep], row[keep], col[keep], df['k'].to_numpy()[keep])
+        self.topk_station[at] = station[keep]
+        self.topk_time[at] = df['time_min'].to_numpy()[keep]
+        self.topk_distance[at] = df['distance_km'].to_numpy()[keep]
+
+    def _layers(self, features):
+        if features is None:
+            return list(range(len(self.names))), self.names
+        unknown = [f for f in features if f not in self.cube['index']]
+        if unknown:
+            raise KeyError(f"features {', '.join(unknown)}")
+        return [self.cube['index'][f] for f in features], list(features)
+
+    def _cell_uncached(self, row, col, features, slot):
+        layers, names = self._layers(features)
+        x = self.cube['x_min'] + col * self.cube['cell_size']
+        y = self.cube['y_min'] + row * self.cube['cell_size']
+        result = {
+            'cell_id': cell_id([x], [y])[0],
+            'x_3035': x,
+            'y_3035': y,
+            'features': dict(zip(names, _floats(self.cube['features'][row, col, layers]))),
+            'stations': [],
+        }
+        if slot in self.slots:
+            s = self.slots[slot]
+            for i, t, d in zip(self.topk_station[s, row, col], self.topk_time[s, row, col], self.topk_distance[s, row, col]):
+                if i >= 0:
+                    result['stations'].append({'station_id': self.station_ids[i], 'time_min': float(t), 'distance_km': float(d)})
+        return result
+
+    def _bbox_uncached(self, r0, c0, r1, c1, features):
+        layers, names = self._layers(features)
+        block = self.cube['features'][r0:r1 + 1, c0:c1 + 1][..., layers]
+        rr, cc = np.nonzero(~np.isnan(block).all(axis=2))
+        x = self.cube['x_min'] + (c0 + cc) * self.cube['cell_size']
+        y = self.cube['y_min'] + (r0 + rr) * self.cube['cell_size']
+        values = block[rr, cc]
+        return {
+            'cell_id': cell_id(x, y).tolist(),
+            'x_3035': x.tolist(),
+            'y_3035': y.tolist(),
+            **{name: _floats(values[:, j]) for j, name in enumerate(names)},
+        }
+
+    def point(self, lon, lat, features=None, slot=0):
+        """Features and top-k stations of the cell containing lon/lat (None outside the grid)."""
+        return self.batch([(lon, lat)], features, slot)[0]
+
+    def batch(self, points, features=None, slot=0):
+        """point() for many (lon, lat) pairs; one projection call for all of them."""
+        if len(points) > MAX_BATCH_POINTS:
+            raise ValueError(f"at most {MAX_BATCH_POINTS} points per batch")
+        lonlat = np.asarray(points, dtype=float).reshape(-1, 2)
+        x, y = lonlat_to_3035(lonlat[:, 0], lonlat[:, 1])
+        row, col, inside = cell_rc(self.cube, x, y)
+        key = tuple(features) if features is not None else None
+        self._layers(key)
+        return [self._cell(int(r), int(c), key, int(slot)) if ok else None for r, c, ok in zip(row, col, inside)]
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat, features=None):
+        """Columnar features of every cell in the lon/lat box that has a value (cells snap to the grid)."""
+        x, y = lonlat_to_3035([min_lon, max_lon, min_lon, max_lon], [min_lat, min_lat, max_lat, max_lat])
+        r0, c0, r1, c1 = window_rc(self.cube, x.min(), y.min(), x.max(), y.max())
+        key = tuple(features) if features is not None else None
+        if r1 < r0 or c1 < c0:
+            # Box misses the grid
+            _, names = self._layers(key)
+            return {'cell_id': [], 'x_3035': [], 'y_3035': [], **{name: [] for name in names}}
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > MAX_BBOX_CELLS:
+            raise ValueError(f"bbox covers more than {MAX_BBOX_CELLS} cells")
+        return self._bbox(r0, c0, r1, c1, key)
+
+    def station(self, station_id):
+        return self.stations.get(station_id)
+
+    def health(self):
+        return {
+            'loaded_at': self.loaded_at,
+            'features': len(self.names),
+            'stations': len(self.station_ids),
+            'slots': sorted(self.slots),
+            'cell_cache': self._cell.cache_info()._asdict(),
+            'bbox_cache': self._bbox.cache_info()._asdict(),
+        }
+
+def _warm_worker():
+    # pyproj builds its transformer once per thread (~0.2s); pay it before the first request
+    lonlat_to_3035(0.0, 0.0)
+
+class QueryServer(ThreadingHTTPServer):
+    """Serves requests from a fixed pool of warm threads instead of one new thread per request."""
+    request_queue_size = 128 # many clients connecting at once
+
+    def __init__(self, address, handler, workers=WORKERS):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(workers, initializer=_warm_worker)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, route):
+            try:
+                self._send(200, route())
+            except KeyError as e:
+                self._send(400, {'error': f"missing or unknown: {e.args[0]}"})
+            except (ValueError, TypeError) as e:
+                self._send(400, {'error': str(e)})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            features = q['features'].split(',') if q.get('features') else None
+            if url.path == '/point':
+                self._handle(lambda: service.point(float(q['lon']), float(q['lat']), features, int(q.get('slot', 0))))
+            elif url.path == '/bbox':
+                self._handle(lambda: service.bbox(float(q['min_lon']), float(q['min_lat']),
+                                                  float(q['max_lon']), float(q['max_lat']), features))
+            elif url.path.startswith('/station/'):
+                station = service.station(unquote(url.path[len('/station/'):]))
+                self._send(200, station) if station is not None else self._send(404, {'error': 'unknown station'})
+            elif url.path == '/health':
+                self._send(200, service.health())
+            else:
+                self._send(404, {'error': 'unknown endpoint'})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/batch':
+                self._send(404, {'error': 'unknown endpoint'})
+                return
+            def route():
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                return service.batch(body['points'], body.get('features'), int(body.get('slot', 0)))
+            self._handle(route)
+
+        def log_message(self, format, *args):
+            pass # thousands of requests per session; errors are in the responses
+
+    return Handler
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, workers=WORKERS):
+    service = FeatureService()
+    server = QueryServer((host, port), make_handler(service), workers)
+    print(f"Serving cell/station features on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP query service for cell and station features.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
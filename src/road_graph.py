@@ -0,0 +1,203 @@
+"""
+Offline Road-Graph Routing Engine
+
+In-process alternative to the Valhalla container for the travel matrix.
+The pyrosm driving network is turned once into a compact directed CSR graph
+(edge weight = travel time from `maxspeed`, falling back to highway-class
+defaults) and cached in data/road_graph.npz.
+
+Routing runs one Dijkstra tree per station on the reversed graph, cut off at
+the matrix time threshold, so each tree gives origin->station times for every
+origin at once.
+"""
+
+import pandas as pd
+import numpy as np
+import os
+import time
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra, connected_components
+from scipy.spatial import cKDTree
+from pyproj import Transformer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PBF_PATH = os.path.join(BASE_DIR, "../data/portugal-latest.osm.pbf")
+GRAPH_CACHE = os.path.join(BASE_DIR, "../data/road_graph.npz")
+
+# Trees computed per dijkstra call (each row is a dense float64 array over all nodes)
+STATION_BATCH_SIZE = 16
+MAX_SNAP_DISTANCE_M = 1000.0
+MIN_EDGE_TIME_S = 0.01
+
+# Fallback speeds (km/h) when an edge has no usable maxspeed
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 120, 'motorway_link': 60,
+    'trunk': 100, 'trunk_link': 50,
+    'primary': 80, 'primary_link': 40,
+    'secondary': 70, 'secondary_link': 40,
+    'tertiary': 50, 'tertiary_link': 30,
+    'unclassified': 40, 'road': 40,
+    'residential': 30, 'living_street': 10,
+    'service': 20
+}
+DEFAULT_SPEED_KMH = 30
+# Portuguese implicit limits (maxspeed=PT:urban etc.)
+ZONE_SPEEDS_KMH = {'PT:urban': 50, 'PT:rural': 90, 'PT:trunk': 100, 'PT:motorway': 120}
+
+def parse_maxspeed(maxspeed, highway):
+    """Vectorized maxspeed parsing (km/h) with highway-class defaults."""
+    raw = maxspeed.astype(str).str.strip()
+    speed = pd.to_numeric(raw.str.extract(r'(\d+(?:\.\d+)?)', expand=False), errors='coerce')
+    speed = speed.where(~raw.str.contains('mph', regex=False), speed * 1.609)
+    speed = speed.fillna(raw.map(ZONE_SPEEDS_KMH))
+    speed = speed.fillna(highway.map(HIGHWAY_SPEEDS_KMH)).fillna(DEFAULT_SPEED_KMH)
+    return speed.clip(5, 130)
+
+def _directed_edges(edges):
+    """Expands undirected OSM ways into directed (u, v) rows following oneway tags."""
+    oneway = edges['oneway'].astype(str).str.lower() if 'oneway' in edges.columns else pd.Series('', index=edges.index)
+    forward_only = oneway.isin(['yes', 'true', '1']) | edges['highway'].isin(['motorway'])
+    if 'junction' in edges.columns:
+        forward_only |= edges['junction'].astype(str).isin(['roundabout', 'circular'])
+    reverse_only = oneway == '-1'
+
+    fwd = edges[~reverse_only]
+    bwd = edges[~forward_only]
+    return pd.concat([
+        pd.DataFrame({'u': fwd['u'].to_numpy(), 'v': fwd['v'].to_numpy(), 'time_s': fwd['time_s'].to_numpy(), 'length_m': fwd['length'].to_numpy()}),
+        pd.DataFrame({'u': bwd['v'].to_numpy(), 'v': bwd['u'].to_numpy(), 'time_s': bwd['time_s'].to_numpy(), 'length_m': bwd['length'].to_numpy()}),
+    ], ignore_index=True)
+
+def build_road_graph(pbf_path=PBF_PATH, cache_path=GRAPH_CACHE):
+    from pyrosm import OSM
+
+    print(f"Extracting driving network from {pbf_path}...")
+    t0 = time.time()
+    osm = OSM(pbf_path)
+    nodes, edges = osm.get_network(network_type="driving", nodes=True)
+    print(f"  {len(nodes)} nodes, {len(edges)} ways ({time.time()-t0:.1f}s)")
+
+    node_ids = pd.Index(nodes['id'].to_numpy())
+    edges = edges[['u', 'v', 'length', 'highway', 'maxspeed'] + [c for c in ('oneway', 'junction') if c in edges.columns]].copy()
+    speed = parse_maxspeed(edges['maxspeed'], edges['highway'])
+    edges['time_s'] = np.maximum(edges['length'].to_numpy() / (speed.to_numpy() / 3.6), MIN_EDGE_TIME_S)
+
+    directed = _directed_edges(edges)
+    directed['u'] = node_ids.get_indexer(directed['u'])
+    directed['v'] = node_ids.get_indexer(directed['v'])
+    directed = directed[(directed['u'] >= 0) & (directed['v'] >= 0) & (directed['u'] != directed['v'])]
+
+    # Parallel edges: keep the fastest, then lay out in CSR order
+    directed = directed.sort_values(['u', 'v', 'time_s']).drop_duplicates(subset=['u', 'v'])
+    n = len(node_ids)
+    indptr = np.searchsorted(directed['u'].to_numpy(), np.arange(n + 1)).astype(np.int64)
+
+    transformer = Transformer.from_crs("EPSG:4326", "EPSG:3035", always_xy=True)
+    x, y = transformer.transform(nodes['lon'].to_numpy(), nodes['lat'].to_numpy())
+
+    graph = {
+        'indptr': indptr,
+        'indices': directed['v'].to_numpy(np.int32),
+        'time_s': directed['time_s'].to_numpy(np.float32),
+        'length_m': directed['length_m'].to_numpy(np.float32),
+        'node_lon': nodes['lon'].to_numpy(np.float64),
+        'node_lat': nodes['lat'].to_numpy(np.float64),
+        'node_x': np.asarray(x, dtype=np.float32),
+        'node_y': np.asarray(y, dtype=np.float32),
+    }
+
+    # Only snap onto the largest strongly connected component (no dead-end islands)
+    labels = connected_components(_csr(graph, 'time_s'), directed=True, connection='strong')[1]
+    graph['routable'] = labels == np.bincount(labels).argmax()
+
+    stat = os.stat(pbf_path)
+    np.savez(cache_path, pbf_size=stat.st_size, pbf_mtime=stat.st_mtime, **graph)
+    print(f"Cached {n} nodes / {len(directed)} directed edges to {cache_path} ({time.time()-t0:.1f}s)")
+    return graph
+
+def load_road_graph(pbf_path=PBF_PATH, cache_path=GRAPH_CACHE):
+    """Loads the cached graph, rebuilding it if the PBF changed since it was cached."""
+    if os.path.exists(cache_path):
+        data = np.load(cache_path)
+        stat = os.stat(pbf_path) if os.path.exists(pbf_path) else None
+        if stat is None or (int(data['pbf_size']) == stat.st_size and float(data['pbf_mtime']) == stat.st_mtime):
+            return {k: data[k] for k in data.files if not k.startswith('pbf_')}
+        print("PBF changed since the road graph was cached; rebuilding...")
+    return build_road_graph(pbf_path, cache_path)
+
+def _csr(graph, weight):
+    n = len(graph['indptr']) - 1
+    return sparse.csr_matrix((graph[weight], graph['indices'], graph['indptr']), shape=(n, n))
+
+def snap_to_nodes(graph, lon, lat):
+    """Nearest routable node for each point; -1 where the nearest one is beyond MAX_SNAP_DISTANCE_M."""
+    transformer = Transformer.from_crs("EPSG:4326", "EPSG:3035", always_xy=True)
+    x, y = transformer.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    candidates = np.nonzero(graph['routable'])[0]
+    tree = cKDTree(np.column_stack([graph['node_x'][candidates], graph['node_y'][candidates]]))
+    dist, idx = tree.query(np.column_stack([x, y]))
+    return np.where(dist <= MAX_SNAP_DISTANCE_M, candidates[idx], -1)
+
+def _tree_lengths(pred_row, reached, length_rev):
+    """
+    Path length to the tree root for every reached node, by pointer jumping
+    over the predecessor array (log(depth) vectorized passes).
+    """
+    pos = np.full(len(pred_row), -1, dtype=np.int64)
+    pos[reached] = np.arange(len(reached))
+    parent = pred_row[reached]
+    has_parent = parent >= 0
+
+    acc = np.zeros(len(reached), dtype=np.float64)
+    acc[has_parent] = np.asarray(length_rev[parent[has_parent], reached[has_parent]]).ravel()
+    jump = np.where(has_parent, pos[np.maximum(parent, 0)], -1)
+
+    while (jump >= 0).any():
+        m = jump >= 0
+        new_acc = acc.copy()
+        new_acc[m] += acc[jump[m]]
+        new_jump = jump.copy()
+        new_jump[m] = jump[jump[m]]
+        acc, jump = new_acc, new_jump
+    return acc
+
+def station_travel_times(graph, origin_nodes, station_nodes, limit_sec):
+    """
+    Yields DataFrames (origin_idx, station_idx, time_s, distance_km) for every
+    origin that reaches a station within limit_sec, one station batch at a time.
+    """
+    # Trees on the reversed graph give origin -> station times
+    time_rev = _csr(graph, 'time_s').T.tocsr()
+    length_rev = _csr(graph, 'length_m').T.tocsr()
+
+    origin_nodes = np.asarray(origin_nodes)
+    valid_origins = np.nonzero(origin_nodes >= 0)[0]
+    target_nodes = origin_nodes[valid_origins]
+    station_idx = np.nonzero(np.asarray(station_nodes) >= 0)[0]
+
+    for b in range(0, len(station_idx), STATION_BATCH_SIZE):
+        batch = station_idx[b : b + STATION_BATCH_SIZE]
+        dist, pred = dijkstra(time_rev, directed=True, indices=np.asarray(station_nodes)[batch],
+                              limit=limit_sec, return_predecessors=True)
+
+        frames = []
+        for row, s_idx in enumerate(batch):
+            t = dist[row, target_nodes]
+            hit = np.isfinite(t)
+            if not hit.any():
+                continue
+            reached = np.nonzero(np.isfinite(dist[row]))[0]
+            lengths = _tree_lengths(pred[row], reached, length_rev)
+            lookup = np.full(dist.shape[1], np.nan)
+            lookup[reached] = lengths
+            frames.append(pd.DataFrame({
+                'origin_idx': valid_origins[hit],
+                'station_idx': s_idx,
+                'time_s': t[hit],
+                'distance_km': lookup[target_nodes[hit]] / 1000.0
+            }))
+        if frames:
+            yield pd.concat(frames, ignore_index=True)
+
+if __name__ == "__main__":
+    build_road_graph()
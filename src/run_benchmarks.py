@@ -0,0 +1,354 @@
+"""
+Micro-Benchmarks
+
+Times the hot functions on fixed synthetic fixtures (built with the
+generate_synthetic_data.py helpers and fixed seeds) and compares the
+medians with the baseline committed in benchmarks/baseline.json:
+
+    analyze_single_cell    every cell of a sparse rural / dense Lisbon 10km block
+    save_to_db             one block of road_stats appended after 100 saved blocks
+    haversine              10k / 1M origin-station pairs
+    session_timelines      session_bounds + aggregate_station_days, 10k / 1M sessions
+    price_sessions         tariff_engine.price_sessions, 10k / 1M sessions
+    effective_kwh_price    reference profiles at every station tariff
+    normalize_census_ids   mainland-sized census grid id list
+    parse_latlong          10k / 120k RNAL LatLong strings
+
+Each benchmark runs once to warm up, then at least MIN_ROUNDS times (more
+while under MAX_TIME_S). The latest results go to benchmarks/latest.json.
+
+    python run_benchmarks.py                      # run all, compare with the baseline
+    python run_benchmarks.py haversine --quick    # name filter; --quick skips the 1M fixtures
+    python run_benchmarks.py --save-baseline      # accept the current numbers
+    python run_benchmarks.py --compare [old.json] new.json   # saved results, no run
+
+A median slower than the baseline by more than --threshold (default 15%) is
+flagged and the command exits with status 1. Baselines are machine specific,
+so compare (and re-baseline) on the same machine.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+
+# Benchmarked code must not append run_metrics rows
+os.environ["RUN_METRICS"] = "0"
+
+import duckdb
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import LineString, Polygon
+
+from generate_synthetic_data import (CENTER_X, CENTER_Y, DensitySurface, study_extent, make_stations, make_tariffs,
+                                     make_sessions, session_fragments, make_lodging, osm_features)
+from process_cell_logic import analyze_single_cell
+from orchestrate_blocks import save_to_db
+from calculate_travel_matrix import haversine
+from process_session_logic import session_bounds
+from process_mobie_data import aggregate_station_days
+from tariff_engine import parse_prices, build_tariffs, effective_kwh_price, price_sessions
+from process_mobie_prices import REFERENCE_PROFILES
+from census_logic import normalize_census_ids
+from calculate_tourism_pressure import parse_latlong
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, "../benchmarks")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+LATEST_PATH = os.path.join(BENCH_DIR, "latest.json")
+
+MIN_ROUNDS = 3
+MAX_ROUNDS = 50
+MAX_TIME_S = 2.0
+DEFAULT_THRESHOLD = 0.15
+
+FIXTURE_SEED = 2026
+N_STATIONS = 4000 # about the size of the MOBI.E network
+SIZES = {'10k': 10_000, '120k': 120_000, '1M': 1_000_000}
+LARGE = {'1M'} # skipped with --quick
+BLOCKS = {
+    'dense': (2660000, 1940000), # the orchestrate_blocks Lisbon test block
+    'rural': (CENTER_X + 60000, CENTER_Y + 60000), # far outside every synthetic town
+}
+
+BENCHMARKS = {}
+
+def benchmark(name, sizes):
+    """
+    Registers factory(size) under "name[size]" for every size. The factory builds
+    its fixture (untimed) and returns the timed callable, or (setup, run) when
+    every round needs fresh state.
+    """
+    def register(factory):
+        for size in sizes:
+            BENCHMARKS[f"{name}[{size}]"] = (factory, size)
+        return factory
+    return register
+
+# --- Fixtures ---
+
+@lru_cache(maxsize=None)
+def density_surface():
+    extent = study_extent(40)
+    return extent, DensitySurface(extent, np.random.default_rng(FIXTURE_SEED))
+
+@lru_cache(maxsize=None)
+def station_fixture():
+    extent, density = density_surface()
+    rng = np.random.default_rng(FIXTURE_SEED + 1)
+    stations = make_stations(extent, density, rng, N_STATIONS)
+    components = make_tariffs(stations, rng)
+    components['price_val'] = parse_prices(components['TARIFA'])
+    tariffs = build_tariffs(components, stations.set_index('ID')['power_kw'])
+    return stations, tariffs
+
+@lru_cache(maxsize=None)
+def session_fixture(size):
+    """Sessions plus their day fragments in the shape load_fragments returns."""
+    stations, _ = station_fixture()
+    sessions = make_sessions(stations, np.random.default_rng(FIXTURE_SEED + 2), SIZES[size], days=28)
+    f = session_fragments(sessions)
+    fragments = pd.DataFrame({
+        'idCdr': f['idCdr'],
+        'idChargingStation': f['station'],
+        'idDay': f['idDay'].astype(np.int64),
+        'start': f['start'],
+        'end': f['end'],
+        'start_day': f['start'].dt.strftime('%Y%m%d'),
+        'energia_total_periodo': f['period_kwh'],
+    })
+    return sessions, fragments
+
+@lru_cache(maxsize=None)
+def block_fixture(kind):
+    """Roads, POIs and land use of one 10km block (EPSG:3035, as orchestrate_blocks extracts them) and its cells."""
+    _, density = density_surface()
+    bx, by = BLOCKS[kind]
+    ways, pois = osm_features((bx, by, bx + 10000, by + 10000), density, np.random.default_rng(FIXTURE_SEED + 3))
+
+    roads = [(coords, tags['highway']) for coords, tags in ways if 'highway' in tags]
+    roads = gpd.GeoDataFrame({'highway': [h for _, h in roads]}, geometry=[LineString(c) for c, _ in roads], crs="EPSG:3035")
+    landuse = [(coords, tags['landuse']) for coords, tags in ways if 'landuse' in tags]
+    landuse = gpd.GeoDataFrame({'landuse': [l for _, l in landuse]}, geometry=[Polygon(c) for c, _ in landuse], crs="EPSG:3035")
+    poi_cols = {key: pois['value'].where(pois['key'] == key) for key in ['amenity', 'shop', 'tourism']}
+    pois = gpd.GeoDataFrame(poi_cols, geometry=gpd.points_from_xy(pois['x'], pois['y']), crs="EPSG:3035")
+
+    gx, gy = np.meshgrid(np.arange(bx, bx + 10000, 1000), np.arange(by, by + 10000, 1000))
+    cells = [{'cell_id': f"RES1kmN{y // 1000}E{x // 1000}", 'x_3035': x, 'y_3035': y} for x, y in zip(gx.ravel(), gy.ravel())]
+    return cells, roads, pois, landuse
+
+# --- Benchmarks ---
+
+@benchmark('analyze_single_cell', ['rural', 'dense'])
+def bench_analyze_single_cell(size):
+    cells, roads, pois, landuse = block_fixture(size)
+    return lambda: [analyze_single_cell(cell, roads, pois, landuse, None) for cell in cells]
+
+@benchmark('save_to_db', ['100 blocks'])
+def bench_save_to_db(size):
+    rng = np.random.default_rng(FIXTURE_SEED + 4)
+    def block(i, classes):
+        df = pd.DataFrame({'cell_id': [f"RES1kmN{1900 + i}E{2600 + k}" for k in range(100)]})
+        for c in classes:
+            df[c] = np.where(rng.uniform(size=100) < 0.3, np.nan, rng.uniform(0, 5000, 100))
+            df[f"{c}_share"] = df[c] / 5000
+        df['total_road_len'] = df[list(classes)].sum(axis=1)
+        return df
+    classes = ['primary', 'secondary', 'tertiary', 'residential', 'service']
+    history = pd.concat([block(i, classes) for i in range(100)], ignore_index=True)
+    # The new block brings a class the table has not seen, as blocks do
+    new_block = block(100, classes + ['motorway'])
+
+    con = duckdb.connect()
+    con.register("history_df", history.fillna(0.0))
+    con.execute("CREATE TABLE road_stats_base AS SELECT * FROM history_df")
+    def setup():
+        con.execute("CREATE OR REPLACE TABLE road_stats AS SELECT * FROM road_stats_base")
+    return setup, lambda: save_to_db(con, "road_stats", new_block)
+
+@benchmark('haversine', ['10k', '1M'])
+def bench_haversine(size):
+    rng = np.random.default_rng(FIXTURE_SEED + 5)
+    n = SIZES[size]
+    lon1, lon2 = rng.uniform(-9.5, -6.2, (2, n))
+    lat1, lat2 = rng.uniform(37.0, 42.1, (2, n))
+    return lambda: haversine(lon1, lat1, lon2, lat2)
+
+@benchmark('session_timelines', ['10k', '1M'])
+def bench_session_timelines(size):
+    stations, _ = station_fixture()
+    _, fragments = session_fixture(size)
+    stations_meta = stations.set_index('ID')[['sockets']].rename(columns={'sockets': 'stalls'})
+    return lambda: aggregate_station_days(fragments, stations_meta, session_bounds(fragments))
+
+@benchmark('price_sessions', ['10k', '1M'])
+def bench_price_sessions(size):
+    _, tariffs = station_fixture()
+    sessions, _ = session_fixture(size)
+    duration_min = ((sessions['end'] - sessions['start']).dt.total_seconds() / 60).to_numpy()
+    return lambda: price_sessions(tariffs, sessions['station'], sessions['kwh'].to_numpy(), duration_min)
+
+@benchmark('effective_kwh_price', [f"{N_STATIONS // 1000}k stations"])
+def bench_effective_kwh_price(size):
+    _, tariffs = station_fixture()
+    profiles = {k: np.array([p[k] for p in REFERENCE_PROFILES.values()], dtype=float) for k in ['kwh', 'duration_min', 'power_kw']}
+    return lambda: effective_kwh_price(tariffs, **profiles)
+
+@benchmark('normalize_census_ids', ['mainland'])
+def bench_normalize_census_ids(size):
+    # ~89k cells, like GRID1K21_CONT, with a few malformed ids
+    gx, gy = np.meshgrid(np.arange(2630, 2900), np.arange(1730, 2060))
+    ids = pd.Series([f"PT_CRS3035RES1000mN{y * 1000}E{x * 1000}" for x, y in zip(gx.ravel(), gy.ravel())], dtype=object)
+    ids.iloc[::1000] = "INVALID"
+    return lambda: normalize_census_ids(ids)
+
+@benchmark('parse_latlong', ['10k', '120k'])
+def bench_parse_latlong(size):
+    extent, density = density_surface()
+    latlong = make_lodging(extent, density, np.random.default_rng(FIXTURE_SEED + 6), SIZES[size])['LatLong']
+    return lambda: parse_latlong(latlong)
+
+# --- Runner ---
+
+def measure(setup, run):
+    """Warm-up plus MIN_ROUNDS..MAX_ROUNDS timed rounds (setup untimed). Returns the timing stats."""
+    if setup:
+        setup()
+    run()
+    times = []
+    deadline = time.perf_counter() + MAX_TIME_S
+    while len(times) < MIN_ROUNDS or (len(times) < MAX_ROUNDS and time.perf_counter() < deadline):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    return {
+        'rounds': len(times),
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.mean(times),
+        'stddev_s': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'max_s': max(times),
+    }
+
+def machine_info():
+    cpu = platform.processor()
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    return {
+        'cpu': cpu,
+        'cpu_count': os.cpu_count(),
+        'system': platform.system(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'geopandas': gpd.__version__,
+        'duckdb': duckdb.__version__,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(filters=(), quick=False):
+    names = [n for n, (_, size) in BENCHMARKS.items()
+             if (not filters or any(f in n for f in filters)) and not (quick and size in LARGE)]
+    results = {}
+    for name in names:
+        factory, size = BENCHMARKS[name]
+        t0 = time.perf_counter()
+        target = factory(size)
+        setup, run = target if isinstance(target, tuple) else (None, target)
+        fixture_s = time.perf_counter() - t0
+        results[name] = measure(setup, run)
+        print(f"{name:<36} median {results[name]['median_s'] * 1000:10.2f} ms  "
+              f"({results[name]['rounds']} rounds, fixture {fixture_s:.1f}s)")
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'machine': machine_info(),
+        'benchmarks': results,
+    }
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Prints current vs baseline medians. Returns the names slower by more than threshold."""
+    if baseline.get('machine', {}).get('cpu') != current.get('machine', {}).get('cpu'):
+        print(f"[WARN] Baseline was recorded on '{baseline.get('machine', {}).get('cpu')}', "
+              f"this run on '{current.get('machine', {}).get('cpu')}'; ratios are only indicative.")
+    rows = []
+    for name, cur in current['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        ratio = cur['median_s'] / base['median_s'] if base else float('nan')
+        if base is None:
+            status = 'new'
+        elif ratio > 1 + threshold:
+            status = 'SLOWER'
+        elif ratio < 1 / (1 + threshold):
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append({
+            'benchmark': name,
+            'baseline_ms': base['median_s'] * 1000 if base else float('nan'),
+            'current_ms': cur['median_s'] * 1000,
+            'ratio': ratio,
+            'status': status,
+        })
+    df = pd.DataFrame(rows)
+    print(f"\n--- Median vs Baseline (commit {baseline.get('commit')}, threshold {threshold:.0%}) ---")
+    print(df.round({'baseline_ms': 2, 'current_ms': 2, 'ratio': 2}).to_string(index=False) if not df.empty else "(nothing to compare)")
+    return [r['benchmark'] for r in rows if r['status'] == 'SLOWER']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the pipeline's hot functions.")
+    parser.add_argument('filters', nargs='*', help="only benchmarks whose name contains one of these")
+    parser.add_argument('--quick', action='store_true', help="skip the 1M fixtures")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="relative slowdown to flag (0.15 = 15%%)")
+    parser.add_argument('--save-baseline', action='store_true', help="write these results into benchmarks/baseline.json")
+    parser.add_argument('--compare', nargs='+', metavar='JSON', help="compare saved results ([baseline] current) without running")
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline = load_results(args.compare[0] if len(args.compare) > 1 else BASELINE_PATH)
+        current = load_results(args.compare[-1])
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
+
+    current = run_benchmarks(args.filters, args.quick)
+    save_results(current, LATEST_PATH)
+    if args.save_baseline:
+        # Merged, so one benchmark can be re-baselined on its own
+        baseline = load_results(BASELINE_PATH) if os.path.exists(BASELINE_PATH) else {'benchmarks': {}}
+        baseline.update({k: current[k] for k in ('created_at', 'commit', 'machine')})
+        baseline['benchmarks'].update(current['benchmarks'])
+        save_results(baseline, BASELINE_PATH)
+        print(f"Baseline updated: {BASELINE_PATH}")
+    elif os.path.exists(BASELINE_PATH):
+        slower = compare(load_results(BASELINE_PATH), current, args.threshold)
+        if slower:
+            print(f"{len(slower)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}.")
+            sys.exit(1)
+    else:
+        print("No baseline yet; run with --save-baseline to record one.")
@@ -0,0 +1,258 @@
+"""
+Run Metrics
+
+Instrumentation for stages and their hot sections. Every tracked section
+appends one row to the `run_metrics` table in data/run_metrics.db:
+
+    run_id | script | stage | section | key | started_at | wall_s | cpu_s
+    peak_rss_mb | rows_in | rows_out | rows_per_s | calls | profile_path
+
+    with track('osm_blocks', 'block', key=f"X={bx} Y={by}", rows_in=len(cells), profile=True) as m:
+        ...
+        m['rows_out'] = len(results)
+
+Sections inside tight loops (one HTTP request, one chunk) use a Tally, which
+sums its calls and writes a single row when the run ends. Rows are buffered
+and written at exit; parallel stages retry while another process holds the
+database. peak_rss_mb is the process peak so far (ru_maxrss).
+
+Set METRICS_PROFILE=cprofile (or py-spy, if installed) to dump a profile of
+every section opened with profile=True to data/profiles/. RUN_METRICS=0
+disables recording.
+
+    python run_metrics.py              # latest run of every stage vs earlier runs
+    python run_metrics.py osm_blocks   # slowest keys (blocks) of one stage
+"""
+
+import atexit
+import cProfile
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import duckdb
+import pandas as pd
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_DB = os.path.join(BASE_DIR, "../data/run_metrics.db")
+PROFILE_DIR = os.path.join(BASE_DIR, "../data/profiles")
+
+ENABLED = os.environ.get("RUN_METRICS", "1") != "0"
+PROFILER = os.environ.get("METRICS_PROFILE", "").lower() # "", "cprofile" or "py-spy"
+LOCK_RETRIES = 20
+
+RUN_ID = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+SCRIPT = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "interactive"
+
+COLUMNS = ['run_id', 'script', 'stage', 'section', 'key', 'started_at', 'wall_s', 'cpu_s',
+           'peak_rss_mb', 'rows_in', 'rows_out', 'rows_per_s', 'calls', 'profile_path']
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_tallies = []
+
+def peak_rss_mb(who=None):
+    """Peak resident set size in MB of this process (or of a struct_rusage), NaN without `resource`."""
+    if who is None:
+        if resource is None:
+            return float('nan')
+        who = resource.getrusage(resource.RUSAGE_SELF)
+    # Linux reports KB, macOS bytes
+    return who.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def record(stage, section, wall_s, cpu_s, key=None, rows_in=None, rows_out=None, calls=1,
+           started_at=None, peak_mb=None, profile_path=None, script=None):
+    if not ENABLED:
+        return
+    rows = rows_out if rows_out is not None else rows_in
+    with _buffer_lock:
+        _buffer.append({
+            'run_id': RUN_ID,
+            'script': script or SCRIPT,
+            'stage': stage,
+            'section': section,
+            'key': None if key is None else str(key),
+            'started_at': started_at or datetime.now(),
+            'wall_s': wall_s,
+            'cpu_s': cpu_s,
+            'peak_rss_mb': peak_rss_mb() if peak_mb is None else peak_mb,
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+            'rows_per_s': rows / wall_s if rows is not None and wall_s > 0 else None,
+            'calls': calls,
+            'profile_path': profile_path,
+        })
+
+def _profile_path(stage, section, key, ext):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    label = re.sub(r'[^A-Za-z0-9=_-]+', '_', "_".join(str(p) for p in (stage, section, key) if p is not None))
+    return os.path.join(PROFILE_DIR, f"{label}_{RUN_ID}.{ext}")
+
+@contextmanager
+def _profiled(stage, section, key, enabled):
+    """Yields the profile path (or None) while the selected profiler samples the block."""
+    if not enabled or PROFILER not in ('cprofile', 'py-spy'):
+        yield None
+        return
+    if PROFILER == 'cprofile':
+        path = _profile_path(stage, section, key, 'prof')
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+        return
+    if shutil.which('py-spy') is None:
+        print("[WARN] METRICS_PROFILE=py-spy but py-spy is not installed; not profiling.")
+        yield None
+        return
+    path = _profile_path(stage, section, key, 'svg')
+    spy = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()), '--output', path, '--nonblocking'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        yield path
+    finally:
+        # py-spy writes the flame graph when interrupted
+        spy.send_signal(signal.SIGINT)
+        spy.wait(timeout=30)
+
+@contextmanager
+def track(stage, section='total', key=None, rows_in=None, profile=False):
+    """
+    Times the enclosed block. Yields a dict whose 'rows_in'/'rows_out' the caller
+    may fill in; the row is recorded even if the block raises.
+    """
+    m = {'rows_in': rows_in, 'rows_out': None}
+    started_at = datetime.now()
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    with _profiled(stage, section, key, profile) as path:
+        try:
+            yield m
+        finally:
+            record(stage, section, time.perf_counter() - wall0, time.process_time() - cpu0, key=key,
+                   rows_in=m['rows_in'], rows_out=m['rows_out'], started_at=started_at, profile_path=path)
+
+class Tally:
+    """Accumulates a section that runs many times; one row (with calls) is written at exit."""
+
+    def __init__(self, stage, section, key=None):
+        self.stage, self.section, self.key = stage, section, key
+        self.calls = 0
+        self.wall_s = self.cpu_s = 0.0
+        self.rows_in = self.rows_out = None
+        self.started_at = None
+        _tallies.append(self)
+
+    @contextmanager
+    def __call__(self, rows_in=None):
+        m = {'rows_in': rows_in, 'rows_out': None}
+        self.started_at = self.started_at or datetime.now()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield m
+        finally:
+            self.wall_s += time.perf_counter() - wall0
+            self.cpu_s += time.process_time() - cpu0
+            self.calls += 1
+            if m['rows_in'] is not None:
+                self.rows_in = (self.rows_in or 0) + m['rows_in']
+            if m['rows_out'] is not None:
+                self.rows_out = (self.rows_out or 0) + m['rows_out']
+
+    def record(self):
+        if self.calls:
+            record(self.stage, self.section, self.wall_s, self.cpu_s, key=self.key, rows_in=self.rows_in,
+                   rows_out=self.rows_out, calls=self.calls, started_at=self.started_at)
+        self.calls = 0
+        self.wall_s = self.cpu_s = 0.0
+        self.rows_in = self.rows_out = self.started_at = None
+
+def flush():
+    """Writes the buffered rows, retrying while another process holds run_metrics.db."""
+    for tally in _tallies:
+        tally.record()
+    with _buffer_lock:
+        if not _buffer:
+            return
+        rows = pd.DataFrame(_buffer, columns=COLUMNS)
+        _buffer.clear()
+
+    os.makedirs(os.path.dirname(METRICS_DB), exist_ok=True)
+    delay = 0.1
+    for _ in range(LOCK_RETRIES):
+        try:
+            con = duckdb.connect(METRICS_DB)
+            break
+        except duckdb.IOException:
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    else:
+        print(f"[WARN] {METRICS_DB} stayed locked; dropped {len(rows)} metric rows.")
+        return
+    try:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS run_metrics (
+                run_id VARCHAR, script VARCHAR, stage VARCHAR, section VARCHAR, key VARCHAR,
+                started_at TIMESTAMP, wall_s DOUBLE, cpu_s DOUBLE, peak_rss_mb DOUBLE,
+                rows_in BIGINT, rows_out BIGINT, rows_per_s DOUBLE, calls BIGINT, profile_path VARCHAR
+            )
+        """)
+        con.register("metrics_df", rows)
+        con.execute(f"INSERT INTO run_metrics SELECT {', '.join(COLUMNS)} FROM metrics_df")
+    finally:
+        con.close()
+
+atexit.register(flush)
+
+def report(stage=None):
+    if not os.path.exists(METRICS_DB):
+        print("No metrics recorded yet.")
+        return
+    con = duckdb.connect(METRICS_DB, read_only=True)
+    if stage is None:
+        # Latest run of each stage/section against the median of its earlier runs
+        df = con.execute("""
+            WITH runs AS (
+                SELECT stage, section, run_id, sum(wall_s) AS wall_s, sum(cpu_s) AS cpu_s,
+                       max(peak_rss_mb) AS peak_rss_mb, sum(rows_out) AS rows_out, min(started_at) AS started_at
+                FROM run_metrics GROUP BY ALL
+            ), ranked AS (
+                SELECT *, row_number() OVER (PARTITION BY stage, section ORDER BY started_at DESC) AS rn FROM runs
+            ), previous AS (
+                SELECT stage, section, median(wall_s) AS prev_wall_s FROM ranked WHERE rn > 1 GROUP BY ALL
+            )
+            SELECT l.stage, l.section, l.started_at, round(l.wall_s, 2) AS wall_s, round(l.cpu_s, 2) AS cpu_s,
+                   round(l.peak_rss_mb) AS peak_rss_mb, l.rows_out,
+                   round(p.prev_wall_s, 2) AS prev_median_wall_s,
+                   round(l.wall_s / nullif(p.prev_wall_s, 0), 2) AS ratio
+            FROM ranked l LEFT JOIN previous p USING (stage, section)
+            WHERE l.rn = 1
+            ORDER BY l.stage, l.section
+        """).df()
+    else:
+        df = con.execute("""
+            SELECT section, key, count(*) AS runs, round(median(wall_s), 2) AS median_wall_s,
+                   round(max(wall_s), 2) AS max_wall_s, round(median(rows_per_s), 1) AS median_rows_per_s,
+                   round(max(peak_rss_mb)) AS peak_rss_mb
+            FROM run_metrics WHERE stage = ? AND key IS NOT NULL
+            GROUP BY ALL ORDER BY median_wall_s DESC LIMIT 20
+        """, [stage]).df()
+    con.close()
+    print(df.to_string(index=False) if not df.empty else "No metrics recorded yet.")
+
+if __name__ == "__main__":
+    report(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,423 @@
+"""
+Pipeline Runner
+
+Runs the processing scripts as a dependency graph and skips every stage whose
+inputs have not changed since its last successful run.
+
+Each stage declares its input files and the tables it reads and writes
+("store.table"). Dependencies follow from the tables: a stage depends on the
+stage that last wrote each table it reads. A stage's fingerprint hashes
+
+- the content of its input files (sha256, re-hashed only when size/mtime move),
+- the source of its script and of every local module it imports,
+- its arguments and the environment variables it listens to,
+- the fingerprints of its upstream stages (the "version" of the tables it reads),
+
+and is stored in data/pipeline_state.json after a successful run. An
+unchanged fingerprint means the stage is skipped; a new detailed-*.csv only
+reruns the session stages and what reads their tables.
+
+Independent stages run in parallel. DuckDB allows a single process per
+database file, so a stage holds a lock on every store it touches and stages
+sharing a store (e.g. census and income in osm_analysis.db) still run one at
+a time. Script output goes to data/pipeline_logs/<stage>.log, and each
+stage's wall/CPU time and peak RSS to run_metrics (see run_metrics.py).
+
+Manual stages (append-only OSM extraction, Valhalla routing) only run when
+named; their last recorded version still feeds downstream fingerprints, so
+rerunning one by hand through the runner refreshes what reads its tables.
+
+Usage (from src/):
+    python run_pipeline.py                  # every stale non-manual stage
+    python run_pipeline.py catchment        # catchment and its stale upstreams
+    python run_pipeline.py --dry-run        # show the plan only
+    python run_pipeline.py census --force   # rerun census regardless of hashes
+    python run_pipeline.py travel_matrix --mark-done   # adopt a matrix built by hand
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import run_metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "../data")
+STATE_PATH = os.path.join(DATA_DIR, "pipeline_state.json")
+LOG_DIR = os.path.join(DATA_DIR, "pipeline_logs")
+
+HASH_CHUNK = 1 << 20
+
+# Lock units: DuckDB files and Parquet/NumPy directories
+STORES = {
+    'osm': "osm_analysis.db",
+    'mobie': "mobie_data.db",
+    'matrix': "travel_matrix.db",
+    'routing': "routing_cache.db",
+    'fragments': "session_fragments",
+    'archive': "session_archive",
+    'cube': "demand_cube",
+    'features': "feature_store",
+    'cells': "feature_cube",
+}
+
+# In execution order; inputs are paths or globs relative to data/
+STAGES = {
+    'grid_spine': dict(
+        script='create_grid_spine.py',
+        writes=['osm.grid_spine'],
+    ),
+    'census': dict(
+        script='process_census.py',
+        inputs=['GRID1K21_CONT.gpkg'],
+        writes=['osm.census_stats'],
+    ),
+    # Appends per block, so a rerun would duplicate rows: manual
+    'osm_blocks': dict(
+        script='orchestrate_blocks.py',
+        inputs=['portugal-latest.osm.pbf'],
+        reads=['osm.grid_spine'],
+        writes=['osm.road_stats', 'osm.poi_stats', 'osm.poly_stats', 'osm.cell_origins'],
+        manual=True,
+    ),
+    'internal_origins': dict(
+        script='backfill_internal_origins.py',
+        inputs=['portugal-latest.osm.pbf'],
+        reads=['osm.grid_spine', 'osm.cell_origins'],
+        writes=['osm.cell_origins'],
+        manual=True,
+    ),
+    'income': dict(
+        script='process_income_data.py',
+        inputs=['Agregados_pub_2023.csv', 'Sujeitos Passivos_pub_2023.csv', 'Continente_CAOP2024_1.gpkg'],
+        reads=['osm.grid_spine'],
+        writes=['osm.income'],
+    ),
+    'cell_admin': dict(
+        script='build_cell_admin.py',
+        args=['--force'],
+        inputs=['Continente_CAOP2024_1.gpkg'],
+        reads=['osm.grid_spine'],
+        writes=['osm.cell_admin'],
+    ),
+    'tourism': dict(
+        script='calculate_tourism_pressure.py',
+        inputs=['Estabelecimentos_de_Alojamento_Local.csv', 'GRID1K21_CONT.gpkg'],
+        writes=['osm.tourism'],
+    ),
+    'cell_lags': dict(
+        script='spatial_lag.py',
+        reads=['osm.grid_spine', 'osm.census_stats', 'osm.road_stats', 'osm.poi_stats', 'osm.tourism'],
+        writes=['osm.cell_lags'],
+    ),
+    'feature_cube': dict(
+        script='build_feature_cube.py',
+        reads=['osm.grid_spine', 'osm.census_stats', 'osm.road_stats', 'osm.poi_stats', 'osm.poly_stats',
+               'osm.income', 'osm.tourism', 'osm.cell_lags'],
+        writes=['cells.features'],
+    ),
+    'mobie_static': dict(
+        script='process_mobie_static.py',
+        inputs=['MOBIe_Lista_de_postos.csv'],
+        writes=['mobie.stations', 'mobie.station_cells'],
+    ),
+    # Also refreshes the touched months of the session archive, once it exists
+    'mobie_sessions': dict(
+        script='process_mobie_data.py',
+        inputs=['detailed-*.csv'],
+        reads=['mobie.stations'],
+        writes=['mobie.session_stats', 'mobie.session_files', 'fragments.sessions', 'archive.sessions'],
+    ),
+    'session_archive': dict(
+        script='build_session_archive.py',
+        reads=['fragments.sessions'],
+        writes=['archive.sessions'],
+    ),
+    'mobie_prices': dict(
+        script='process_mobie_prices.py',
+        inputs=['MOBIE_Tarifas.csv'],
+        reads=['mobie.stations', 'archive.sessions'],
+        writes=['mobie.prices', 'mobie.session_costs'],
+    ),
+    'demand_cube': dict(
+        script='build_demand_cube.py',
+        reads=['mobie.stations', 'fragments.sessions'],
+        writes=['mobie.demand_profiles', 'cube.demand_cube'],
+    ),
+    # Needs the Valhalla container: manual
+    'snap': dict(
+        script='snap_locations.py',
+        reads=['osm.cell_origins', 'mobie.stations'],
+        writes=['routing.snapped_locations'],
+        manual=True,
+    ),
+    'travel_matrix': dict(
+        script='calculate_travel_matrix.py',
+        env=['ROUTING_BACKEND'],
+        reads=['osm.cell_origins', 'mobie.stations', 'routing.snapped_locations'],
+        writes=['matrix.travel_times', 'matrix.departure_slots', 'matrix.cell_topk', 'routing.route_cache'],
+        manual=True,
+    ),
+    'catchment': dict(
+        script='calculate_station_catchment.py',
+        reads=['matrix.travel_times', 'osm.census_stats', 'osm.poi_stats', 'osm.income', 'osm.tourism'],
+        writes=['mobie.station_catchment'],
+    ),
+    # Rewrites only the months whose joined rows changed
+    'feature_store': dict(
+        script='build_feature_store.py',
+        reads=['mobie.session_stats', 'mobie.stations', 'mobie.prices', 'mobie.station_catchment',
+               'osm.census_stats', 'osm.tourism', 'osm.cell_lags'],
+        writes=['features.station_days'],
+    ),
+}
+
+def stage_dependencies(stages=STAGES):
+    """stage -> upstream stages: every stage declared before it that writes a table it reads."""
+    writers = {}
+    deps = {}
+    for name, stage in stages.items():
+        # All writers, not just the last: a run that leaves out internal_origins still orders the matrix after osm_blocks
+        deps[name] = sorted({w for t in stage.get('reads', []) for w in writers.get(t, [])})
+        for table in stage.get('writes', []):
+            writers.setdefault(table, []).append(name)
+    return deps
+
+def stage_stores(stage):
+    return sorted({t.split('.')[0] for t in stage.get('reads', []) + stage.get('writes', [])})
+
+def local_modules(script, seen=None):
+    """The script and every module in src/ it imports, transitively."""
+    seen = set() if seen is None else seen
+    if script in seen:
+        return seen
+    seen.add(script)
+    with open(os.path.join(BASE_DIR, script), encoding='utf-8') as f:
+        source = f.read()
+    for module in re.findall(r'^\s*(?:from|import)\s+(\w+)', source, flags=re.MULTILINE):
+        if os.path.exists(os.path.join(BASE_DIR, f"{module}.py")):
+            local_modules(f"{module}.py", seen)
+    return seen
+
+def file_hash(path, cache):
+    """sha256 of a file; reuses the cached digest while size and mtime are unchanged."""
+    st = os.stat(path)
+    key = os.path.relpath(path, BASE_DIR)
+    entry = cache.get(key)
+    if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+        return entry['sha256']
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    cache[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': h.hexdigest()}
+    return cache[key]['sha256']
+
+def resolve_inputs(stage):
+    """Input paths (globs expanded, sorted) and the patterns that matched nothing."""
+    paths, missing = [], []
+    for pattern in stage.get('inputs', []):
+        matches = sorted(glob.glob(os.path.join(DATA_DIR, pattern)))
+        if matches:
+            paths.extend(matches)
+        else:
+            missing.append(pattern)
+    return paths, missing
+
+def fingerprint(name, stage, upstream_versions, file_cache):
+    h = hashlib.sha256()
+    for module in sorted(local_modules(stage['script'])):
+        h.update(f"src:{module}:{file_hash(os.path.join(BASE_DIR, module), file_cache)}\n".encode())
+    h.update(f"args:{stage.get('args', [])}\n".encode())
+    for var in stage.get('env', []):
+        h.update(f"env:{var}={os.environ.get(var, '')}\n".encode())
+    paths, _ = resolve_inputs(stage)
+    for path in paths:
+        h.update(f"input:{os.path.relpath(path, DATA_DIR)}:{file_hash(path, file_cache)}\n".encode())
+    for up in sorted(upstream_versions):
+        h.update(f"upstream:{up}:{upstream_versions[up]}\n".encode())
+    return h.hexdigest()
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    return {'stages': {}, 'files': {}}
+
+def save_state(state):
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATE_PATH)
+
+def plan(targets, state, force=()):
+    """
+    Walks the graph in declaration order and returns {stage: (action, fingerprint, reason)}
+    for the targets and their upstreams. action is 'run', 'skip' or 'blocked'.
+    A stage runs when its fingerprint differs from the recorded one (which
+    includes any upstream that is about to run) or when forced.
+    """
+    deps = stage_dependencies()
+    needed = set()
+    def add(name):
+        if name not in needed:
+            needed.add(name)
+            for up in deps[name]:
+                if not STAGES[up].get('manual') or up in targets:
+                    add(up)
+    for name in targets:
+        add(name)
+
+    recorded = state['stages']
+    result = {}
+    for name, stage in STAGES.items():
+        if name not in needed:
+            continue
+        upstream = {}
+        blocked = None
+        for up in deps[name]:
+            if up in result and result[up][0] != 'blocked':
+                upstream[up] = result[up][1]
+            elif up not in result:
+                # Manual stage outside the selection; run by hand if never recorded
+                upstream[up] = recorded.get(up, {}).get('fingerprint', 'unrecorded')
+            else:
+                blocked = f"upstream {up} is blocked"
+        _, missing = resolve_inputs(stage)
+        if missing:
+            blocked = f"missing input {', '.join(missing)}"
+        if blocked:
+            result[name] = ('blocked', None, blocked)
+            continue
+
+        fp = fingerprint(name, stage, upstream, state['files'])
+        if name in force:
+            result[name] = ('run', fp, 'forced')
+        elif name not in recorded:
+            result[name] = ('run', fp, 'never ran')
+        elif recorded[name]['fingerprint'] != fp:
+            result[name] = ('run', fp, 'inputs or upstream changed')
+        else:
+            result[name] = ('skip', fp, 'up to date')
+    return result
+
+def run_stage(name, stage, store_locks):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"{name}.log")
+    locks = [store_locks[s] for s in stage_stores(stage)]
+    for lock in locks:
+        lock.acquire()
+    try:
+        print(f"[{name}] started ({stage['script']})")
+        started_at = datetime.now()
+        start = time.time()
+        with open(log_path, 'w') as log:
+            proc = subprocess.Popen([sys.executable, stage['script']] + stage.get('args', []),
+                                    cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT)
+            if hasattr(os, 'wait4'):
+                # The child's own CPU time and peak RSS, even with other stages running alongside
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                cpu_s, peak_mb = usage.ru_utime + usage.ru_stime, run_metrics.peak_rss_mb(usage)
+            else:
+                proc.wait()
+                cpu_s, peak_mb = float('nan'), float('nan')
+        seconds = time.time() - start
+        run_metrics.record(name, 'stage', seconds, cpu_s, started_at=started_at, peak_mb=peak_mb,
+                           script=stage['script'], key=None if proc.returncode == 0 else f"exit {proc.returncode}")
+        return proc.returncode, seconds, log_path
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+def record_stage(state, name, fp, seconds):
+    state['stages'][name] = {
+        'fingerprint': fp,
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'seconds': round(seconds, 1),
+    }
+    save_state(state)
+
+def run_pipeline(targets=None, force=False, dry_run=False, mark_done=False, jobs=4):
+    targets = targets or [n for n, s in STAGES.items() if not s.get('manual')]
+    unknown = [t for t in targets if t not in STAGES]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)}. Stages: {', '.join(STAGES)}")
+
+    state = load_state()
+    steps = plan(targets, state, force=set(targets) if force else set())
+
+    print("--- Pipeline Plan ---")
+    for name, (action, fp, reason) in steps.items():
+        print(f"  {name:<18} {action:<8} {reason}")
+    to_run = [n for n, (action, _, _) in steps.items() if action == 'run']
+    if mark_done:
+        # Adopts outputs built outside the runner (e.g. a matrix routed before it existed)
+        for name in to_run:
+            record_stage(state, name, steps[name][1], 0.0)
+        print(f"Recorded {len(to_run)} stage(s) as up to date without running them.")
+        return steps
+    if dry_run or not to_run:
+        if not dry_run:
+            save_state(state) # keeps the file hash cache
+        print("Nothing to run." if not to_run else f"{len(to_run)} stage(s) would run.")
+        return steps
+
+    deps = stage_dependencies()
+    store_locks = {s: threading.Lock() for s in STORES}
+    done, failed = set(), set()
+    pending = list(to_run)
+    running = {}
+
+    print(f"--- Running {len(to_run)} stage(s), up to {jobs} in parallel ---")
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                ups = [u for u in deps[name] if u in to_run]
+                if any(u in failed for u in ups):
+                    pending.remove(name)
+                    failed.add(name)
+                    print(f"[{name}] skipped: upstream failed")
+                elif all(u in done for u in ups):
+                    pending.remove(name)
+                    running[pool.submit(run_stage, name, STAGES[name], store_locks)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                code, seconds, log_path = future.result()
+                if code == 0:
+                    done.add(name)
+                    record_stage(state, name, steps[name][1], seconds)
+                    print(f"[{name}] done in {seconds:.1f}s")
+                else:
+                    failed.add(name)
+                    print(f"[{name}] FAILED (exit {code}) after {seconds:.1f}s, see {log_path}")
+                    with open(log_path) as f:
+                        for line in f.readlines()[-10:]:
+                            print(f"    {line.rstrip()}")
+
+    print(f"Pipeline finished: {len(done)} ran, {len(failed)} failed, "
+          f"{sum(a == 'skip' for a, _, _ in steps.values())} up to date.")
+    if failed:
+        sys.exit(1)
+    return steps
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline stages whose inputs changed.")
+    parser.add_argument('stages', nargs='*', help=f"stages to bring up to date (default: all non-manual). One of: {', '.join(STAGES)}")
+    parser.add_argument('--force', action='store_true', help="rerun the named stages even if unchanged")
+    parser.add_argument('--dry-run', action='store_true', help="print the plan without running anything")
+    parser.add_argument('--mark-done', action='store_true', help="record the stale stages as up to date without running them")
+    parser.add_argument('--jobs', type=int, default=4, help="maximum stages running at once")
+    args = parser.parse_args()
+    run_pipeline(args.stages, force=args.force, dry_run=args.dry_run, mark_done=args.mark_done, jobs=args.jobs)
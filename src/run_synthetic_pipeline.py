@@ -0,0 +1,137 @@
+"""
+Synthetic End-to-End Run
+
+Builds a throwaway workspace (<workspace>/src with a copy of these scripts,
+<workspace>/data with generate_synthetic_data.py output), runs the pipeline
+there through run_pipeline.py and reports per-stage throughput from the
+workspace's run_metrics table. The real data/ directory is never touched.
+
+    python run_synthetic_pipeline.py --scale 5
+    python run_synthetic_pipeline.py --scale 1 --with-osm   # + OSM blocks, offline matrix, catchment
+
+The report (stage wall/CPU time, peak RSS, input rows/s and hot sections) is
+printed and saved as <workspace>/data/synthetic_report.json.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import duckdb
+import pandas as pd
+
+from generate_synthetic_data import generate
+from run_pipeline import STAGES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORKSPACE = os.path.join(tempfile.gettempdir(), "enable_synthetic")
+
+# Need pyrosm (and the matrix an OSM road graph); the matrix runs offline, no Valhalla.
+# internal_origins is left out: backfill_internal_origins.py reads a cell_stats table the block stage does not write.
+OSM_STAGES = ['osm_blocks', 'travel_matrix', 'catchment']
+
+def prepare_workspace(workspace, reuse_data=False, **params):
+    src_dir = os.path.join(workspace, "src")
+    data_dir = os.path.join(workspace, "data")
+    if os.path.exists(src_dir):
+        shutil.rmtree(src_dir)
+    os.makedirs(src_dir)
+    for path in glob.glob(os.path.join(BASE_DIR, "*.py")):
+        shutil.copy2(path, src_dir)
+
+    manifest_path = os.path.join(data_dir, "synthetic_manifest.json")
+    if reuse_data and os.path.exists(manifest_path):
+        print(f"Reusing synthetic data in {data_dir}")
+        # Outputs of the previous run go; the generated inputs stay
+        with open(manifest_path) as f:
+            inputs = set(json.load(f)['rows']) | {"synthetic_manifest.json"}
+        for name in os.listdir(data_dir):
+            if name not in inputs:
+                path = os.path.join(data_dir, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    else:
+        if os.path.exists(data_dir):
+            shutil.rmtree(data_dir)
+        generate(data_dir, **params)
+    with open(manifest_path) as f:
+        return src_dir, data_dir, json.load(f)
+
+def input_rows(stage, manifest):
+    """Rows across the generated files a stage reads (None if it reads none)."""
+    rows = [n for name, n in manifest['rows'].items()
+            for pattern in stage.get('inputs', []) if glob.fnmatch.fnmatch(name, pattern)]
+    return sum(rows) if rows else None
+
+def report(data_dir, manifest, since):
+    con = duckdb.connect(os.path.join(data_dir, "run_metrics.db"), read_only=True)
+    metrics = con.execute("SELECT * FROM run_metrics WHERE started_at >= ? ORDER BY started_at", [since]).df()
+    con.close()
+
+    stages = metrics[metrics['section'] == 'stage'].copy()
+    stages['input_rows'] = [input_rows(STAGES[s], manifest) for s in stages['stage']]
+    stages['input_rows_per_s'] = stages['input_rows'] / stages['wall_s']
+    stages['failed'] = stages['key'].notna()
+    sections = metrics[~metrics['section'].isin(['stage', 'total'])].groupby(['stage', 'section'], as_index=False).agg(
+        calls=('calls', 'sum'), wall_s=('wall_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+        rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'))
+    sections['rows_per_s'] = sections[['rows_out', 'rows_in']].max(axis=1) / sections['wall_s']
+
+    print("\n--- Stage Throughput ---")
+    print(stages[['stage', 'wall_s', 'cpu_s', 'peak_rss_mb', 'input_rows', 'input_rows_per_s', 'failed']].round(2).to_string(index=False))
+    print("\n--- Hot Sections ---")
+    print(sections.round(3).to_string(index=False) if not sections.empty else "(none)")
+
+    result = {
+        'params': manifest['params'],
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'stages': stages[['stage', 'wall_s', 'cpu_s', 'peak_rss_mb', 'input_rows', 'input_rows_per_s', 'failed']].to_dict('records'),
+        'sections': sections.to_dict('records'),
+    }
+    with open(os.path.join(data_dir, "synthetic_report.json"), 'w') as f:
+        json.dump(result, f, indent=2, default=lambda v: None if pd.isna(v) else float(v))
+    return result
+
+def run_synthetic_pipeline(workspace=DEFAULT_WORKSPACE, with_osm=False, jobs=4, reuse_data=False, **params):
+    print(f"--- Preparing workspace {workspace} ---")
+    src_dir, data_dir, manifest = prepare_workspace(workspace, reuse_data, **params)
+
+    targets = [n for n, s in STAGES.items() if not s.get('manual') and n != 'catchment']
+    if with_osm:
+        if 'portugal-latest.osm.pbf' not in manifest['rows']:
+            print("[WARN] No synthetic PBF (pyosmium missing); skipping OSM stages.")
+        else:
+            targets += OSM_STAGES
+
+    print(f"--- Running {len(targets)} stages ---")
+    since = datetime.now()
+    start = time.time()
+    env = dict(os.environ, ROUTING_BACKEND="offline", RUN_METRICS="1")
+    proc = subprocess.run([sys.executable, "run_pipeline.py", *targets, "--force", "--jobs", str(jobs)], cwd=src_dir, env=env)
+    print(f"Pipeline {'finished' if proc.returncode == 0 else 'FAILED'} in {time.time() - start:.1f}s")
+
+    result = report(data_dir, manifest, since)
+    if proc.returncode != 0:
+        sys.exit(proc.returncode)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline end to end on synthetic inputs.")
+    parser.add_argument('--workspace', default=DEFAULT_WORKSPACE)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--extent-km', type=int, default=40)
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--exports', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--with-osm', action='store_true', help="also run OSM extraction, the offline matrix and catchment")
+    parser.add_argument('--reuse-data', action='store_true', help="keep the generated inputs of the previous run")
+    parser.add_argument('--jobs', type=int, default=4)
+    args = parser.parse_args()
+    run_synthetic_pipeline(args.workspace, args.with_osm, args.jobs, args.reuse_data, scale=args.scale,
+                           extent_km=args.extent_km, days=args.days, exports=args.exports, seed=args.seed)
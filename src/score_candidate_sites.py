@@ -0,0 +1,238 @@
+"""
+What-If Site Scoring (Candidate Charger Locations)
+
+Scores a batch of hypothetical station sites against today's network without
+adding them to `stations` or rebuilding the travel matrix. Each candidate is
+routed only from the cell origins near it:
+
+- valhalla: the matrix's Euclidean filter (candidate_pairs) picks the origins,
+  cached routes are reused from route_cache and the rest is requested as one
+  many-origins-to-one-candidate matrix per chunk, then cached, so scoring the
+  same site again is free
+- offline: one 30-minute shortest-path tree per candidate on the road graph
+
+Cell times (best over the cell's origins) are compared with each cell's
+baseline best time (slot 0 of cell_topk). Cells the matrix never routed
+(ORIGIN_LIMIT) have no baseline and are left out of the deltas. Metrics per candidate:
+
+- {feature}_{band}min:  the candidate's own catchment, as in station_catchment
+- new_pop_{band}min:    population of cells with no station within the band today
+- cells_improved:       cells whose best time gets shorter
+- access_gain:          population-weighted minutes saved, with times capped at 30 minutes
+
+Candidates are scored independently, each against today's network rather than
+against each other, and ranked by RANK_BY. Output: `candidate_scores` in
+mobie_data.db.
+
+    python score_candidate_sites.py candidates.csv                        # candidate_id, lat, lon
+    python score_candidate_sites.py candidates.csv --rank-by new_pop_20min
+"""
+
+import argparse
+import duckdb
+import requests
+import pandas as pd
+import numpy as np
+import os
+from calculate_travel_matrix import (
+    ROUTING_BACKEND, VALHALLA_URL, TIME_THRESHOLD_MIN, TIME_THRESHOLD_SEC, TARGET_CHUNK_SIZE, ORIGIN_LIMIT,
+    candidate_pairs, load_origins, open_route_cache, load_cached_routes, save_cached_routes,
+)
+from calculate_station_catchment import TIME_BANDS_MIN, WEIGHT_FEATURE, EXTENSIVE_FEATURES, INTENSIVE_FEATURES, load_cell_features, catchment_table
+from snap_locations import origin_key, attach_snaps, valhalla_location
+from run_metrics import track, Tally
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OSM_DB = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+MOBIE_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
+MATRIX_DB = os.path.join(BASE_DIR, "../data/travel_matrix.db")
+
+RANK_BY = 'access_gain'
+TOP_N = 10
+
+def request_sources(session, sources, target):
+    """Static many-to-one matrix: one {time, distance} per source."""
+    payload = {
+        "sources": sources,
+        "targets": [target],
+        "costing": "auto"
+    }
+    response = session.post(VALHALLA_URL, json=payload, timeout=60)
+    response.raise_for_status()
+    return [row[0] for row in response.json().get('sources_to_targets', [])]
+
+def route_valhalla(origins, candidates):
+    """(origin_idx, candidate_idx, time_s) for every nearby pair, from route_cache or Valhalla."""
+    near = candidate_pairs(origins, candidates)
+    pairs = pd.DataFrame({
+        'origin_idx': np.repeat(np.arange(len(near)), [len(c) for c in near]),
+        'candidate_idx': np.concatenate(near + [np.empty(0, dtype=np.int64)]),
+    })
+    pairs['origin_key'] = origins['origin_key'].to_numpy()[pairs['origin_idx']]
+    pairs['target_key'] = candidates['target_key'].to_numpy()[pairs['candidate_idx']]
+    print(f"Candidate pairs: {len(pairs):,}")
+
+    conn_cache = open_route_cache()
+    cached = load_cached_routes(conn_cache, pairs, [0])
+    hits = [cached.get((o, t, 0)) for o, t in zip(pairs['origin_key'], pairs['target_key'])]
+    pairs['cached'] = [h is not None for h in hits]
+    pairs['time_s'] = [h[0] if h is not None else None for h in hits]
+    missing = pairs[~pairs['cached']]
+    print(f"Route cache hits: {len(pairs) - len(missing):,}, to request: {len(missing):,}")
+
+    session = requests.Session()
+    origin_locations = [valhalla_location(o) for o in origins.to_dict('records')]
+    requests_tally = Tally('candidate_scoring', 'valhalla_request')
+    routed = []
+    for c, group in missing.groupby('candidate_idx'):
+        target = valhalla_location(candidates.iloc[c].to_dict())
+        for j in range(0, len(group), TARGET_CHUNK_SIZE):
+            chunk = group.iloc[j : j + TARGET_CHUNK_SIZE]
+            try:
+                with requests_tally(rows_in=len(chunk)) as m:
+                    result = request_sources(session, [origin_locations[o] for o in chunk['origin_idx']], target)
+                    m['rows_out'] = len(result)
+            except Exception as e:
+                print(f"  [ERROR] Candidate {candidates.at[c, 'candidate_id']} chunk {j}-{j+len(chunk)}: {e}")
+                continue
+            routed.append(chunk.assign(time_s=[r.get('time') for r in result],
+                                       distance_km=[r.get('distance') for r in result]))
+
+    if routed:
+        new_routes = pd.concat(routed, ignore_index=True)
+        save_cached_routes(conn_cache, new_routes.assign(slot=0)[['origin_key', 'target_key', 'slot', 'time_s', 'distance_km']])
+        pairs = pd.concat([pairs[pairs['cached']], new_routes], ignore_index=True)
+    conn_cache.close()
+
+    pairs['time_s'] = pd.to_numeric(pairs['time_s'], errors='coerce')
+    return pairs.loc[pairs['time_s'] <= TIME_THRESHOLD_SEC, ['origin_idx', 'candidate_idx', 'time_s']]
+
+def route_offline(origins, candidates):
+    """(origin_idx, candidate_idx, time_s) from one shortest-path tree per candidate."""
+    from road_graph import load_road_graph, snap_to_nodes, station_travel_times
+
+    graph = load_road_graph()
+    origin_nodes = snap_to_nodes(graph, origins['lon'], origins['lat'])
+    candidate_nodes = snap_to_nodes(graph, candidates['lon'], candidates['lat'])
+    print(f"Snapped {(candidate_nodes >= 0).sum()}/{len(candidate_nodes)} candidates to the road graph.")
+    frames = list(station_travel_times(graph, origin_nodes, candidate_nodes, TIME_THRESHOLD_SEC))
+    if not frames:
+        return pd.DataFrame({'origin_idx': [], 'candidate_idx': [], 'time_s': []})
+    routes = pd.concat(frames, ignore_index=True).rename(columns={'station_idx': 'candidate_idx'})
+    return routes[['origin_idx', 'candidate_idx', 'time_s']]
+
+def load_baseline():
+    """
+    Best static time per cell today (cell_topk slot 0) and the cells the matrix routed
+    (None = every cell). Routed cells missing from cell_topk have no station within
+    30 minutes; cells the matrix never routed (ORIGIN_LIMIT) have no baseline.
+    """
+    if not os.path.exists(MATRIX_DB):
+        print("  [WARN] travel_matrix.db not found; every cell counts as unserved.")
+        return pd.Series(dtype=float), None
+    con = duckdb.connect(MATRIX_DB, read_only=True)
+    exists = con.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = 'cell_topk'").fetchone()[0]
+    df = con.execute("SELECT cell_id, times_min[1] as base_min FROM cell_topk WHERE slot = 0").df() if exists else None
+    con.close()
+    if df is None:
+        print("  [WARN] cell_topk not found; every cell counts as unserved.")
+        return pd.Series(dtype=float), None
+    # The matrix routes the same first ORIGIN_LIMIT origins (calculate_travel_matrix.py)
+    routed = None if ORIGIN_LIMIT is None else pd.Index(load_origins(ORIGIN_LIMIT)['cell_id'].unique())
+    return df.set_index('cell_id')['base_min'], routed
+
+def score_columns():
+    """The candidate_scores columns a run can rank by: the catchment columns, then the deltas."""
+    columns = []
+    for band in TIME_BANDS_MIN:
+        columns += [f"{name}_{band}min" for name in (*EXTENSIVE_FEATURES, *INTENSIVE_FEATURES)] + [f"cells_{band}min"]
+    return columns + [f"new_pop_{band}min" for band in TIME_BANDS_MIN] + ['cells_improved', 'access_gain']
+
+def score_candidates(candidates, rank_by=RANK_BY):
+    """Scores and ranks a frame of candidate sites (candidate_id, lat, lon)."""
+    columns = score_columns()
+    if rank_by not in columns:
+        raise ValueError(f"Unknown rank column {rank_by}; choose one of: {', '.join(columns)}")
+    candidates = candidates.reset_index(drop=True)
+    candidates['target_key'] = [origin_key(lon, lat) for lon, lat in zip(candidates['lon'], candidates['lat'])]
+
+    print("--- 1. Loading Origins & Baseline ---")
+    origins = attach_snaps(load_origins(), 'origin', 'origin_key')
+    cells_by_key = origins.groupby('origin_key')['cell_id'].unique()
+    unique_origins = origins.drop_duplicates(subset=['origin_key']).reset_index(drop=True)
+    baseline, routed = load_baseline()
+    print(f"{len(candidates)} candidates, {len(unique_origins)} unique origins, {len(baseline)} served cells today.")
+    if routed is not None:
+        print(f"  [WARN] The matrix routed only {len(routed)} cells (ORIGIN_LIMIT = {ORIGIN_LIMIT}); "
+              "accessibility deltas count only those cells.")
+
+    print(f"--- 2. Routing Nearby Origins ({ROUTING_BACKEND}) ---")
+    with track('candidate_scoring', 'routing', rows_in=len(candidates)) as m:
+        routes = route_offline(unique_origins, candidates) if ROUTING_BACKEND == "offline" else route_valhalla(unique_origins, candidates)
+        m['rows_out'] = len(routes)
+
+    # Origins fan out to their cells; a cell takes its best origin
+    routes['cell_id'] = unique_origins['origin_key'].map(cells_by_key).to_numpy()[routes['origin_idx'].to_numpy(dtype=np.int64)]
+    routes = routes.explode('cell_id')
+    edges = routes.groupby(['cell_id', 'candidate_idx'], as_index=False)['time_s'].min()
+    edges['time_min'] = edges['time_s'] / 60.0
+    edges['station_id'] = candidates['candidate_id'].to_numpy()[edges['candidate_idx'].to_numpy(dtype=np.int64)]
+    print(f"{len(edges):,} cell edges within {TIME_THRESHOLD_MIN:.0f} minutes.")
+
+    print("--- 3. Catchment & Accessibility Deltas ---")
+    con_osm = duckdb.connect(OSM_DB, read_only=True)
+    features = load_cell_features(con_osm, edges['cell_id'].unique())
+    con_osm.close()
+
+    scores = candidates[['candidate_id', 'lat', 'lon']].copy()
+    if not edges.empty:
+        catchment = catchment_table(edges[['cell_id', 'station_id', 'time_min']], features)
+        scores = scores.merge(catchment.rename(columns={'station_id': 'candidate_id'}), on='candidate_id', how='left')
+
+    pop = features[WEIGHT_FEATURE].reindex(edges['cell_id']).fillna(0).to_numpy()
+    base = baseline.reindex(edges['cell_id']).fillna(np.inf).to_numpy()
+    new = edges['time_min'].to_numpy()
+    # Cells without a baseline are left out of the deltas rather than counted as unserved
+    known = np.ones(len(edges), dtype=bool) if routed is None else edges['cell_id'].isin(routed).to_numpy()
+    deltas = pd.DataFrame({'candidate_id': edges['station_id']})
+    for band in TIME_BANDS_MIN:
+        deltas[f"new_pop_{band}min"] = np.where(known & (new <= band) & (base > band), pop, 0.0)
+    deltas['cells_improved'] = (known & (new < base)).astype(np.int32)
+    deltas['access_gain'] = np.where(known, pop * np.clip(np.minimum(base, TIME_THRESHOLD_MIN) - np.minimum(new, TIME_THRESHOLD_MIN), 0, None), 0.0)
+    scores = scores.merge(deltas.groupby('candidate_id', as_index=False).sum(), on='candidate_id', how='left')
+    scores = scores.reindex(columns=['candidate_id', 'lat', 'lon'] + columns)
+
+    # Candidates nothing reaches score zero rather than NULL; intensive means stay NULL
+    additive = [c for c in scores.columns[3:] if not c.startswith(tuple(INTENSIVE_FEATURES))]
+    scores[additive] = scores[additive].fillna(0)
+    counts = [c for c in additive if c.startswith('cells_')]
+    scores[counts] = scores[counts].astype(np.int32)
+    scores['rank'] = scores[rank_by].rank(ascending=False, method='min', na_option='bottom').astype(np.int32)
+    return scores.sort_values(['rank', 'candidate_id']).reset_index(drop=True)
+
+def score_candidate_sites(candidates_path, rank_by=RANK_BY):
+    if not os.path.exists(candidates_path) or not os.path.exists(OSM_DB) or not os.path.exists(MOBIE_DB):
+        print(f"Missing input files. Checked:\n{candidates_path}\n{OSM_DB}\n{MOBIE_DB}")
+        return
+
+    candidates = pd.read_csv(candidates_path, dtype={'candidate_id': str})
+    scores = score_candidates(candidates, rank_by)
+
+    print("--- 4. Saving candidate_scores ---")
+    con = duckdb.connect(MOBIE_DB)
+    con.register("scores_df", scores)
+    con.execute("CREATE OR REPLACE TABLE candidate_scores AS SELECT * FROM scores_df")
+    con.close()
+
+    cols = ['rank', 'candidate_id', rank_by] + [c for c in ('new_pop_20min', 'pop_20min', 'cells_improved') if c != rank_by and c in scores]
+    print(f"\nTop {TOP_N} candidates by {rank_by}:")
+    print(scores[cols].head(TOP_N).to_string(index=False))
+    print(f"\nScored {len(scores)} candidates. Table in mobie_data.db: candidate_scores")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score hypothetical charger sites against the current network.")
+    parser.add_argument('candidates', help="CSV with candidate_id, lat, lon")
+    parser.add_argument('--rank-by', default=RANK_BY)
+    args = parser.parse_args()
+    with track('candidate_scoring'):
+        score_candidate_sites(args.candidates, args.rank_by)
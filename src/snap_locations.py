@@ -0,0 +1,226 @@
+"""
+Valhalla Location Snapping (Pre-processing for the Travel Matrix)
+
+Calls Valhalla's /locate once for every unique origin in `cell_origins` and
+every station in `stations`, and caches the correlated edge in
+`snapped_locations` (data/routing_cache.db).
+
+The matrix stage then sends pre-correlated locations (snapped lat/lon plus a
+tight radius and heading hint) so the server does not re-snap the same
+points for every request, and skips points marked as unroutable up front.
+"""
+
+import duckdb
+import requests
+import json
+import pandas as pd
+import numpy as np
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OSM_DB = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+MOBIE_DB = os.path.join(BASE_DIR, "../data/mobie_data.db")
+ROUTING_DB = os.path.join(BASE_DIR, "../data/routing_cache.db")
+VALHALLA_LOCATE_URL = "http://localhost:8002/locate"
+
+LOCATE_BATCH_SIZE = 100
+# A point is unroutable if it snaps further than this or onto a disconnected island
+MAX_SNAP_DISTANCE_M = 1000.0
+MIN_REACHABILITY = 50
+
+# Hints sent with pre-correlated locations in matrix requests
+SNAP_RADIUS_M = 10
+HEADING_TOLERANCE_DEG = 60
+
+SNAPPED_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS snapped_locations (
+        kind VARCHAR,
+        loc_id VARCHAR,
+        lon DOUBLE,
+        lat DOUBLE,
+        snap_lon DOUBLE,
+        snap_lat DOUBLE,
+        way_id BIGINT,
+        side_of_street VARCHAR,
+        percent_along DOUBLE,
+        heading DOUBLE,
+        snap_dist_m DOUBLE,
+        reach INTEGER,
+        routable BOOLEAN,
+        correlation VARCHAR
+    )
+"""
+
+def origin_key(lon, lat):
+    # Entry points on a shared cell boundary appear in both cells; key them by position
+    return f"{lon:.6f},{lat:.6f}"
+
+def parse_locate_result(result):
+    """
+    Turns one element of a /locate response into a snapped_locations record
+    (without kind/loc_id). The first correlated edge is Valhalla's best candidate.
+    """
+    edges = result.get('edges') or []
+    if not edges:
+        return {'snap_lon': None, 'snap_lat': None, 'way_id': None, 'side_of_street': None,
+                'percent_along': None, 'heading': None, 'snap_dist_m': None, 'reach': 0,
+                'routable': False, 'correlation': None}
+
+    best = edges[0]
+    reach = min(best.get('outbound_reach', MIN_REACHABILITY), best.get('inbound_reach', MIN_REACHABILITY))
+    dist = best.get('distance')
+    routable = reach >= MIN_REACHABILITY and (dist is None or dist <= MAX_SNAP_DISTANCE_M)
+
+    return {
+        'snap_lon': best.get('correlated_lon'),
+        'snap_lat': best.get('correlated_lat'),
+        'way_id': best.get('way_id'),
+        'side_of_street': best.get('side_of_street'),
+        'percent_along': best.get('percent_along'),
+        'heading': best.get('heading'),
+        'snap_dist_m': dist,
+        'reach': int(reach),
+        'routable': bool(routable),
+        'correlation': json.dumps({k: best.get(k) for k in ('edge_id', 'way_id', 'percent_along', 'side_of_street', 'linear_reference') if k in best})
+    }
+
+def locate_batch(session, points):
+    payload = {
+        "locations": [{"lat": p['lat'], "lon": p['lon']} for p in points],
+        "costing": "auto",
+        "verbose": True
+    }
+    response = session.post(VALHALLA_LOCATE_URL, json=payload, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+def load_snapped(kind):
+    """Returns cached snaps for 'origin' or 'station', or None if the cache is not built."""
+    if not os.path.exists(ROUTING_DB):
+        return None
+    con = duckdb.connect(ROUTING_DB, read_only=True)
+    try:
+        exists = con.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = 'snapped_locations'").fetchone()[0]
+        if exists == 0:
+            return None
+        return con.execute("SELECT * FROM snapped_locations WHERE kind = ?", [kind]).df()
+    finally:
+        con.close()
+
+def attach_snaps(df, kind, key_col):
+    """
+    Merges cached snaps onto an origins/chargers frame and drops points known to be
+    unroutable. Points that were never located keep their raw coordinates.
+    """
+    snaps = load_snapped(kind)
+    if snaps is None or snaps.empty:
+        return df.assign(snap_lon=np.nan, snap_lat=np.nan, heading=np.nan, routable=True)
+
+    snaps = snaps[['loc_id', 'snap_lon', 'snap_lat', 'heading', 'routable']]
+    df = df.merge(snaps, left_on=key_col, right_on='loc_id', how='left').drop(columns=['loc_id'])
+    df['routable'] = df['routable'].fillna(True).astype(bool)
+    dropped = (~df['routable']).sum()
+    if dropped:
+        print(f"Skipping {dropped} unroutable {kind}s flagged by snap_locations.")
+    return df[df['routable']].reset_index(drop=True)
+
+def valhalla_location(row):
+    """Builds a Valhalla location, pre-correlated if a snap is cached for the row."""
+    if pd.isna(row.get('snap_lat')):
+        return {"lat": row['lat'], "lon": row['lon']}
+
+    loc = {
+        "lat": row['snap_lat'],
+        "lon": row['snap_lon'],
+        "radius": SNAP_RADIUS_M,
+        # Reachability was checked once during snapping
+        "minimum_reachability": 0
+    }
+    if not pd.isna(row.get('heading')):
+        loc["heading"] = int(round(row['heading'])) % 360
+        loc["heading_tolerance"] = HEADING_TOLERANCE_DEG
+    return loc
+
+def snap_locations():
+    if not os.path.exists(OSM_DB) or not os.path.exists(MOBIE_DB):
+        print(f"Missing required databases. Checked:\n{OSM_DB}\n{MOBIE_DB}")
+        return
+
+    print("--- 1. Loading Unique Origins & Stations ---")
+    conn_osm = duckdb.connect(OSM_DB, read_only=True)
+    origins = conn_osm.execute("SELECT DISTINCT lon, lat FROM cell_origins WHERE lon IS NOT NULL AND lat IS NOT NULL").df()
+    conn_osm.close()
+    origins['loc_id'] = [origin_key(lon, lat) for lon, lat in zip(origins['lon'], origins['lat'])]
+    origins = origins.drop_duplicates(subset=['loc_id'])
+    origins['kind'] = 'origin'
+
+    conn_mobie = duckdb.connect(MOBIE_DB, read_only=True)
+    stations = conn_mobie.execute("SELECT ID as loc_id, LONGITUDE as lon, LATITUDE as lat FROM stations").df()
+    conn_mobie.close()
+    stations['kind'] = 'station'
+
+    points = pd.concat([origins, stations], ignore_index=True)
+    print(f"Loaded {len(origins)} unique origins and {len(stations)} stations.")
+
+    print("--- 2. Checking Snap Cache ---")
+    con = duckdb.connect(ROUTING_DB)
+    con.execute(SNAPPED_SCHEMA)
+    # Stations that moved are re-snapped; their stale rows are replaced below
+    cached = con.execute("SELECT kind, loc_id, lon, lat FROM snapped_locations").df()
+    if not cached.empty:
+        merged = points.merge(cached, on=['kind', 'loc_id', 'lon', 'lat'], how='left', indicator=True)
+        points = merged[merged['_merge'] == 'left_only'].drop(columns=['_merge'])
+    print(f"{len(points)} points need snapping.")
+
+    if points.empty:
+        con.close()
+        print("Snap cache is up to date.")
+        return
+
+    print("--- 3. Calling /locate ---")
+    session = requests.Session()
+    records = []
+    failed = 0
+    rows = points.to_dict('records')
+    for i in range(0, len(rows), LOCATE_BATCH_SIZE):
+        batch = rows[i : i + LOCATE_BATCH_SIZE]
+        try:
+            results = locate_batch(session, batch)
+        except Exception as e:
+            # Leave the batch uncached so the next run retries it
+            print(f"  [ERROR] Batch {i}-{i+len(batch)}: {e}")
+            failed += len(batch)
+            continue
+
+        for point, result in zip(batch, results):
+            rec = {'kind': point['kind'], 'loc_id': point['loc_id'], 'lon': point['lon'], 'lat': point['lat']}
+            rec.update(parse_locate_result(result))
+            records.append(rec)
+
+        if (i // LOCATE_BATCH_SIZE) % 50 == 0:
+            print(f"  Located {i + len(batch)}/{len(rows)}")
+
+    print("--- 4. Saving to routing_cache.db ---")
+    if records:
+        snap_df = pd.DataFrame(records)
+        con.execute("DELETE FROM snapped_locations WHERE (kind, loc_id) IN (SELECT kind, loc_id FROM snap_df)")
+        con.execute("""
+            INSERT INTO snapped_locations
+            SELECT kind, loc_id, lon, lat, snap_lon, snap_lat, way_id, side_of_street, percent_along,
+                   heading, snap_dist_m, reach, routable, correlation
+            FROM snap_df
+        """)
+
+    summary = con.execute("""
+        SELECT kind, count(*) as total, sum(CASE WHEN routable THEN 0 ELSE 1 END) as unroutable
+        FROM snapped_locations GROUP BY kind ORDER BY kind
+    """).df()
+    con.close()
+
+    print(summary.to_string(index=False))
+    if failed:
+        print(f"{failed} points failed and will be retried on the next run.")
+    print("Done. Table in routing_cache.db: snapped_locations")
+
+if __name__ == "__main__":
+    snap_locations()
@@ -0,0 +1,157 @@
+"""
+Spatial Lags (k-ring neighbourhood features on the 1km grid)
+
+Cell features only describe their own 1km cell. This engine rasterizes any
+cell feature table onto a dense (rows x cols x features) array indexed by
+x_3035/y_3035 and derives neighbourhood features by convolution, for several
+radii at once:
+
+- sum:    total over the k-ring (every cell within k cells, Chebyshev distance, self included)
+- mean:   mean over the cells of the k-ring that have a value (sea/missing cells excluded)
+- decay:  sum weighted by exp(-d / k) over the disc of radius k cells (d in cells)
+
+Sums and means use ndimage.uniform_filter (separable running sums, cost
+independent of k); decay kernels use ndimage.convolve, or FFT convolution
+once the kernel is large. Results are named {feature}_lag{k},
+{feature}_mean_lag{k} and {feature}_decay_lag{k}.
+
+Run as a script to materialize LAG_FEATURES for every grid_spine cell into
+`cell_lags` (osm_analysis.db).
+"""
+
+import duckdb
+import numpy as np
+import pandas as pd
+import os
+from scipy import ndimage, signal
+from grid_logic import CELL_SIZE_M
+from run_metrics import track
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "../data/osm_analysis.db")
+
+LAG_RADII = [1, 2, 5, 10]
+# Kernels with at least this many cells go through the FFT
+FFT_MIN_KERNEL_CELLS = 15 * 15
+
+# output name -> (table, SQL expression, stats)
+LAG_FEATURES = {
+    'pop': ('census_stats', 'pop_total', ['sum', 'decay']),
+    'households': ('census_stats', 'households_total', ['sum']),
+    'road_len': ('road_stats', 'total_road_len', ['sum', 'mean']),
+    'poi': ('poi_stats', None, ['sum', 'decay']), # sum of all poi_* columns
+    'tourism_pressure': ('tourism', 'tourism_pressure', ['mean']),
+}
+
+def lag_name(feature, stat, k):
+    return f"{feature}_lag{k}" if stat == 'sum' else f"{feature}_{stat}_lag{k}"
+
+def rasterize(x_3035, y_3035, values):
+    """
+    Scatters (n_rows x n_features) values onto the dense grid spanning the cells'
+    lower-left corners. Returns (grid, present, rows, cols): grid with 0 where a
+    cell has no value, present 1.0 where it has one, and each row's position.
+    """
+    x = np.asarray(x_3035, dtype=float)
+    y = np.asarray(y_3035, dtype=float)
+    values = np.asarray(values, dtype=float).reshape(len(x), -1)
+    cols = ((x - x.min()) // CELL_SIZE_M).astype(np.int64)
+    rows = ((y - y.min()) // CELL_SIZE_M).astype(np.int64)
+
+    shape = (rows.max() + 1, cols.max() + 1, values.shape[1])
+    grid = np.zeros(shape)
+    present = np.zeros(shape)
+    known = ~np.isnan(values)
+    grid[rows, cols] = np.where(known, values, 0.0)
+    present[rows, cols] = known
+    return grid, present, rows, cols
+
+def ring_sum(stack, k):
+    """Sum over the (2k+1)^2 k-ring of every cell, zero outside the grid."""
+    size = 2 * k + 1
+    return ndimage.uniform_filter(stack, size=(size, size, 1), mode='constant', cval=0.0) * (size * size)
+
+def decay_kernel(k):
+    offsets = np.arange(-k, k + 1)
+    d = np.hypot(*np.meshgrid(offsets, offsets))
+    return np.where(d <= k, np.exp(-d / k), 0.0)
+
+def convolve(stack, kernel):
+    """Convolves every feature layer of stack with kernel, zero outside the grid."""
+    if kernel.size < FFT_MIN_KERNEL_CELLS:
+        return ndimage.convolve(stack, kernel[:, :, None], mode='constant', cval=0.0)
+    out = signal.fftconvolve(stack, kernel[:, :, None], mode='same', axes=(0, 1))
+    # FFT round-off leaves ~1e-12 noise where the exact result is 0
+    scale = np.abs(stack).max(axis=(0, 1)) * kernel.sum()
+    out[np.abs(out) < 1e-9 * scale] = 0.0
+    return out
+
+def spatial_lags(x_3035, y_3035, features, radii=LAG_RADII, stats=('sum',)):
+    """
+    Lagged features for every row of features (DataFrame aligned with x/y).
+    stats: any of 'sum', 'mean', 'decay', or a dict column -> stats.
+    Returns a DataFrame with the same index and one column per feature, stat and radius.
+    """
+    grid, present, rows, cols = rasterize(x_3035, y_3035, features.to_numpy(dtype=float))
+    stats_of = stats if isinstance(stats, dict) else {c: stats for c in features.columns}
+    needed = {s for c in features.columns for s in stats_of[c]}
+
+    out = {}
+    for k in radii:
+        results = {}
+        if 'sum' in needed or 'mean' in needed:
+            results['sum'] = ring_sum(grid, k)[rows, cols]
+        if 'mean' in needed:
+            counts = ring_sum(present, k)[rows, cols]
+            results['mean'] = np.divide(results['sum'], counts, out=np.full(counts.shape, np.nan), where=counts > 0.5)
+        if 'decay' in needed:
+            results['decay'] = convolve(grid, decay_kernel(k))[rows, cols]
+        for j, col in enumerate(features.columns):
+            for stat in stats_of[col]:
+                out[lag_name(col, stat, k)] = results[stat][:, j]
+    return pd.DataFrame(out, index=features.index)
+
+def table_exists(con, table_name):
+    return con.execute(f"SELECT count(*) FROM information_schema.tables WHERE table_name = '{table_name}'").fetchone()[0] > 0
+
+def build_cell_lags():
+    if not os.path.exists(DB_PATH):
+        print("Missing input files.")
+        return
+
+    print("--- 1. Loading Grid & Cell Features ---")
+    con = duckdb.connect(DB_PATH)
+    cells = con.execute("SELECT cell_id, x_3035, y_3035 FROM grid_spine").df().set_index('cell_id')
+    features = pd.DataFrame(index=cells.index)
+    stats = {}
+    for name, (table, column, feature_stats) in LAG_FEATURES.items():
+        if not table_exists(con, table):
+            print(f"  [WARN] Table {table} not found; skipping {name}.")
+            continue
+        if column is None:
+            cols = con.execute(f"DESCRIBE {table}").df()['column_name']
+            expr = ' + '.join(f'COALESCE("{c}", 0)' for c in cols if c.startswith('poi_')) or '0'
+        else:
+            expr = column
+        df = con.execute(f"SELECT cell_id, avg({expr}) as v FROM {table} GROUP BY 1").df()
+        features[name] = df.set_index('cell_id')['v'].reindex(features.index)
+        stats[name] = feature_stats
+    if features.empty:
+        con.close()
+        print("No feature tables found.")
+        return
+    print(f"{len(cells)} cells, features: {', '.join(features.columns)}")
+
+    print(f"--- 2. Convolving (radii {LAG_RADII}) ---")
+    lags = spatial_lags(cells['x_3035'], cells['y_3035'], features, LAG_RADII, stats)
+    lags = lags.astype(np.float32).reset_index()
+
+    print("--- 3. Saving cell_lags ---")
+    con.register("lags_df", lags)
+    con.execute("CREATE OR REPLACE TABLE cell_lags AS SELECT * FROM lags_df ORDER BY cell_id")
+    con.close()
+    print(f"Saved {lags.shape[1] - 1} lag columns for {len(lags)} cells. Table in osm_analysis.db: cell_lags")
+
+if __name__ == "__main__":
+    with track('cell_lags'):
+        build_cell_lags()
@@ -0,0 +1,80 @@
+import pandas as pd
+import numpy as np
+
+# TIPO_TARIFA -> (column, reduction over a profile's components)
+TARIFF_COMPONENTS = {
+    'FLAT': ('p_fixed', 'sum'),
+    'ENERGY': ('p_energy', 'max'),
+    'TIME': ('p_time', 'max'),
+    'PARKING_TIME': ('p_parking', 'max'),
+}
+
+def parse_prices(values):
+    """Vectorized price parser: "€ 0.261 /charge" -> 0.261, anything else -> 0.0."""
+    extracted = pd.Series(values, dtype=object).astype(str).str.extract(r'€\s+([0-9.]+)', expand=False)
+    return extracted.astype(float).fillna(0.0).to_numpy()
+
+def build_tariffs(components, station_power):
+    """
+    Pivots tariff component rows (ID, TIPO_TARIFARIO, TIPO_TARIFA, price_val) into
+    one row per (ID, TIPO_TARIFARIO) with p_fixed, p_energy, p_time, p_parking,
+    has_parking and the station's power_kw. Stations missing from station_power
+    (Series indexed by ID) are dropped.
+    """
+    components = components[components['ID'].isin(station_power.index)]
+    profiles = components.groupby(['ID', 'TIPO_TARIFARIO']).size().index
+
+    tariffs = pd.DataFrame(index=profiles)
+    for kind, (col, how) in TARIFF_COMPONENTS.items():
+        part = components[components['TIPO_TARIFA'] == kind]
+        tariffs[col] = part.groupby(['ID', 'TIPO_TARIFARIO'])['price_val'].agg(how).reindex(profiles).fillna(0.0)
+    has_parking = components[components['TIPO_TARIFA'] == 'PARKING_TIME'].groupby(['ID', 'TIPO_TARIFARIO']).size()
+    tariffs['has_parking'] = has_parking.reindex(profiles).notna().astype(int)
+    tariffs['power_kw'] = station_power.reindex(profiles.get_level_values('ID')).to_numpy()
+    return tariffs
+
+def _cost(p, delivered, duration_min, rate):
+    # p: tariff component arrays, broadcastable against the session arrays
+    with np.errstate(divide='ignore', invalid='ignore'):
+        idle_min = np.nan_to_num(np.clip(duration_min - delivered / rate * 60.0, 0.0, None))
+    return p['p_fixed'] + (delivered * p['p_energy']) + (duration_min * p['p_time']) + (idle_min * p['p_parking'])
+
+def session_cost(tariffs, kwh=np.inf, duration_min=60.0, power_kw=np.inf):
+    """
+    Cost of every charging profile at every tariff, as one broadcast.
+
+    kwh, duration_min, power_kw: scalars or arrays of n_profiles (requested
+    energy, plug-in time, vehicle power limit). Energy delivered is capped by
+    min(vehicle, station power) over the duration; TIME is charged for the whole
+    session and PARKING_TIME for plugged-in minutes after charging ends.
+    Returns (cost, delivered_kwh), both n_tariffs x n_profiles.
+    """
+    kwh, duration_min, power_kw = (np.atleast_1d(np.asarray(v, dtype=float))[None, :] for v in (kwh, duration_min, power_kw))
+    p = {c: tariffs[c].to_numpy(dtype=float)[:, None] for c in tariffs.columns}
+
+    rate = np.minimum(power_kw, p['power_kw'])
+    delivered = np.minimum(kwh, rate * (duration_min / 60.0))
+    return _cost(p, delivered, duration_min, rate), delivered
+
+def effective_kwh_price(tariffs, kwh=np.inf, duration_min=60.0, power_kw=np.inf):
+    """Cost per delivered kWh (0 where nothing can be delivered), n_tariffs x n_profiles."""
+    cost, delivered = session_cost(tariffs, kwh, duration_min, power_kw)
+    return np.divide(cost, delivered, out=np.zeros_like(cost), where=delivered > 0)
+
+def price_sessions(tariffs, station_ids, kwh, duration_min, tariff_type='REGULAR'):
+    """
+    Prices real sessions (metered kWh, plug-in minutes) under their station's
+    tariff_type profile. Returns costs aligned to station_ids; NaN where the
+    station has no such profile.
+    """
+    by_station = tariffs.xs(tariff_type, level='TIPO_TARIFARIO')
+    idx = by_station.index.get_indexer(pd.Index(station_ids))
+    known = idx >= 0
+
+    p = {c: by_station[c].to_numpy(dtype=float)[idx[known]] for c in by_station.columns}
+    kwh = np.asarray(kwh, dtype=float)[known]
+    duration_min = np.asarray(duration_min, dtype=float)[known]
+
+    out = np.full(len(idx), np.nan)
+    out[known] = _cost(p, kwh, duration_min, p['power_kw'])
+    return out